@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# Minimum time between two emails for the same breach episode
+ALERT_COOLDOWN_SECONDS = float(os.getenv("ALERT_COOLDOWN_SECONDS", "900"))
+# Distances (meters from the safe zone center) that trigger an email as soon as they are crossed
+ALERT_ESCALATION_THRESHOLDS_METERS = [
+    float(x) for x in os.getenv("ALERT_ESCALATION_THRESHOLDS_METERS", "500,1000,2000,5000").split(",") if x.strip()
+]
+# A patient without any alert for this long is considered back inside; the next alert starts a new episode
+ALERT_EPISODE_GAP_SECONDS = float(os.getenv("ALERT_EPISODE_GAP_SECONDS", "1800"))
+ALERT_DEDUP_SNAPSHOT_PATH = os.getenv("ALERT_DEDUP_SNAPSHOT_PATH", "alert_dedup_state.json")
+ALERT_DEDUP_SNAPSHOT_SECONDS = float(os.getenv("ALERT_DEDUP_SNAPSHOT_SECONDS", "30"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+
+class AlertDeduplicator:
+    """
+    Per-patient gate in front of the alert emails.
+
+    The first alert of a breach episode always goes out. After that a patient
+    who stays outside the zone is only emailed again when the distance crosses a
+    higher escalation threshold or when the cool-down has passed. State is one
+    small list per patient: [last_seen_at, last_sent_at, escalation_level],
+    kept in memory and snapshotted to a JSON file.
+
+    All times are the alerts' `event_ts`, not the time they are processed, so a
+    replayed backlog splits into the same episodes as it did live.
+    """
+
+    def __init__(
+        self,
+        cooldown_seconds=ALERT_COOLDOWN_SECONDS,
+        thresholds_meters=ALERT_ESCALATION_THRESHOLDS_METERS,
+        episode_gap_seconds=ALERT_EPISODE_GAP_SECONDS,
+        snapshot_path=ALERT_DEDUP_SNAPSHOT_PATH,
+        snapshot_seconds=ALERT_DEDUP_SNAPSHOT_SECONDS,
+    ):
+        self.cooldown_seconds = cooldown_seconds
+        self.thresholds_meters = sorted(thresholds_meters)
+        self.episode_gap_seconds = episode_gap_seconds
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self.suppressed = 0
+        self._state = {}
+        self._dirty = False
+        # Newest event time seen, the clock finished episodes are pruned by
+        self._latest_event = float("-inf")
+        self._last_snapshot = time.time()
+        self._lock = threading.Lock()
+        self.load()
+
+    def escalation_level(self, distance_meters):
+        try:
+            distance_meters = float(distance_meters)
+        except (TypeError, ValueError):
+            return 0
+        return sum(1 for threshold in self.thresholds_meters if distance_meters >= threshold)
+
+    @staticmethod
+    def event_time(alert, default=None):
+        """The alert's `event_ts` as epoch seconds; `default` (or now) when it is missing or unreadable."""
+        event_ts = alert.get("event_ts")
+        try:
+            if isinstance(event_ts, (int, float)):
+                return float(event_ts)
+            event = datetime.fromisoformat(str(event_ts).replace("Z", "+00:00"))
+            if event.tzinfo is None:
+                event = event.replace(tzinfo=timezone.utc)
+            return event.timestamp()
+        except (TypeError, ValueError):
+            return time.time() if default is None else default
+
+    def admit(self, alert, now=None):
+        """
+        Decide whether an alert should be emailed.
+        Returns (send, reason, undo). Admitted alerts are recorded as sent right
+        away so later alerts for the same patient are held back; call `restore`
+        with `undo` if the delivery fails. `now` only stands in for a missing event_ts.
+        """
+        event = self.event_time(alert, now)
+        patient_id = str(alert["patient_id"])
+        level = self.escalation_level(alert.get("distance_meters"))
+
+        with self._lock:
+            previous = self._state.get(patient_id)
+            if previous is None or event - previous[0] > self.episode_gap_seconds:
+                send, reason = True, "first alert"
+            elif level > previous[2]:
+                send, reason = True, "escalation"
+            elif event - previous[1] >= self.cooldown_seconds:
+                send, reason = True, "reminder"
+            else:
+                send, reason = False, "suppressed"
+
+            # An out-of-order alert never moves the episode back in time
+            last_seen = event if previous is None else max(previous[0], event)
+            if send:
+                entry = [last_seen, event if previous is None else max(previous[1], event), level]
+            else:
+                entry = [last_seen, previous[1], previous[2]]
+                self.suppressed += 1
+            self._state[patient_id] = entry
+            self._latest_event = max(self._latest_event, event)
+            self._dirty = True
+
+        self.maybe_snapshot()
+        return send, reason, (previous, entry)
+
+    def restore(self, alert, undo):
+        """
+        Undo `admit` for an alert that could not be delivered, unless a newer alert
+        for the patient has been admitted for sending since: the caretaker then got
+        the newer one, and rewinding would send it again when the batch is replayed.
+        """
+        previous, entry = undo
+        patient_id = str(alert["patient_id"])
+        with self._lock:
+            current = self._state.get(patient_id)
+            if current is None or current[1:] != entry[1:]:
+                return
+            if previous is None:
+                self._state.pop(patient_id)
+            else:
+                self._state[patient_id] = previous
+            self._dirty = True
+
+    def load(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path) as fh:
+                self._state = json.load(fh)
+            self._latest_event = max((entry[0] for entry in self._state.values()), default=float("-inf"))
+            print(f"Loaded alert dedup state for {len(self._state)} patients")
+        except (OSError, ValueError) as e:
+            print("Couldn't load alert dedup state, starting empty:", e)
+
+    def snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            # Finished episodes carry no information anymore
+            cutoff = self._latest_event - self.episode_gap_seconds
+            self._state = {patient_id: entry for patient_id, entry in self._state.items() if entry[0] >= cutoff}
+            state = dict(self._state)
+            self._dirty = False
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(state, fh, separators=(",", ":"))
+        os.replace(tmp_path, self.snapshot_path)
+
+    def maybe_snapshot(self, now=None):
+        now = time.time() if now is None else now
+        if self._dirty and now - self._last_snapshot >= self.snapshot_seconds:
+            self._last_snapshot = now
+            self.snapshot()
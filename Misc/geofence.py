@@ -0,0 +1,264 @@
+import json
+
+import numpy as np
+
+
+# Mean Earth radius used by BigQuery geography functions. ST_DISTANCE (use_spheroid=FALSE,
+# the only supported mode, used by the st_distance_meters dbt macro) measures great-circle
+# distance on a sphere of this radius, which is what haversine_meters computes. The two
+# differ only by floating point rounding: against an S2-style chord-angle computation the
+# difference stays below ST_DISTANCE_TOLERANCE_METERS for any pair of points
+# (see geofence_benchmark.py, which checks it on the replayed dataset).
+EARTH_RADIUS_METERS = 6371008.8
+ST_DISTANCE_TOLERANCE_METERS = 1e-3
+
+# Grid cell size of GridIndex, about 1.1 km of latitude
+GRID_CELL_DEGREES = 0.01
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between arrays (or scalars) of points given in degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def point_in_polygon(lats, longs, polygon):
+    """
+    Ray casting test of many points against one polygon given as an (n, 2) array of
+    (lat, long) vertices. Edges are straight in lat/long, which is accurate for
+    neighbourhood-sized zones that don't cross the antimeridian.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    longs = np.asarray(longs, dtype=np.float64)
+    polygon = np.asarray(polygon, dtype=np.float64)
+    inside = np.zeros(lats.shape, dtype=bool)
+    y1, x1 = polygon[:, 0], polygon[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+    for i in range(len(polygon)):
+        crosses = (y1[i] > lats) != (y2[i] > lats)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = x1[i] + (lats - y1[i]) * (x2[i] - x1[i]) / (y2[i] - y1[i])
+        inside ^= crosses & (longs < x_at)
+    return inside
+
+
+def circle_bounds(center_lats, center_longs, radii_meters):
+    """Bounding boxes (min_lat, min_long, max_lat, max_long) of circles given in meters."""
+    center_lats = np.asarray(center_lats, dtype=np.float64)
+    center_longs = np.asarray(center_longs, dtype=np.float64)
+    dlat = np.degrees(np.asarray(radii_meters, dtype=np.float64) / EARTH_RADIUS_METERS)
+    dlong = dlat / np.maximum(np.cos(np.radians(center_lats)), 1e-6)
+    return center_lats - dlat, center_longs - dlong, center_lats + dlat, center_longs + dlong
+
+
+class GridIndex:
+    """
+    Uniform lat/long grid over zone bounding boxes, stored CSR-style (sorted cell
+    keys, offsets, zone ids) so candidate zones of a whole batch of points are
+    found with array operations instead of testing every zone.
+    """
+
+    def __init__(self, min_lats, min_longs, max_lats, max_longs, cell_degrees=GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.columns = int(np.ceil(360.0 / cell_degrees)) + 1
+
+        row0, col0 = self._cells(min_lats, min_longs)
+        row1, col1 = self._cells(max_lats, max_longs)
+        keys, zone_ids = [], []
+        for zone_id in range(len(row0)):
+            rows = np.arange(row0[zone_id], row1[zone_id] + 1)
+            cols = np.arange(col0[zone_id], col1[zone_id] + 1)
+            cell_keys = (rows[:, None] * self.columns + cols[None, :]).ravel()
+            keys.append(cell_keys)
+            zone_ids.append(np.full(len(cell_keys), zone_id, dtype=np.int64))
+
+        keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+        zone_ids = np.concatenate(zone_ids) if zone_ids else np.zeros(0, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        keys, self.zone_ids = keys[order], zone_ids[order]
+        self.cell_keys, starts = np.unique(keys, return_index=True)
+        self.offsets = np.append(starts, len(keys))
+
+    def _cells(self, lats, longs):
+        rows = np.floor((np.asarray(lats, dtype=np.float64) + 90.0) / self.cell_degrees).astype(np.int64)
+        cols = np.floor((np.asarray(longs, dtype=np.float64) + 180.0) / self.cell_degrees).astype(np.int64)
+        return rows, cols
+
+    def candidates(self, lats, longs):
+        """Return (point_index, zone_id) pairs of every point and every zone whose box shares its cell."""
+        rows, cols = self._cells(lats, longs)
+        keys = rows * self.columns + cols
+        if len(self.cell_keys) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        pos = np.clip(np.searchsorted(self.cell_keys, keys), 0, len(self.cell_keys) - 1)
+        found = self.cell_keys[pos] == keys
+        starts = self.offsets[pos]
+        counts = np.where(found, self.offsets[pos + 1] - starts, 0)
+
+        point_index = np.repeat(np.arange(len(keys)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return point_index, self.zone_ids[np.repeat(starts, counts) + within]
+
+
+class SafeZones:
+    """
+    Safe zones of many patients held as sorted NumPy arrays so a batch of GPS
+    samples is matched to its zones and evaluated in one vectorized pass.
+
+    A zone is a circle (center + radius) or, when the record has a `safe_polygon`
+    of [lat, long] vertices, a polygon; the polygon's center is its vertex mean
+    and is what distance_meters is measured from.
+    """
+
+    def __init__(self, patient_ids, center_lats, center_longs, radii_meters, polygons=None):
+        order = np.argsort(np.asarray(patient_ids, dtype=np.int64), kind="stable")
+        self.patient_ids = np.asarray(patient_ids, dtype=np.int64)[order]
+        self.center_lats = np.asarray(center_lats, dtype=np.float64)[order]
+        self.center_longs = np.asarray(center_longs, dtype=np.float64)[order]
+        self.radii_meters = np.asarray(radii_meters, dtype=np.float64)[order]
+        # zone index -> (n, 2) vertex array
+        polygons = polygons or {}
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        self.polygons = {int(position[i]): np.asarray(polygon, dtype=np.float64) for i, polygon in polygons.items()}
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from dicts with patient_id, safe_center_lat, safe_center_long, safe_radius_meters (or safe_polygon)."""
+        patient_ids, center_lats, center_longs, radii, polygons = [], [], [], [], {}
+        for r in records:
+            polygon = r.get("safe_polygon")
+            if polygon:
+                polygon = np.asarray(polygon, dtype=np.float64)
+                polygons[len(patient_ids)] = polygon
+                center_lat, center_long = polygon.mean(axis=0)
+                radius = np.nan
+            elif r.get("safe_center_lat") is not None and r.get("safe_center_long") is not None and r.get("safe_radius_meters") is not None:
+                center_lat, center_long, radius = r["safe_center_lat"], r["safe_center_long"], r["safe_radius_meters"]
+            else:
+                continue
+            patient_ids.append(int(r["patient_id"]))
+            center_lats.append(float(center_lat))
+            center_longs.append(float(center_long))
+            radii.append(float(radius))
+        return cls(patient_ids, center_lats, center_longs, radii, polygons)
+
+    @classmethod
+    def from_json_file(cls, path):
+        """Load the Datasets/safe_zones.json format (center_lat, center_long, radius_meters or polygon)."""
+        with open(path) as fh:
+            zones = json.load(fh)
+        return cls.from_records([
+            {
+                "patient_id": zone["patient_id"],
+                "safe_center_lat": zone.get("center_lat"),
+                "safe_center_long": zone.get("center_long"),
+                "safe_radius_meters": zone.get("radius_meters"),
+                "safe_polygon": zone.get("polygon"),
+            }
+            for zone in zones
+        ])
+
+    def lookup(self, patient_ids):
+        """Return (zone_index, known_mask) for an array of patient ids."""
+        patient_ids = np.asarray(patient_ids, dtype=np.int64)
+        if len(self.patient_ids) == 0:
+            return np.zeros(len(patient_ids), dtype=np.int64), np.zeros(len(patient_ids), dtype=bool)
+        index = np.searchsorted(self.patient_ids, patient_ids)
+        index = np.clip(index, 0, len(self.patient_ids) - 1)
+        known = self.patient_ids[index] == patient_ids
+        return index, known
+
+    def evaluate(self, patient_ids, lats, longs):
+        """
+        Distance of every sample to its patient's safe center.
+        Returns (distance_meters, outside_mask, zone_index, known_mask); samples of
+        patients without a zone get NaN distance and are never outside.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        longs = np.asarray(longs, dtype=np.float64)
+        index, known = self.lookup(patient_ids)
+        distance = haversine_meters(self.center_lats[index], self.center_longs[index], lats, longs)
+        distance = np.where(known, distance, np.nan)
+        with np.errstate(invalid="ignore"):
+            outside = known & (distance > self.radii_meters[index])
+
+        if self.polygons:
+            for zone in np.unique(index[known]):
+                polygon = self.polygons.get(int(zone))
+                if polygon is None:
+                    continue
+                selected = np.flatnonzero(known & (index == zone))
+                outside[selected] = ~point_in_polygon(lats[selected], longs[selected], polygon)
+        return distance, outside, index, known
+
+
+class ZoneSet:
+    """
+    Many zones (circles and polygons) that are not tied to a single patient, e.g.
+    care homes or day centers shared by several patients. Points are matched
+    through a GridIndex, so the cost grows with the zones near a point rather than
+    with the total number of zones.
+    """
+
+    def __init__(self, zones, cell_degrees=GRID_CELL_DEGREES):
+        """`zones` are dicts with zone_id and either center_lat/center_long/radius_meters or polygon."""
+        self.zone_ids = [zone["zone_id"] for zone in zones]
+        count = len(zones)
+        self.center_lats = np.zeros(count)
+        self.center_longs = np.zeros(count)
+        self.radii_meters = np.full(count, np.nan)
+        self.polygons = {}
+        min_lats, min_longs, max_lats, max_longs = (np.zeros(count) for _ in range(4))
+
+        for i, zone in enumerate(zones):
+            if zone.get("polygon"):
+                polygon = np.asarray(zone["polygon"], dtype=np.float64)
+                self.polygons[i] = polygon
+                self.center_lats[i], self.center_longs[i] = polygon.mean(axis=0)
+                min_lats[i], min_longs[i] = polygon.min(axis=0)
+                max_lats[i], max_longs[i] = polygon.max(axis=0)
+            else:
+                self.center_lats[i] = float(zone["center_lat"])
+                self.center_longs[i] = float(zone["center_long"])
+                self.radii_meters[i] = float(zone["radius_meters"])
+                bounds = circle_bounds(self.center_lats[i], self.center_longs[i], self.radii_meters[i])
+                min_lats[i], min_longs[i], max_lats[i], max_longs[i] = bounds
+
+        self.index = GridIndex(min_lats, min_longs, max_lats, max_longs, cell_degrees)
+
+    def __len__(self):
+        return len(self.zone_ids)
+
+    def containing(self, lats, longs):
+        """Return (point_index, zone_index) pairs for every zone that contains a point."""
+        lats = np.asarray(lats, dtype=np.float64)
+        longs = np.asarray(longs, dtype=np.float64)
+        point_index, zone_index = self.index.candidates(lats, longs)
+
+        distance = haversine_meters(self.center_lats[zone_index], self.center_longs[zone_index], lats[point_index], longs[point_index])
+        with np.errstate(invalid="ignore"):
+            inside = distance <= self.radii_meters[zone_index]
+
+        if self.polygons:
+            for zone in np.unique(zone_index):
+                polygon = self.polygons.get(int(zone))
+                if polygon is None:
+                    continue
+                selected = np.flatnonzero(zone_index == zone)
+                inside[selected] = point_in_polygon(lats[point_index[selected]], longs[point_index[selected]], polygon)
+        return point_index[inside], zone_index[inside]
+
+    def locate(self, lats, longs):
+        """Index of a zone containing each point, -1 for points outside every zone."""
+        located = np.full(len(np.asarray(lats)), -1, dtype=np.int64)
+        point_index, zone_index = self.containing(lats, longs)
+        located[point_index] = zone_index
+        return located
@@ -0,0 +1,115 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from geofence import EARTH_RADIUS_METERS, ST_DISTANCE_TOLERANCE_METERS, SafeZones, ZoneSet, haversine_meters
+
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Datasets")
+
+
+def chord_angle_distance_meters(lat1, lon1, lat2, lon2):
+    """
+    Reference distance computed the way S2 (BigQuery's geography library) does it:
+    unit vectors, chord length, then the angle of the chord on the sphere.
+    """
+    def unit_vectors(lat, lon):
+        lat, lon = np.radians(lat), np.radians(lon)
+        return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+    chord = np.linalg.norm(unit_vectors(lat1, lon1) - unit_vectors(lat2, lon2), axis=-1)
+    return 2.0 * np.arcsin(np.minimum(1.0, chord / 2.0)) * EARTH_RADIUS_METERS
+
+
+def scaled_vitals(csv_path, rows, seed=0):
+    """Tile the replay dataset up to `rows` samples, jittering GPS by up to ~50 m so copies differ."""
+    with open(csv_path) as fh:
+        columns = fh.readline().strip().split(",")
+    vitals = np.loadtxt(csv_path, delimiter=",", skiprows=1, dtype=np.float64,
+                        usecols=[columns.index(c) for c in ("patient_id", "gps_lat", "gps_long")])
+    vitals = vitals[~np.isnan(vitals).any(axis=1)]
+    rng = np.random.default_rng(seed)
+    picks = np.resize(np.arange(len(vitals)), rows)
+    patient_ids = vitals[picks, 0].astype(np.int64)
+    lats = vitals[picks, 1] + rng.uniform(-4.5e-4, 4.5e-4, rows)
+    longs = vitals[picks, 2] + rng.uniform(-4.5e-4, 4.5e-4, rows)
+    return patient_ids, lats, longs
+
+
+def timed(label, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<42} {elapsed * 1000:9.1f} ms  {rows / elapsed / 1e6:7.2f} M rows/s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the geofence module on the replayed vitals dataset")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--batch-size", type=int, default=500, help="batch size of the streaming evaluator")
+    parser.add_argument("--shared-zones", type=int, default=20_000, help="synthetic shared zones for the grid index")
+    parser.add_argument("--csv", default=os.path.join(DATASETS_DIR, "patient_vitals_gps.csv"))
+    parser.add_argument("--zones", default=os.path.join(DATASETS_DIR, "safe_zones.json"))
+    args = parser.parse_args()
+
+    zones = SafeZones.from_json_file(args.zones)
+    patient_ids, lats, longs = scaled_vitals(args.csv, args.rows)
+    print(f"{args.rows} samples, {len(zones)} patient zones")
+
+    distance, outside, _, _ = timed("per-patient circles, one pass", args.rows, lambda: zones.evaluate(patient_ids, lats, longs))
+
+    def batched():
+        for start in range(0, args.rows, args.batch_size):
+            end = start + args.batch_size
+            zones.evaluate(patient_ids[start:end], lats[start:end], longs[start:end])
+    timed(f"per-patient circles, batches of {args.batch_size}", args.rows, batched)
+
+    def row_by_row(limit=20_000):
+        import math
+        for i in range(limit):
+            z, _ = zones.lookup(patient_ids[i:i + 1])
+            lat1, lon1 = math.radians(zones.center_lats[z[0]]), math.radians(zones.center_longs[z[0]])
+            lat2, lon2 = math.radians(lats[i]), math.radians(longs[i])
+            a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+            2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+    timed("scalar loop (first 20k rows)", 20_000, row_by_row)
+    print(f"{int(outside.sum())} samples outside their safe zone")
+
+    # Tolerance against the S2-style reference
+    index, known = zones.lookup(patient_ids)
+    reference = chord_angle_distance_meters(zones.center_lats[index], zones.center_longs[index], lats, longs)
+    worst = float(np.nanmax(np.abs(reference[known] - distance[known])))
+    print(f"max |haversine - chord angle| = {worst:.2e} m (tolerance {ST_DISTANCE_TOLERANCE_METERS:g} m)")
+    far = haversine_meters(0.0, 0.0, np.linspace(-89, 89, 1001), np.linspace(-179, 179, 1001))
+    far_reference = chord_angle_distance_meters(np.zeros(1001), np.zeros(1001), np.linspace(-89, 89, 1001), np.linspace(-179, 179, 1001))
+    print(f"max difference over antipodal-range pairs = {float(np.max(np.abs(far - far_reference))):.2e} m")
+
+    # Shared zones: grid index against testing every zone
+    rng = np.random.default_rng(1)
+    lat_range = (lats.min() - 0.05, lats.max() + 0.05)
+    long_range = (longs.min() - 0.05, longs.max() + 0.05)
+    shared = ZoneSet([
+        {"zone_id": i, "center_lat": lat, "center_long": long, "radius_meters": radius}
+        for i, (lat, long, radius) in enumerate(zip(
+            rng.uniform(*lat_range, args.shared_zones),
+            rng.uniform(*long_range, args.shared_zones),
+            rng.uniform(50, 400, args.shared_zones),
+        ))
+    ])
+    sample = min(args.rows, 200_000)
+    located = timed(f"grid index, {args.shared_zones} shared zones", sample, lambda: shared.locate(lats[:sample], longs[:sample]))
+
+    brute_rows = min(sample, 2_000)
+    def brute_force():
+        d = haversine_meters(shared.center_lats[None, :], shared.center_longs[None, :], lats[:brute_rows, None], longs[:brute_rows, None])
+        return (d <= shared.radii_meters[None, :]).any(axis=1)
+    inside_any = timed(f"brute force, {args.shared_zones} shared zones", brute_rows, brute_force)
+    assert np.array_equal(inside_any, located[:brute_rows] >= 0), "grid index disagrees with brute force"
+    print("grid index agrees with brute force")
+
+
+if __name__ == "__main__":
+    main()
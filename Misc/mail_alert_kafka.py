@@ -1,18 +1,35 @@
-from confluent_kafka import Consumer, Producer
+from confluent_kafka import Consumer, Producer, TopicPartition
 from google.cloud import bigquery
-import smtplib, ssl, certifi
-import ssl
-from email.message import EmailMessage
-from email.utils import formataddr
 import os
+import sys
 import json
+import threading
+import time
 from dotenv import load_dotenv
+from alert_dedup import AlertDeduplicator
 
 load_dotenv()
 
-GAPP_PASS = os.getenv("GAPP_PASS")
+# The mail service is shared with the backend; it only needs the standard library and certifi
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend", "alzora_agent"))
+from mail_delivery import get_mail_service, new_message
+
 bigquery_client = bigquery.Client()
 
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# Sender and SMTP settings are the MAIL_* variables of backend/alzora_agent/mail_delivery.py
+ALERT_BATCH_SIZE = int(os.getenv("ALERT_BATCH_SIZE", "100"))
+ALERT_POLL_TIMEOUT_SECONDS = float(os.getenv("ALERT_POLL_TIMEOUT_SECONDS", "1.0"))
+ALERT_RETRY_BACKOFF_SECONDS = float(os.getenv("ALERT_RETRY_BACKOFF_SECONDS", "5"))
+DIRECTORY_REFRESH_SECONDS = float(os.getenv("ALERT_DIRECTORY_REFRESH_SECONDS", "300"))
+# Alerts for a patient missing from the directory are parked and their offsets committed, so the partition
+# keeps moving; they are retried every ALERT_PARKED_RETRY_SECONDS for up to ALERT_UNKNOWN_PATIENT_RETRY_SECONDS,
+# which covers a new patient still on its way to the warehouse
+ALERT_UNKNOWN_PATIENT_RETRY_SECONDS = float(os.getenv("ALERT_UNKNOWN_PATIENT_RETRY_SECONDS", "1800"))
+ALERT_PARKED_RETRY_SECONDS = float(os.getenv("ALERT_PARKED_RETRY_SECONDS", "60"))
+ALERT_PARKED_PATH = os.getenv("ALERT_PARKED_PATH", "parked_alerts.json")
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
 def read_config():
   config = {}
   with open("client.properties") as fh:
@@ -30,44 +47,152 @@ def get_bigquery_data(query):
     return rows
 
 
-def send_alert_mail(alert_details):
+class CaretakerDirectory:
+    """
+    In-memory patient -> (name, caretaker emails) lookup.
+
+    Loaded with two warehouse queries for all patients and refreshed every
+    `refresh_seconds`; an unknown patient triggers at most one early refresh per
+    `min_refresh_seconds` so a burst of alerts never turns into a burst of queries.
+    """
+
+    def __init__(self, refresh_seconds=DIRECTORY_REFRESH_SECONDS, min_refresh_seconds=30, loader=None):
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.loader = loader or self.load_from_bigquery
+        self._patients = {}
+        self._loaded_at = 0.0
+        self._attempted_at = float("-inf")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load_from_bigquery():
+        caretakers_emails = get_bigquery_data('''SELECT
+        patient_id,
+        ARRAY_AGG(email) as caretaker_email
+        FROM
+        `alzora_datawarehouse.caretakers`,
+        UNNEST(
+            ARRAY(
+            SELECT CAST(TRIM(pid) AS INT64)
+            FROM UNNEST(SPLIT(REGEXP_REPLACE(patient_ids, r'[\\[\\]]', ''))) AS pid
+            WHERE TRIM(pid) != ''
+            )
+        ) as patient_id
+        GROUP BY
+        patient_id;''')
+
+        patient_names = get_bigquery_data('''SELECT patient_id, first_name, last_name from `alzora_datawarehouse.patients`''')
+
+        emails = {row.patient_id: list(row.caretaker_email) for row in caretakers_emails}
+        return {
+            row.patient_id: {
+                "first_name": row.first_name,
+                "last_name": row.last_name or "",
+                "caretaker_emails": emails.get(row.patient_id, []),
+            }
+            for row in patient_names
+        }
+
+    def refresh(self):
+        self._attempted_at = time.monotonic()
+        patients = self.loader()
+        self._patients = patients
+        self._loaded_at = time.monotonic()
+        print(f"Loaded caretaker directory for {len(patients)} patients")
+
+    def get(self, patient_id):
+        patient_id = int(patient_id)
+        with self._lock:
+            now = time.monotonic()
+            expired = now - self._loaded_at > self.refresh_seconds
+            unknown = patient_id not in self._patients
+            if (expired or unknown) and now - self._attempted_at > self.min_refresh_seconds:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    if not self._patients:
+                        raise
+                    print("Couldn't refresh caretaker directory, using the cached one:", e)
+            return self._patients.get(patient_id)
 
-    patient_id = alert_details["patient_id"]
 
-    caretakers_emails = get_bigquery_data(f'''SELECT 
-    patient_id,
-    ARRAY_AGG(email) as caretaker_email
-    FROM 
-    `alzora_datawarehouse.caretakers`,
-    UNNEST(
-        ARRAY(
-        SELECT CAST(TRIM(pid) AS INT64) 
-        FROM UNNEST(SPLIT(REGEXP_REPLACE(patient_ids, r'[\[\]]', ''))) AS pid
-        WHERE TRIM(pid) != ''
-        )
-    ) as patient_id
-    WHERE 
-    patient_id={patient_id}
-    GROUP BY
-    patient_id
-    ORDER BY 
-    patient_id;''')
+class ParkedAlerts:
+    """
+    Alerts for patients not in the caretaker directory yet.
+
+    They are kept here, snapshotted to a JSON file, instead of holding back the
+    Kafka partition: their offsets are committed and `retry` sends them once the
+    patient shows up, or drops them after `max_age_seconds`.
+    """
+
+    def __init__(self, path=ALERT_PARKED_PATH, retry_seconds=ALERT_PARKED_RETRY_SECONDS,
+                 max_age_seconds=ALERT_UNKNOWN_PATIENT_RETRY_SECONDS):
+        self.path = path
+        self.retry_seconds = retry_seconds
+        self.max_age_seconds = max_age_seconds
+        # [parked_at (epoch seconds), alert_details]
+        self._alerts = []
+        self._retried_at = time.monotonic()
+        self.load()
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def park(self, alert_details, now=None):
+        print("Patient id:", alert_details["patient_id"], "not in the caretaker directory yet, parking alert")
+        self._alerts.append([time.time() if now is None else now, alert_details])
+        self.snapshot()
 
-    row = list(caretakers_emails)[0]
-    
-    caretaker_emails = row.caretaker_email
+    def retry(self, directory, mail_service, now=None):
+        now = time.time() if now is None else now
+        remaining = []
+        for parked_at, alert_details in self._alerts:
+            try:
+                delivered = send_alert_mail(alert_details, directory, mail_service)
+            except Exception as e:
+                print("Exception is: " + str(e))
+                delivered = False
+            if delivered is None and now - parked_at >= self.max_age_seconds:
+                print(f"Patient id: {alert_details['patient_id']} still unknown after {now - parked_at:.0f}s, skipping alert")
+            elif not delivered:
+                remaining.append([parked_at, alert_details])
+        if len(remaining) != len(self._alerts):
+            self._alerts = remaining
+            self.snapshot()
 
-    patient_info = get_bigquery_data(f'''SELECT first_name, last_name from `alzora_datawarehouse.patients` WHERE patient_id={row.patient_id}''')
+    def maybe_retry(self, directory, mail_service):
+        if self._alerts and time.monotonic() - self._retried_at >= self.retry_seconds:
+            self._retried_at = time.monotonic()
+            self.retry(directory, mail_service)
 
-    patient_info = list(patient_info)[0]
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as fh:
+                self._alerts = json.load(fh)
+            print(f"Loaded {len(self._alerts)} parked alerts")
+        except (OSError, ValueError) as e:
+            print("Couldn't load parked alerts, starting empty:", e)
 
-    print("For Patient id: ", row.patient_id, "Caretakers Emails: ", caretaker_emails, "Patient's Name: ", patient_info.first_name + " " + patient_info.last_name)
+    def snapshot(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump(self._alerts, fh, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
 
-    subject = f"Your patient {patient_info.first_name} {patient_info.last_name} is out of Safe Zone!!"
+
+def build_alert_message(alert_details, patient):
+    first_name, last_name = patient["first_name"], patient["last_name"]
+
+    subject = f"Your patient {first_name} {last_name} is out of Safe Zone!!"
     body = f"""
         Dear Caretaker,
 
-        This alert is regarding your patient {patient_info.first_name} {patient_info.last_name}.
+        This alert is regarding your patient {first_name} {last_name}.
 
         They have been detected to have gone out of your configured safe zone.
 
@@ -76,61 +201,156 @@ def send_alert_mail(alert_details):
         Event Time: {alert_details["event_ts"]}
         GPS_Latitude: {alert_details["gps_lat"]}
         GPS_Longitude: {alert_details["gps_long"]}
-        GPS_Latitude: {alert_details["gps_lat"]}
         Distance Away from Safe Zone: {alert_details["distance_meters"]} meters
-        
 
-        Please let us know or use our application if you need any further insights. 
+
+        Please let us know or use our application if you need any further insights.
 
         With ❤️ from Alzora Team
     """
-    sender_email = "nikhilsmankani@gmail.com"
-    app_password = GAPP_PASS
 
-    # Create email
-    msg = EmailMessage()
-    msg["From"] = formataddr(("Alzora Team", sender_email))
-    msg["To"] = caretaker_emails
-    msg["Subject"] = subject
-    msg.set_content(body)
+    return new_message(patient["caretaker_emails"], subject, body)
+
+
+def send_alert_mail(alert_details, directory, mail_service):
+    """
+    Returns True once the alert is in the outbox (the mail service delivers and
+    retries it from there) or can never be delivered, False to retry it, and
+    None when the patient is not in the directory: it may just not have reached
+    the warehouse yet, see ParkedAlerts.
+    """
+    patient = directory.get(alert_details["patient_id"])
+    if patient is None:
+        return None
+    if not patient["caretaker_emails"]:
+        print("No caretakers found for patient id:", alert_details["patient_id"], "skipping alert")
+        return True
+
+    print("For Patient id: ", alert_details["patient_id"], "Caretakers Emails: ", patient["caretaker_emails"], "Patient's Name: ", patient["first_name"] + " " + patient["last_name"])
+
+    try:
+        message_id = mail_service.send(build_alert_message(alert_details, patient), kind="safezone_alert")
+    except Exception as e:
+        print("Failed to queue alert for patient id:", alert_details["patient_id"], e)
+        return False
+
+    print("Queued Email", message_id)
+    return True
+
+
+def parse_alert(msg):
+    value = msg.value().decode("utf-8")
+    print(f"Consumed message from topic {msg.topic()}: value = {value:12}")
+    value = json.loads(value)
+    return {
+        "patient_id": value.get("patient_id"),
+        "event_ts": value.get("event_ts"),
+        "gps_lat": value.get("gps_lat"),
+        "gps_long": value.get("gps_long"),
+        "distance_meters": value.get("distance_meters")
+    }
+
+
+def admit_alerts(messages, dedup):
+    """
+    Parse the batch and run it through the dedup stage in offset order.
+    Returns a list of (alert_details, dedup undo token) per message, None when
+    nothing has to be sent (malformed or suppressed).
+    """
+    jobs = []
+    for msg in messages:
+        try:
+            alert_details = parse_alert(msg)
+        except (ValueError, UnicodeDecodeError) as e:
+            # A malformed alert can never succeed, don't let it block the partition
+            print("Skipping malformed alert:", e)
+            jobs.append(None)
+            continue
+
+        send, reason, undo = dedup.admit(alert_details)
+        print(f"Alert for patient id {alert_details['patient_id']}: {reason}")
+        jobs.append((alert_details, undo) if send else None)
+    return jobs
 
-    context = ssl.create_default_context(cafile=certifi.where())
-    with smtplib.SMTP_SSL("smtp.gmail.com", 465, context=context) as server:
-        server.login(sender_email, app_password)
-        server.send_message(msg)
-    
-    print("Sent Email Successfully!")
+
+def deliver(job, dedup, directory, mail_service, parked):
+    if job is None:
+        return True
+    alert_details, undo = job
+    try:
+        delivered = send_alert_mail(alert_details, directory, mail_service)
+    except Exception as e:
+        print("Exception is: " + str(e))
+        delivered = False
+    if delivered is None:
+        # Stays admitted in the dedup state, the parked store sends it once the patient is known
+        parked.park(alert_details)
+        return True
+    if not delivered:
+        dedup.restore(alert_details, undo)
+    return delivered
 
 
-def consume(topic, config):
+def commit_delivered(consumer, messages, delivered):
+    """
+    Commit, per partition, the offsets up to the first undelivered message and
+    rewind the consumer to it so it is fetched again on the next poll.
+    """
+    commits, rewinds = {}, {}
+    for msg, ok in zip(messages, delivered):
+        key = (msg.topic(), msg.partition())
+        if key in rewinds:
+            continue
+        if ok:
+            commits[key] = msg.offset() + 1
+        else:
+            rewinds[key] = msg.offset()
+
+    if commits:
+        consumer.commit(offsets=[TopicPartition(topic, partition, offset) for (topic, partition), offset in commits.items()], asynchronous=False)
+    for (topic, partition), offset in rewinds.items():
+        print(f"Rewinding {topic}[{partition}] to offset {offset} for redelivery")
+        consumer.seek(TopicPartition(topic, partition, offset))
+
+
+def consume(topic, config, consumer=None, directory=None, mail_service=None, dedup=None, parked=None):
     # sets the consumer group ID and offset
     config["group.id"] = "alzora-alerting-1"
     config["auto.offset.reset"] = "earliest"
+    # offsets are committed only after the alert has been delivered
+    config["enable.auto.commit"] = "false"
 
-    # creates a new consumer instance
-    consumer = Consumer(config)
+    # creates a new consumer instance (any object with the Consumer interface works, e.g. a test double)
+    consumer = consumer or Consumer(config)
+    directory = directory or CaretakerDirectory()
+    mail_service = mail_service or get_mail_service()
+    dedup = dedup or AlertDeduplicator()
+    parked = parked if parked is not None else ParkedAlerts()
 
     # subscribes to the specified topic
     consumer.subscribe([topic])
 
     try:
         while True:
-            # consumer polls the topic and prints any incoming messages
-            msg = consumer.poll(1.0)
-            if msg is not None and msg.error() is None:
-                value = msg.value().decode("utf-8")
-                print(f"Consumed message from topic {topic}: value = {value:12}")
-                value = json.loads(value)
-                send_alert_mail({
-                    "patient_id": value.get("patient_id"),
-                    "event_ts": value.get("event_ts"),
-                    "gps_lat": value.get("gps_lat"),
-                    "gps_long": value.get("gps_long"),
-                    "distance_meters": value.get("distance_meters")
-                })
+            # polls a batch of alerts and hands them to the mail outbox, which sends them in the background
+            messages = consumer.consume(num_messages=ALERT_BATCH_SIZE, timeout=ALERT_POLL_TIMEOUT_SECONDS)
+            messages = [msg for msg in messages if msg is not None and msg.error() is None]
+            parked.maybe_retry(directory, mail_service)
+            if not messages:
+                dedup.maybe_snapshot()
+                continue
+
+            jobs = admit_alerts(messages, dedup)
+            delivered = [deliver(job, dedup, directory, mail_service, parked) for job in jobs]
+            commit_delivered(consumer, messages, delivered)
+            if not all(delivered):
+                time.sleep(ALERT_RETRY_BACKOFF_SECONDS)
     except KeyboardInterrupt:
         pass
     finally:
+        dedup.snapshot()
+        print("Mail delivery:", mail_service.metrics())
+        mail_service.close()
         consumer.close()
 
 
@@ -139,4 +359,5 @@ def main():
     topic = "safezone_alerts"
     consume(topic, config)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
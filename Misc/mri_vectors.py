@@ -1,11 +1,44 @@
+"""
+Resumable MRI embedding ingestion into TiDB `mri_image_embeddings`.
+
+    python mri_vectors.py                                   # Vertex AI + TiDB from .env
+    python mri_vectors.py --model stub --db-url sqlite:///mri.db --manifest mri_manifest.jsonl
+    python mri_vectors.py --drop-legacy-rows                # once, on a table filled by the original script
+
+Misc has no requirements file: this needs pytidb 0.0.11, as pinned in
+backend/alzora_agent/requirements.txt. From 0.0.14 on TiDBClient.connect raises
+on a URL without a host, such as the sqlite one above.
+
+Pipeline:
+  * files are hashed, and decoded/resized to PNG, in a process pool; files whose
+    hash is already in the manifest are skipped without being decoded;
+  * images are decoded a window at a time, so only MRI_EMBEDDING_MAX_IN_FLIGHT
+    decoded images are held in memory however large the dataset;
+  * a bounded pool of embedding workers calls the model through a token-bucket
+    rate limiter that halves its rate on quota errors and creeps back up on
+    success, retrying with exponential backoff and jitter;
+  * rows go to TiDB in large multi-row INSERT batches over one connection, with
+    ids derived from the file hash, so a re-run never duplicates or collides;
+  * a batch's hashes are appended to the manifest only after it is committed.
+
+The original script inserted rows with random ids that no manifest knows about;
+ingesting next to them would store every image twice. A run that finds such
+rows stops, and --drop-legacy-rows deletes them so the dataset is re-embedded
+under content-hash ids.
+"""
+import argparse
+import hashlib
+import io
+import json
 import os
-from pytidb import TiDBClient
-from pytidb.schema import TableModel, Field, VectorField, DistanceMetric
-from dotenv import load_dotenv
-import vertexai
-from vertexai.vision_models import Image, MultiModalEmbeddingModel
+import random
+import threading
 import time
-from random import randint
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, text
 
 load_dotenv()
 
@@ -19,83 +52,376 @@ TIDB_DATABASE = os.getenv("TIDB_DATABASE")
 
 TIDB_DATABASE_URL=f"mysql+pymysql://{TIDB_USER}:{TIDB_PASS}@{TIDB_HOST}:{TIDB_PORT}/{TIDB_DATABASE}?ssl_ca=/etc/ssl/cert.pem"
 
-db = TiDBClient.connect(TIDB_DATABASE_URL)
+PROJECT_ID = "alzora-474820"
+MRI_DATASET_DIR = os.getenv("MRI_DATASET_DIR", "../Datasets/MRI_Dataset")
+MRI_MANIFEST_PATH = os.getenv("MRI_MANIFEST_PATH", "mri_manifest.jsonl")
+MRI_IMAGES_PER_CLASS = int(os.getenv("MRI_IMAGES_PER_CLASS", "100"))
+# Longest side of the image sent to the model
+MRI_IMAGE_MAX_SIDE = int(os.getenv("MRI_IMAGE_MAX_SIDE", "512"))
+MRI_EMBEDDING_WORKERS = int(os.getenv("MRI_EMBEDDING_WORKERS", "8"))
+# Decoded images waiting for or in an embedding call, caps the memory held by the pipeline
+MRI_EMBEDDING_MAX_IN_FLIGHT = int(os.getenv("MRI_EMBEDDING_MAX_IN_FLIGHT", str(2 * MRI_EMBEDDING_WORKERS)))
+# Vertex AI multimodal embedding quota, requests per minute
+MRI_EMBEDDING_RATE_PER_MINUTE = float(os.getenv("MRI_EMBEDDING_RATE_PER_MINUTE", "120"))
+MRI_EMBEDDING_RETRIES = int(os.getenv("MRI_EMBEDDING_RETRIES", "6"))
+MRI_INSERT_BATCH_SIZE = int(os.getenv("MRI_INSERT_BATCH_SIZE", "500"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
 
-model = ""
 embedding_dimension = 512
 
-def initialize_model():
-    global model
-    PROJECT_ID = "alzora-474820"
-    vertexai.init(project=PROJECT_ID, location="us-central1")
-    model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-    print("Initialising Model ...")
-    
-
-def get_embeddings(image_list, mri_scan_type):
-    count = 1542 + randint(234,99932)
-    object_list = []
-    for image_path in image_list:
-        image = Image.load_from_file(
-            image_path
-        )
 
+def file_sha256(image_path):
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prepare_image(image_path, max_side=MRI_IMAGE_MAX_SIDE):
+    """Decode an image, shrink it so its longest side is at most max_side and return PNG bytes."""
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        image = image.convert("L") if image.mode not in ("L", "RGB") else image
+        image.thumbnail((max_side, max_side))
+        png = io.BytesIO()
+        image.save(png, format="PNG")
+    return png.getvalue()
+
+
+def mri_id(sha256):
+    """Primary key derived from the file hash: stable across runs and within BIGINT range."""
+    return int(sha256[:15], 16)
+
+
+class Manifest:
+    """Append-only JSON-lines record of the files already stored in TiDB, keyed by content hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = set()
+        if os.path.exists(path):
+            with open(path) as fh:
+                for line in fh:
+                    line = line.strip()
+                    if line:
+                        try:
+                            self.hashes.add(json.loads(line)["sha256"])
+                        except (ValueError, KeyError):
+                            # A line cut short by a crash; its batch is re-checked against TiDB
+                            continue
+
+    def __contains__(self, sha256):
+        return sha256 in self.hashes
+
+    def add(self, entries):
+        with open(self.path, "a") as fh:
+            for entry in entries:
+                fh.write(json.dumps(entry) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.hashes.update(entry["sha256"] for entry in entries)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def is_quota_error(error):
+    if isinstance(error, QuotaExceeded):
+        return True
+    name = type(error).__name__
+    return name in ("ResourceExhausted", "TooManyRequests") or "429" in str(error) or "Quota" in str(error)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by the embedding workers.
+
+    Starts at `rate_per_minute` with a burst of `burst` tokens. Every quota error
+    halves the rate (down to `min_rate_per_minute`) and every success adds back
+    5% of the configured rate, so the pool settles just under the real quota.
+    """
+
+    def __init__(self, rate_per_minute=MRI_EMBEDDING_RATE_PER_MINUTE, burst=None, min_rate_per_minute=None):
+        self.max_rate = rate_per_minute / 60.0
+        self.min_rate = (min_rate_per_minute or rate_per_minute / 32.0) / 60.0
+        self.rate = self.max_rate
+        self.burst = burst or max(1.0, min(self.max_rate, MRI_EMBEDDING_WORKERS))
+        self.throttled = 0
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def on_quota_error(self):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the saved-up burst so the pool actually slows down
+            self._tokens = min(self._tokens, 0.0)
+
+
+class VertexImageEmbedder:
+    """multimodalembedding@001 on Vertex AI, initialised once and shared by the workers."""
+
+    def __init__(self, dimension=embedding_dimension):
+        import vertexai
+        from vertexai.vision_models import MultiModalEmbeddingModel
+
+        vertexai.init(project=PROJECT_ID, location="us-central1")
+        self.model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
+        self.dimension = dimension
+        print("Initialising Model ...")
+
+    def embed(self, image_bytes):
+        from vertexai.vision_models import Image
+
+        return self.model.get_embeddings(image=Image(image_bytes=image_bytes), dimension=self.dimension).image_embedding
+
+
+class StubImageEmbedder:
+    """Deterministic offline embeddings for local runs; can inject latency and quota errors."""
+
+    def __init__(self, dimension=embedding_dimension, latency_seconds=0.0, quota_error_rate=0.0):
+        self.dimension = dimension
+        self.latency_seconds = latency_seconds
+        self.quota_error_rate = quota_error_rate
+        self._random = random.Random(0)
+
+    def embed(self, image_bytes):
+        time.sleep(self.latency_seconds)
+        if self._random.random() < self.quota_error_rate:
+            raise QuotaExceeded("429 Quota exceeded for multimodalembedding (stub)")
+        seed = int(hashlib.sha256(image_bytes).hexdigest()[:16], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+
+def embed_with_retries(embedder, limiter, image_bytes, retries=MRI_EMBEDDING_RETRIES):
+    for attempt in range(retries + 1):
+        limiter.acquire()
         try:
-            embeddings = model.get_embeddings(
-                image=image,
-                dimension=embedding_dimension,
-            )
+            embedding = embedder.embed(image_bytes)
+            limiter.on_success()
+            return embedding
         except Exception as e:
-            print("Entered exception waiting for a min...")
-            time.sleep(60)
-            initialize_model()
+            if attempt == retries:
+                raise
+            if is_quota_error(e):
+                limiter.on_quota_error()
+            backoff = min(60.0, 2 ** attempt) * (0.5 + random.random())
+            print(f"Embedding failed ({e}), retrying in {backoff:.1f}s ...")
+            time.sleep(backoff)
+
+
+def connect(db_url):
+    from pytidb import TiDBClient
+
+    db = TiDBClient.connect(db_url)
+    if db.db_engine.dialect.name == "mysql":
+        from pytidb.schema import TableModel, Field, VectorField, DistanceMetric
 
-            embeddings = model.get_embeddings(
-                image=image,
-                dimension=embedding_dimension,
+        class MriImageEmbeddings(TableModel, table=True):
+            __tablename__ = "mri_image_embeddings"
+
+            id: int = Field(primary_key=True)
+            mri_scan_type: str = Field()
+            embedding: list[float] = VectorField(dimensions=512, distance_metric=DistanceMetric.L2)
+
+        db.create_table(schema=MriImageEmbeddings, if_exists="skip")
+    else:
+        # Local stand-in database without vector types
+        with db.db_engine.begin() as conn:
+            conn.execute(text("CREATE TABLE IF NOT EXISTS mri_image_embeddings (id BIGINT PRIMARY KEY, mri_scan_type VARCHAR(64), embedding TEXT)"))
+    return db
+
+
+class BatchWriter:
+    """Inserts rows into mri_image_embeddings in large batches over a single connection."""
+
+    def __init__(self, db, manifest, batch_size=MRI_INSERT_BATCH_SIZE):
+        self.conn = db.db_engine.connect()
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.inserted = 0
+        self._rows = []
+
+    def add(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        # Rows committed before a crash but missing from the manifest are already there
+        existing = {
+            row[0] for row in self.conn.execute(
+                text("SELECT id FROM mri_image_embeddings WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": [row["id"] for row in rows]},
+            )
+        }
+        new_rows = [row for row in rows if row["id"] not in existing]
+        if new_rows:
+            self.conn.execute(
+                text("INSERT INTO mri_image_embeddings (id, mri_scan_type, embedding) VALUES (:id, :mri_scan_type, :embedding)"),
+                [{"id": row["id"], "mri_scan_type": row["mri_scan_type"], "embedding": json.dumps(row["embedding"])} for row in new_rows],
             )
+        self.conn.commit()
+        self.manifest.add([{"sha256": row["sha256"], "id": row["id"], "path": row["path"]} for row in rows])
+        self.inserted += len(new_rows)
+        print(f"{len(new_rows)} objects inserted to TiDB ({self.inserted} this run)")
 
-        object_list.append(MriImageEmbeddings(
-            id = count,
-            mri_scan_type = mri_scan_type,
-            embedding = embeddings.image_embedding
-        ))
+    def close(self):
+        self.flush()
+        self.conn.close()
 
-        count = count + randint(234,99932)
 
-    return object_list
+def legacy_row_ids(db, known_hashes):
+    """Ids of rows not keyed by any known content hash, i.e. inserted with random ids by the original script."""
+    known_ids = {mri_id(sha256) for sha256 in known_hashes}
+    with db.db_engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT id FROM mri_image_embeddings")) if row[0] not in known_ids]
 
 
-class MriImageEmbeddings(TableModel, table=True):
-    __tablename__ = "mri_image_embeddings"
+def drop_legacy_rows(db, ids, batch_size=MRI_INSERT_BATCH_SIZE):
+    with db.db_engine.begin() as conn:
+        for start in range(0, len(ids), batch_size):
+            conn.execute(
+                text("DELETE FROM mri_image_embeddings WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                {"ids": ids[start:start + batch_size]},
+            )
+    print(f"Deleted {len(ids)} legacy rows from mri_image_embeddings")
+
+
+def list_images(dataset_dir, per_class=MRI_IMAGES_PER_CLASS):
+    images = []
+    for class_name in sorted(os.listdir(dataset_dir)):
+        class_dir = os.path.join(dataset_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for fname in sorted(os.listdir(class_dir))[:per_class]:
+            images.append((os.path.abspath(os.path.join(class_dir, fname)), class_name))
+    return images
+
 
-    id: int = Field(primary_key=True)
-    mri_scan_type: str = Field()
-    embedding: list[float] = VectorField(dimensions=512, distance_metric=DistanceMetric.L2)
+def ingest(images, embedder, db, manifest, limiter, embedding_workers=MRI_EMBEDDING_WORKERS,
+           batch_size=MRI_INSERT_BATCH_SIZE, decode_workers=None, max_in_flight=None):
+    writer = BatchWriter(db, manifest, batch_size)
+    max_in_flight = max_in_flight or max(MRI_EMBEDDING_MAX_IN_FLIGHT, embedding_workers)
+    failed = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=decode_workers) as decode_pool, \
+            ThreadPoolExecutor(max_workers=embedding_workers, thread_name_prefix="mri-embedding") as embed_pool:
+        hashes = list(decode_pool.map(file_sha256, [path for path, _ in images], chunksize=16))
+        pending, seen = [], set()
+        for (path, class_name), sha256 in zip(images, hashes):
+            if sha256 in manifest or sha256 in seen:
+                continue
+            seen.add(sha256)
+            pending.append((path, class_name, sha256))
+        print(f"{len(images)} images, {len(images) - len(pending)} already embedded or duplicates, {len(pending)} to go")
 
-table = db.create_table(schema=MriImageEmbeddings, if_exists="skip")
+        futures = {}
 
-print("Connected to TiDB database and created table!")
+        def collect(return_when):
+            nonlocal failed
+            done, _ = wait(futures, return_when=return_when)
+            for future in done:
+                path, class_name, sha256 = futures.pop(future)
+                try:
+                    embedding = future.result()
+                except Exception as e:
+                    # Not in the manifest, so the next run picks it up again
+                    print(f"Giving up on {path}: {e}")
+                    failed += 1
+                    continue
+                writer.add({"id": mri_id(sha256), "mri_scan_type": class_name, "embedding": embedding, "sha256": sha256, "path": path})
 
-initialize_model()
+        # Images are decoded one window at a time and handed to the embedding workers,
+        # never more than max_in_flight of them at once
+        for start in range(0, len(pending), max_in_flight):
+            window = pending[start:start + max_in_flight]
+            decoded = decode_pool.map(prepare_image, [path for path, _, _ in window], chunksize=4)
+            for (path, class_name, sha256), image_bytes in zip(window, decoded):
+                while len(futures) >= max_in_flight:
+                    collect(FIRST_COMPLETED)
+                future = embed_pool.submit(embed_with_retries, embedder, limiter, image_bytes)
+                futures[future] = (path, class_name, sha256)
+        while futures:
+            collect(FIRST_COMPLETED)
+    writer.close()
 
-dataset_dir = "../Datasets/MRI_Dataset"
+    elapsed = time.perf_counter() - started
+    print(f"Done with all objects: {writer.inserted} inserted, {failed} failed, "
+          f"{limiter.throttled} quota errors, {elapsed:.1f}s")
+    return writer.inserted, failed
 
-curr_image_list = []
 
-for class_name in sorted(os.listdir(dataset_dir)):
-    for fname in sorted(os.listdir(os.path.join(dataset_dir,class_name)))[:100]:
-        image_path = os.path.abspath(os.path.join(dataset_dir, class_name, fname))
-        curr_image_list.append(image_path)
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset-dir", default=MRI_DATASET_DIR)
+    parser.add_argument("--per-class", type=int, default=MRI_IMAGES_PER_CLASS)
+    parser.add_argument("--manifest", default=MRI_MANIFEST_PATH)
+    parser.add_argument("--db-url", default=TIDB_DATABASE_URL)
+    parser.add_argument("--model", choices=["vertex", "stub"], default="vertex")
+    parser.add_argument("--stub-latency-ms", type=float, default=50.0)
+    parser.add_argument("--stub-quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=MRI_EMBEDDING_WORKERS)
+    parser.add_argument("--rate-per-minute", type=float, default=MRI_EMBEDDING_RATE_PER_MINUTE)
+    parser.add_argument("--batch-size", type=int, default=MRI_INSERT_BATCH_SIZE)
+    parser.add_argument("--drop-legacy-rows", action="store_true",
+                        help="delete rows inserted with random ids by the original script before ingesting")
+    args = parser.parse_args()
+
+    if args.model == "stub":
+        embedder = StubImageEmbedder(latency_seconds=args.stub_latency_ms / 1000.0, quota_error_rate=args.stub_quota_error_rate)
+    else:
+        embedder = VertexImageEmbedder()
+
+    db = connect(args.db_url)
+    print("Connected to TiDB database and created table!")
+    try:
+        images = list_images(args.dataset_dir, args.per_class)
+        manifest = Manifest(args.manifest)
+        legacy = legacy_row_ids(db, manifest.hashes | {file_sha256(path) for path, _ in images})
+        if legacy and not args.drop_legacy_rows:
+            print(f"{len(legacy)} rows in mri_image_embeddings have ids that match no dataset file, most likely "
+                  f"inserted with random ids by the original script. Ingesting next to them would store the "
+                  f"images twice; rerun with --drop-legacy-rows to delete them and re-embed the dataset.")
+            return
+        if legacy:
+            drop_legacy_rows(db, legacy, args.batch_size)
+        ingest(
+            images,
+            embedder,
+            db,
+            manifest,
+            AdaptiveRateLimiter(args.rate_per_minute),
+            embedding_workers=args.workers,
+            batch_size=args.batch_size,
+        )
+    finally:
+        db.disconnect()
 
-        if len(curr_image_list) == 10:
-            curr_object_list = get_embeddings(curr_image_list, class_name)
-            print("Got the embeddings for 10 images!")
-            curr_image_list = []
-            db = TiDBClient.connect(TIDB_DATABASE_URL)
-            table = db.open_table("mri_image_embeddings")
-            table.bulk_insert(curr_object_list)
-            print("10 batch objects inserted to TiDB!")
-            time.sleep(60)
 
-print("Done with all objects")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
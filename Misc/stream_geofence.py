@@ -0,0 +1,345 @@
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+
+from geofence import SafeZones
+
+load_dotenv()
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+VITALS_TOPIC = os.getenv("GEOFENCE_VITALS_TOPIC", "patient_vitals")
+ALERTS_TOPIC = os.getenv("GEOFENCE_ALERTS_TOPIC", "safezone_alerts")
+GEOFENCE_BATCH_SIZE = int(os.getenv("GEOFENCE_BATCH_SIZE", "500"))
+GEOFENCE_POLL_TIMEOUT_SECONDS = float(os.getenv("GEOFENCE_POLL_TIMEOUT_SECONDS", "0.2"))
+# Safe zones are reloaded from the warehouse this often
+GEOFENCE_ZONE_REFRESH_SECONDS = float(os.getenv("GEOFENCE_ZONE_REFRESH_SECONDS", "300"))
+# Read the safe zones from this JSON file (Datasets/safe_zones.json format) instead of BigQuery
+GEOFENCE_ZONES_FILE = os.getenv("GEOFENCE_ZONES_FILE", "")
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+# Alerts produced by the same sample get the same id, so a redelivered batch doesn't create new alerts
+ALERT_ID_NAMESPACE = uuid.UUID("0c6f5d8e-4f1b-4bb5-9a51-3d5c1f0f7a20")
+
+
+def read_config():
+  config = {}
+  with open("client.properties") as fh:
+    for line in fh:
+      line = line.strip()
+      if len(line) != 0 and line[0] != "#":
+        parameter, value = line.strip().split('=', 1)
+        config[parameter] = value.strip()
+  return config
+
+
+def load_zones_from_bigquery():
+    from google.cloud import bigquery
+
+    rows = bigquery.Client().query('''SELECT patient_id, safe_center_lat, safe_center_long, safe_radius_meters
+    FROM `alzora_datawarehouse.patients`
+    WHERE patient_id IS NOT NULL''').result()
+    return SafeZones.from_records([dict(row.items()) for row in rows])
+
+
+class ZoneStore:
+    """Holds the current SafeZones and reloads them every `refresh_seconds`, keeping the old ones on failure."""
+
+    def __init__(self, loader, refresh_seconds=GEOFENCE_ZONE_REFRESH_SECONDS):
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.zones = None
+        self._loaded_at = float("-inf")
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._loaded_at > self.refresh_seconds:
+            self._loaded_at = now
+            try:
+                self.zones = self.loader()
+                print(f"Loaded safe zones for {len(self.zones)} patients")
+            except Exception as e:
+                if self.zones is None:
+                    raise
+                print("Couldn't refresh safe zones, using the cached ones:", e)
+        return self.zones
+
+
+def parse_vitals(messages):
+    """Turn a batch of patient_vitals messages into (patient_ids, lats, longs, event_ts) columns."""
+    patient_ids, lats, longs, event_ts = [], [], [], []
+    for msg in messages:
+        try:
+            value = json.loads(msg.value().decode("utf-8"))
+            patient_id = int(value["patient_id"])
+            lat, long = value.get("gps_lat"), value.get("gps_long")
+            if lat is None or long is None or lat == "" or long == "":
+                continue
+            lat, long = float(lat), float(long)
+        except (ValueError, TypeError, KeyError, UnicodeDecodeError) as e:
+            print("Skipping malformed vitals message:", e)
+            continue
+        patient_ids.append(patient_id)
+        lats.append(lat)
+        longs.append(long)
+        event_ts.append(value.get("timestamp"))
+    return (
+        np.asarray(patient_ids, dtype=np.int64),
+        np.asarray(lats, dtype=np.float64),
+        np.asarray(longs, dtype=np.float64),
+        event_ts,
+    )
+
+
+def evaluate_batch(messages, zones):
+    """
+    Return the alerts for a batch of vitals messages: one per patient, for the
+    patient's latest sample in the batch that is outside the safe zone.
+    """
+    patient_ids, lats, longs, event_ts = parse_vitals(messages)
+    if len(patient_ids) == 0:
+        return []
+
+    distance, outside, zone_index, _ = zones.evaluate(patient_ids, lats, longs)
+
+    latest = {}
+    for i in np.flatnonzero(outside):
+        patient_id = int(patient_ids[i])
+        if patient_id not in latest or str(event_ts[i]) >= str(event_ts[latest[patient_id]]):
+            latest[patient_id] = i
+
+    created_at = datetime.now(timezone.utc).isoformat()
+    alerts = []
+    for patient_id, i in latest.items():
+        z = zone_index[i]
+        radius = float(zones.radii_meters[z])
+        alerts.append({
+            "alert_id": str(uuid.uuid5(ALERT_ID_NAMESPACE, f"{patient_id}|{event_ts[i]}")),
+            "patient_id": patient_id,
+            "event_ts": event_ts[i],
+            "gps_lat": float(lats[i]),
+            "gps_long": float(longs[i]),
+            "safe_center_lat": float(zones.center_lats[z]),
+            "safe_center_long": float(zones.center_longs[z]),
+            # Polygon zones have no radius; NaN is not valid JSON for the consumers
+            "safe_radius_meters": None if np.isnan(radius) else radius,
+            "distance_meters": round(float(distance[i]), 2),
+            "is_outside_safe_zone": True,
+            "created_at": created_at,
+        })
+    return alerts
+
+
+def run(consumer, producer, zone_store, alerts_topic=ALERTS_TOPIC, batch_size=GEOFENCE_BATCH_SIZE,
+        poll_timeout=GEOFENCE_POLL_TIMEOUT_SECONDS, stop_when_idle=False):
+    """
+    Consume vitals in batches, publish the breaches and commit the batch once the
+    alerts are acknowledged by the broker. Returns processing stats.
+    """
+    stats = {"messages": 0, "alerts": 0, "batches": 0, "batch_latencies": []}
+    try:
+        while True:
+            messages = consumer.consume(num_messages=batch_size, timeout=poll_timeout)
+            messages = [msg for msg in messages if msg is not None and msg.error() is None]
+            if not messages:
+                if stop_when_idle:
+                    break
+                producer.poll(0)
+                continue
+
+            started = time.perf_counter()
+            alerts = evaluate_batch(messages, zone_store.get())
+            for alert in alerts:
+                producer.produce(alerts_topic, key=str(alert["patient_id"]), value=json.dumps(alert))
+                print(f"Breach for patient id {alert['patient_id']}: {alert['distance_meters']} meters from the safe center")
+            # At-least-once: the vitals are committed only after the alerts are on the broker
+            producer.flush()
+            consumer.commit(asynchronous=False)
+
+            stats["messages"] += len(messages)
+            stats["alerts"] += len(alerts)
+            stats["batches"] += 1
+            stats["batch_latencies"].append(time.perf_counter() - started)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        producer.flush()
+        consumer.close()
+    return stats
+
+
+# ── IN-MEMORY BROKER (replay and tests) ──────────────────────────────────
+class InMemoryMessage:
+    def __init__(self, topic, offset, key, value):
+        self._topic, self._offset, self._key, self._value = topic, offset, key, value
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return 0
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def error(self):
+        return None
+
+
+class InMemoryBroker:
+    """A single-partition-per-topic stand-in for Kafka with the Producer/Consumer calls used here."""
+
+    def __init__(self):
+        self.topics = defaultdict(list)
+        self.committed = {}
+        self._lock = threading.Lock()
+
+    def producer(self):
+        return InMemoryProducer(self)
+
+    def consumer(self, group_id="replay"):
+        return InMemoryConsumer(self, group_id)
+
+    def append(self, topic, key, value):
+        encode = lambda x: x.encode("utf-8") if isinstance(x, str) else x
+        with self._lock:
+            log = self.topics[topic]
+            log.append(InMemoryMessage(topic, len(log), encode(key), encode(value)))
+
+    def messages(self, topic):
+        return list(self.topics[topic])
+
+
+class InMemoryProducer:
+    def __init__(self, broker):
+        self.broker = broker
+
+    def produce(self, topic, key=None, value=None, **kwargs):
+        self.broker.append(topic, key, value)
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+
+class InMemoryConsumer:
+    def __init__(self, broker, group_id):
+        self.broker = broker
+        self.group_id = group_id
+        self.topics = []
+        self._pending = deque()
+        self._positions = {}
+
+    def subscribe(self, topics):
+        self.topics = list(topics)
+        for topic in self.topics:
+            self._positions[topic] = self.broker.committed.get((self.group_id, topic), 0)
+
+    def consume(self, num_messages=1, timeout=-1):
+        batch = []
+        for topic in self.topics:
+            log = self.broker.topics[topic]
+            start = self._positions[topic]
+            taken = log[start:start + num_messages - len(batch)]
+            self._positions[topic] = start + len(taken)
+            batch.extend(taken)
+        return batch
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        for topic in self.topics:
+            self.broker.committed[(self.group_id, topic)] = self._positions[topic]
+
+    def close(self):
+        pass
+# ── END IN-MEMORY BROKER ──────────────────────────────────────────────────
+
+
+def vitals_message(row):
+    """The JSON value Misc/publish_kafka.py sends for one vitals row."""
+    return json.dumps({
+        "patient_id": int(row["patient_id"]),
+        "device_id": row["device_id"],
+        "timestamp": row["timestamp"],
+        "heart_rate": int(float(row["heart_rate"])),
+        "spO2": float(row["spO2"]),
+        "gps_lat": float(row["gps_lat"]),
+        "gps_long": float(row["gps_long"]),
+        "step_count": int(float(row["step_count"])),
+        "fall_flag": row["fall_flag"] == "True",
+        "battery_level": int(float(row["battery_level"])),
+    })
+
+
+def replay_csv(csv_path, zones_file, batch_size=GEOFENCE_BATCH_SIZE):
+    """Replay a vitals CSV through an in-memory broker and return (alerts, stats)."""
+    broker = InMemoryBroker()
+    producer = broker.producer()
+    with open(csv_path, newline="") as fh:
+        for row in csv.DictReader(fh):
+            producer.produce(VITALS_TOPIC, key=row["patient_id"], value=vitals_message(row))
+
+    consumer = broker.consumer()
+    consumer.subscribe([VITALS_TOPIC])
+    zone_store = ZoneStore(lambda: SafeZones.from_json_file(zones_file))
+
+    started = time.perf_counter()
+    stats = run(consumer, producer, zone_store, batch_size=batch_size, stop_when_idle=True)
+    elapsed = time.perf_counter() - started
+
+    alerts = [json.loads(msg.value()) for msg in broker.messages(ALERTS_TOPIC)]
+    latencies = np.asarray(stats["batch_latencies"]) * 1000
+    print(f"Replayed {stats['messages']} messages in {elapsed:.3f}s ({stats['messages'] / max(elapsed, 1e-9):.0f} msg/s), "
+          f"{stats['alerts']} alerts, batch latency p50 {np.percentile(latencies, 50):.2f} ms / p99 {np.percentile(latencies, 99):.2f} ms")
+    return alerts, stats
+
+
+def consume(config):
+    from confluent_kafka import Consumer, Producer
+
+    consumer_config = dict(config)
+    consumer_config["group.id"] = "alzora-geofence-1"
+    consumer_config["auto.offset.reset"] = "latest"
+    # offsets are committed only after the alerts of the batch are published
+    consumer_config["enable.auto.commit"] = "false"
+
+    consumer = Consumer(consumer_config)
+    producer = Producer(config)
+    consumer.subscribe([VITALS_TOPIC])
+
+    if GEOFENCE_ZONES_FILE:
+        zone_store = ZoneStore(lambda: SafeZones.from_json_file(GEOFENCE_ZONES_FILE))
+    else:
+        zone_store = ZoneStore(load_zones_from_bigquery)
+    return run(consumer, producer, zone_store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate patient_vitals against the safe zones and publish safezone_alerts")
+    parser.add_argument("--replay", help="replay this vitals CSV through an in-memory broker instead of Kafka")
+    parser.add_argument("--zones", default=GEOFENCE_ZONES_FILE or os.path.join("..", "Datasets", "safe_zones.json"),
+                        help="safe zones JSON used with --replay")
+    args = parser.parse_args()
+
+    if args.replay:
+        replay_csv(args.replay, args.zones)
+    else:
+        consume(read_config())
+
+if __name__ == "__main__":
+    main()
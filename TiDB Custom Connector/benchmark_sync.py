@@ -0,0 +1,238 @@
+"""
+Benchmark of the connector's table sync, sequential vs parallel workers.
+
+Runs update() against a local stand-in database holding synthetic copies of the
+configured tables. By default that is a SQLite file with an artificial round-trip
+latency added to every statement, to mimic a remote TiDB; pass --url to run it
+against a real MySQL-compatible server instead (e.g. a local `tiup playground`
+at mysql+pymysql://root@127.0.0.1:4000/test). Operations are counted instead of
+being sent to Fivetran.
+
+    python benchmark_sync.py --rows 20000 --workers 1 4
+
+With --backfill-workers, every table is synced through the chunked initial
+backfill instead, ranges of --range-size keys read by that many workers.
+
+    python benchmark_sync.py --rows 200000 --workers 1 --backfill-workers 1 4 8
+
+--cdc-check runs the update-aware CDC and checksum delete detection instead and
+checks the operations it emits. It needs --url: the SQLite stand-in has no
+consistent snapshots, CRC32 or BIT_XOR.
+
+    python benchmark_sync.py --url mysql+pymysql://root@127.0.0.1:4000/test --rows 20000 --cdc-check
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pytidb import TiDBClient
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+import connector
+
+
+TABLES = {
+    "caretakers": "caretaker_id",
+    "patients": "patient_id",
+    "patient_metadata": "metadata_id",
+    "usual_spots": "spot_id",
+}
+CDC_CHECK_TABLE = "cdc_check"
+VECTOR_TABLES = {
+    "memories": {"primary_key_column": "memory_id", "vector_column": "image_embedding"},
+    "mri_image_embeddings": {"primary_key_column": "id", "vector_column": "embedding"},
+}
+
+
+class CountingOperations:
+    """Stands in for fivetran_connector_sdk.Operations and checks the calls are never concurrent."""
+
+    def __init__(self):
+        self.upserts = 0
+        self.checkpoints = 0
+        self.deleted_keys = []
+        self._busy = threading.Lock()
+
+    def upsert(self, table, data):
+        assert self._busy.acquire(blocking=False), "concurrent SDK calls"
+        self.upserts += 1
+        self._busy.release()
+
+    def delete(self, table, keys):
+        assert self._busy.acquire(blocking=False), "concurrent SDK calls"
+        self.deleted_keys.extend(keys.values())
+        self._busy.release()
+
+    def checkpoint(self, state):
+        assert self._busy.acquire(blocking=False), "concurrent SDK calls"
+        json.dumps(state)
+        self.checkpoints += 1
+        self._busy.release()
+
+
+def create_synthetic_tables(url, rows, dimension):
+    engine = create_engine(url)
+    started = datetime(2025, 1, 1)
+    with engine.begin() as conn:
+        for table_name, primary_key_column in TABLES.items():
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+            conn.execute(text(f"CREATE TABLE {table_name} ({primary_key_column} INTEGER PRIMARY KEY, name VARCHAR(64), created_at TIMESTAMP)"))
+            conn.execute(text(f"CREATE INDEX {table_name}_created ON {table_name} (created_at, {primary_key_column})"))
+            conn.execute(
+                text(f"INSERT INTO {table_name} VALUES (:pk, :name, :created_at)"),
+                [{"pk": i, "name": f"{table_name}-{i}", "created_at": started + timedelta(seconds=i // 3)} for i in range(rows)],
+            )
+        for table_name, table_data in VECTOR_TABLES.items():
+            pk, vector_column = table_data["primary_key_column"], table_data["vector_column"]
+            conn.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+            conn.execute(text(f"CREATE TABLE {table_name} ({pk} INTEGER PRIMARY KEY, {vector_column} TEXT, created_at TIMESTAMP)"))
+            conn.execute(text(f"CREATE INDEX {table_name}_created ON {table_name} (created_at, {pk})"))
+            vector_rows = rows // 10
+            conn.execute(
+                text(f"INSERT INTO {table_name} VALUES (:pk, :vector, :created_at)"),
+                [
+                    {"pk": i, "vector": json.dumps([round(random.random(), 6) for _ in range(dimension)]), "created_at": started + timedelta(seconds=i)}
+                    for i in range(vector_rows)
+                ],
+            )
+    engine.dispose()
+
+
+def run_cdc_check(url, rows, chunk_size):
+    """
+    Sync a CDC table, then update, delete, and insert-sync-delete rows between
+    keys and past the old first and last key of their checksum chunk, and check
+    the next sync emits exactly those deletes and the update.
+    """
+    engine = create_engine(url)
+    started = datetime(2025, 1, 1)
+    # Every third key, so rows can be inserted between existing ones
+    keys = list(range(0, rows * 3, 3))
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {CDC_CHECK_TABLE}"))
+        conn.execute(text(f"CREATE TABLE {CDC_CHECK_TABLE} (id INTEGER PRIMARY KEY, name VARCHAR(64), created_at TIMESTAMP, updated_at TIMESTAMP)"))
+        conn.execute(text(f"CREATE INDEX {CDC_CHECK_TABLE}_updated ON {CDC_CHECK_TABLE} (updated_at, id)"))
+        conn.execute(
+            text(f"INSERT INTO {CDC_CHECK_TABLE} VALUES (:id, :name, :ts, :ts)"),
+            [{"id": key, "name": f"row-{key}", "ts": started + timedelta(seconds=i)} for i, key in enumerate(keys)],
+        )
+
+    configuration = {
+        "PAGE_SIZE": "1000",
+        "SYNC_WORKERS": "1",
+        "TABLES_PRIMARY_KEY_COLUMNS": json.dumps({CDC_CHECK_TABLE: "id"}),
+        "VECTOR_TABLES_DATA": "{}",
+        "CDC_TABLES": json.dumps([CDC_CHECK_TABLE]),
+        "DELETE_CHECK_INTERVAL_MINUTES": "0",
+        "CHECKSUM_CHUNK_SIZE": str(chunk_size),
+    }
+    state = {}
+
+    def sync(delete_check=True):
+        operations = CountingOperations()
+        connector.op = operations
+        connector.update(dict(configuration, DELETE_CHECK_INTERVAL_MINUTES="0" if delete_check else "1000000"), state)
+        return operations
+
+    operations = sync()
+    assert operations.upserts == len(keys), f"initial sync upserted {operations.upserts} of {len(keys)} rows"
+    print(f"cdc: initial sync of {len(keys)} rows, {len(state[f'{CDC_CHECK_TABLE}_chunks'])} checksum chunks recorded")
+
+    # Synced but never seen by a delete check: right after an existing key, and past the last one
+    transient = [keys[len(keys) // 2] + 1, keys[-1] + 1]
+    later = started + timedelta(seconds=len(keys) + 1)
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {CDC_CHECK_TABLE} VALUES (:id, 'transient', :ts, :ts)"), [{"id": key, "ts": later} for key in transient])
+    operations = sync(delete_check=False)
+    assert operations.upserts == len(transient), f"transient rows: {operations.upserts} upserts"
+
+    updated, deleted = keys[1], keys[2::max(1, len(keys) // 20)]
+    with engine.begin() as conn:
+        conn.execute(text(f"UPDATE {CDC_CHECK_TABLE} SET name = 'updated', updated_at = :ts WHERE id = :id"),
+                     {"id": updated, "ts": later + timedelta(seconds=1)})
+        conn.execute(text(f"DELETE FROM {CDC_CHECK_TABLE} WHERE id IN ({', '.join(str(key) for key in deleted + transient)})"))
+        present = {row[0] for row in conn.execute(text(f"SELECT id FROM {CDC_CHECK_TABLE}"))}
+    operations = sync()
+    emitted = set(operations.deleted_keys)
+    missing = set(deleted + transient) - emitted
+    assert not missing, f"deletes not emitted for {sorted(missing)}"
+    assert not emitted & present, f"deletes emitted for existing rows {sorted(emitted & present)}"
+    assert state[f"{CDC_CHECK_TABLE}_last_updated_pk"] == updated, "update not synced"
+    print(f"cdc: {len(deleted) + len(transient)} deletes and 1 update propagated "
+          f"({len(emitted)} delete operations, {operations.upserts} upserts)")
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="MySQL-compatible database to run against (default: a temporary SQLite file)")
+    parser.add_argument("--rows", type=int, default=20000, help="rows per table (vector tables get a tenth)")
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="round trip added to every statement on the SQLite stand-in")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 6])
+    parser.add_argument("--backfill-workers", type=int, nargs="+", help="backfill all tables with each of these BACKFILL_WORKERS")
+    parser.add_argument("--range-size", type=int, default=10000, help="BACKFILL_RANGE_SIZE")
+    parser.add_argument("--cdc-check", action="store_true", help="check CDC and delete detection instead of benchmarking (needs --url)")
+    parser.add_argument("--chunk-size", type=int, default=100, help="CHECKSUM_CHUNK_SIZE for --cdc-check")
+    args = parser.parse_args()
+    if args.cdc_check and args.url is None:
+        parser.error("--cdc-check needs a MySQL-compatible --url")
+
+    url = args.url
+    engine_kwargs = {}
+    if url is None:
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "tidb_standin.db")
+        # Return TIMESTAMP columns as datetimes like the MySQL driver does
+        engine_kwargs["connect_args"] = {"detect_types": sqlite3.PARSE_DECLTYPES}
+
+        @event.listens_for(Engine, "before_cursor_execute")
+        def network_round_trip(*_):
+            time.sleep(args.latency_ms / 1000.0)
+
+    # Every worker connects to the stand-in the same way the connector connects to TiDB
+    connector.create_tidb_connection = lambda configuration: TiDBClient.connect(url, **engine_kwargs)
+    # Set by the SDK runtime when deployed; log.info fails on None outside of it
+    connector.log.LOG_LEVEL = connector.log.Level.INFO
+    if args.cdc_check:
+        run_cdc_check(url, args.rows, args.chunk_size)
+        return
+
+    print(f"Creating synthetic tables in {url}")
+    create_synthetic_tables(url, args.rows, args.dimension)
+
+    configuration = {
+        "PAGE_SIZE": str(args.page_size),
+        "TABLES_PRIMARY_KEY_COLUMNS": json.dumps(TABLES),
+        "VECTOR_TABLES_DATA": json.dumps(VECTOR_TABLES),
+    }
+    if args.backfill_workers:
+        configuration["BACKFILL_TABLES"] = json.dumps(list(TABLES) + list(VECTOR_TABLES))
+        configuration["BACKFILL_RANGE_SIZE"] = str(args.range_size)
+    baseline = None
+    for workers in args.workers:
+        for backfill_workers in args.backfill_workers or [None]:
+            operations = CountingOperations()
+            connector.op = operations
+            configuration["SYNC_WORKERS"] = str(workers)
+            label = f"workers={workers}"
+            if backfill_workers is not None:
+                configuration["BACKFILL_WORKERS"] = str(backfill_workers)
+                label += f" backfill_workers={backfill_workers}"
+            state = {}
+            started = time.perf_counter()
+            connector.update(configuration, state)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            print(f"{label}: {elapsed:7.2f}s  {operations.upserts} upserts  {operations.checkpoints} checkpoints  speedup x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
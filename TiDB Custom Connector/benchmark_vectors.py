@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of vector decoding in process_row.
+
+Builds synthetic rows shaped like `memories` (two 512-dim vectors in TiDB's text
+form) and times the previous per-element parser against the NumPy decoder,
+then the output formats, checking the decoded values are identical. Every
+timing is the best of --repeat runs.
+
+Both text parsers spend their time converting decimal strings to floats, so
+on the text form the NumPy decoder is about as fast as json.loads (within
+run-to-run noise). The real gains are the binary float32 form, decoded with
+one np.frombuffer, and the smaller float16/int8 output.
+
+    python benchmark_vectors.py --rows 100000
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+import connector
+
+
+def synthetic_vectors(rows, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    # TiDB prints vectors as "[v1,v2,...]" with float32 precision
+    return ["[" + ",".join(repr(float(x)) for x in vector) + "]" for vector in rng.standard_normal((rows, dimension)).astype(np.float32)]
+
+
+def timed(label, rows, fn, repeat=1):
+    elapsed = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = min(elapsed, time.perf_counter() - started)
+    print(f"{label:<40} {elapsed:8.2f}s  {rows / elapsed:10.0f} rows/s")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"Generating {args.rows} synthetic {args.dimension}-dim vectors")
+    vectors = synthetic_vectors(args.rows, args.dimension)
+
+    old, old_seconds = timed("json.loads + float() per element", args.rows, lambda: [connector.parse_embedding_string_to_list(v) for v in vectors], args.repeat)
+    new, new_seconds = timed("decode_vector (text, np.fromstring)", args.rows, lambda: [connector.decode_vector(v) for v in vectors], args.repeat)
+    assert all(np.array_equal(np.asarray(a), b) for a, b in zip(old, new)), "decoded values differ"
+    print(f"decoded values are identical, text form {old_seconds / new_seconds:.2f}x the old parser's speed")
+
+    binary = [vector.astype("<f4").tobytes() for vector in new[:args.rows]]
+    _, binary_seconds = timed("decode_vector (binary float32)", args.rows, lambda: [connector.decode_vector(b, args.dimension) for b in binary], args.repeat)
+    print(f"binary form {old_seconds / binary_seconds:.0f}x the old parser's speed")
+
+    configuration = {
+        "VECTOR_TABLES_DATA": json.dumps({"memories": {"primary_key_column": "memory_id", "vector_columns": ["text_embedding", "image_embedding"]}}),
+    }
+    for output_format in ("float", "float16", "int8"):
+        configuration["VECTOR_OUTPUT_FORMAT"] = output_format
+
+        def process_rows():
+            return [
+                connector.process_row({"memory_id": i, "text_embedding": v, "image_embedding": v}, "memories", configuration, True)
+                for i, v in enumerate(vectors)
+            ]
+        rows, _ = timed(f"process_row, 2 columns, {output_format}", args.rows, process_rows)
+        sample = rows[0]["image_embedding"]
+        size = len(sample) if isinstance(sample, bytes) else len(json.dumps(sample))
+        print(f"{'':<40} {size} bytes per vector (text form: {len(vectors[0])})")
+
+    decoded = new[0]
+    float16 = np.frombuffer(connector.encode_vector(decoded, "float16"), dtype="<f2").astype(np.float64)
+    int8 = connector.encode_vector(decoded, "int8")
+    int8 = np.asarray(int8["values"]) * int8["scale"]
+    cosine = lambda a, b: float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+    print(f"cosine to the original: float16 {cosine(decoded, float16):.6f}, int8 {cosine(decoded, int8):.6f}")
+
+
+if __name__ == "__main__":
+    main()
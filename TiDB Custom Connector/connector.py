@@ -1,9 +1,18 @@
 from fivetran_connector_sdk import Connector, Logging as log, Operations as op
+import bisect
 import json
 import logging
+import queue
+import threading
 import certifi
+import warnings
+import numpy as np
+from contextlib import contextmanager
+from functools import lru_cache
 from pytidb import TiDBClient
 from datetime import datetime, timezone
+from sqlalchemy import text
+from concurrent.futures import ThreadPoolExecutor
 
 
 # -----------------------------
@@ -27,16 +36,16 @@ def schema(configuration: dict):
         schema_list.append({"table": table_name, "primary_key": [primary_key_column]})
 
     # Optional: vector table metadata. These are appended to the schema list
-    # and include a typed column (JSON) for the vector payload so Fivetran will
-    # treat it as structured JSON on destination (e.g. BigQuery JSON column).
-    if configuration.get("VECTOR_TABLES_DATA"):
-        vector_tables_data = json.loads(configuration["VECTOR_TABLES_DATA"])
-        for table_name, table_data in vector_tables_data.items():
-            schema_list.append({
-                "table": table_name,
-                "primary_key": [table_data["primary_key_column"]],
-                "columns": {table_data["vector_column"]: "JSON"}
-            })
+    # and include a typed column for every vector payload so Fivetran will
+    # treat it as structured JSON on destination (e.g. BigQuery JSON column),
+    # or as BINARY when float16 output is configured.
+    vector_column_type = VECTOR_OUTPUT_COLUMN_TYPES[get_vector_output_format(configuration)]
+    for table_name, table_data in get_vector_tables(configuration).items():
+        schema_list.append({
+            "table": table_name,
+            "primary_key": [table_data["primary_key_column"]],
+            "columns": {vector_column: vector_column_type for vector_column in table_data["vector_columns"]}
+        })
 
     return schema_list
 
@@ -79,6 +88,108 @@ def parse_embedding_string_to_list(s):
     return None
 
 
+# -----------------------------
+# Vector configuration and decoding
+# -----------------------------
+# VECTOR_TABLES_DATA maps a table to its primary key and its vector column(s):
+# either "vector_column": "embedding" or "vector_columns": ["text_embedding",
+# "image_embedding"]. An optional "dimension" lets binary vectors be told from
+# text ones by their length. It is parsed once per distinct configuration string
+# rather than once per row.
+#
+# VECTOR_OUTPUT_FORMAT picks how vectors are written:
+#   * "float"   (default) JSON list of floats, same values as TiDB's text form
+#   * "float16" little-endian float16 bytes in a BINARY column (4x smaller)
+#   * "int8"    JSON {"scale": s, "values": [int8...]}, value ~= int8 * scale
+DEFAULT_VECTOR_OUTPUT_FORMAT = "float"
+VECTOR_OUTPUT_COLUMN_TYPES = {"float": "JSON", "float16": "BINARY", "int8": "JSON"}
+
+
+@lru_cache(maxsize=8)
+def parse_vector_tables(vector_tables_data: str):
+    vector_tables = {}
+    for table_name, table_data in json.loads(vector_tables_data).items():
+        vector_columns = table_data.get("vector_columns") or [table_data["vector_column"]]
+        vector_tables[table_name] = {
+            "primary_key_column": table_data["primary_key_column"],
+            "vector_columns": tuple(vector_columns),
+            "dimension": table_data.get("dimension"),
+        }
+    return vector_tables
+
+
+def get_vector_tables(configuration: dict):
+    return parse_vector_tables(configuration.get("VECTOR_TABLES_DATA") or "{}")
+
+
+def get_vector_output_format(configuration: dict):
+    output_format = configuration.get("VECTOR_OUTPUT_FORMAT") or DEFAULT_VECTOR_OUTPUT_FORMAT
+    if output_format not in VECTOR_OUTPUT_COLUMN_TYPES:
+        raise ValueError(f"VECTOR_OUTPUT_FORMAT must be one of {sorted(VECTOR_OUTPUT_COLUMN_TYPES)}, got '{output_format}'")
+    return output_format
+
+
+def decode_text_vector(s):
+    s = s.strip()
+    if not (s.startswith("[") and s.endswith("]")):
+        return None
+    inner = s[1:-1]
+    if inner.strip() == "":
+        return np.zeros(0, dtype=np.float64)
+    try:
+        with warnings.catch_warnings():
+            # Depending on the version NumPy warns or raises when it stops at an unparsable element
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(inner, dtype=np.float64, sep=",")
+    except ValueError:
+        values = None
+    if values is None or len(values) != inner.count(",") + 1:
+        # Quoted or malformed elements: use the tolerant parser
+        parsed = parse_embedding_string_to_list(s)
+        return None if parsed is None else np.asarray(parsed, dtype=np.float64)
+    return values
+
+
+def decode_vector(raw, dimension=None):
+    """
+    Decode a TiDB vector value into a float64 NumPy array: the text form
+    "[0.1,0.2,...]" is parsed by NumPy, raw bytes that aren't that text form are
+    read as TiDB's binary little-endian float32 layout. Bytes are only taken as
+    text when they parse as a vector (of `dimension` values, when given), so a
+    binary payload that happens to start with "[" or whitespace still decodes
+    as binary. Returns None when the value can't be parsed.
+    """
+    if raw is None:
+        return None
+    if isinstance(raw, (list, tuple, np.ndarray)):
+        return np.asarray(raw, dtype=np.float64)
+    if isinstance(raw, (bytes, bytearray, memoryview)):
+        raw = bytes(raw)
+        values = None
+        if raw.lstrip()[:1] == b"[":
+            try:
+                values = decode_text_vector(raw.decode("ascii"))
+            except UnicodeDecodeError:
+                values = None
+        if values is not None and (dimension is None or len(values) == dimension):
+            return values
+        if len(raw) % 4 or (dimension is not None and len(raw) != 4 * dimension):
+            return None
+        return np.frombuffer(raw, dtype="<f4").astype(np.float64)
+    return decode_text_vector(raw)
+
+
+def encode_vector(values, output_format: str = DEFAULT_VECTOR_OUTPUT_FORMAT):
+    if output_format == "float16":
+        return values.astype("<f2").tobytes()
+    if output_format == "int8":
+        # Symmetric per-vector quantization
+        max_abs = float(np.max(np.abs(values))) if len(values) else 0.0
+        scale = max_abs / 127.0 if max_abs > 0 else 1.0
+        return {"scale": scale, "values": np.round(values / scale).astype(np.int8).tolist()}
+    return values.tolist()
+
+
 # -----------------------------
 # Utility: parse timestamp from state
 # -----------------------------
@@ -119,51 +230,655 @@ def process_row(row_data, table_name, configuration, is_vector_table):
     if row_data.get("updated_at") and hasattr(row_data["updated_at"], "tzinfo") and row_data["updated_at"].tzinfo is None:
         row_data["updated_at"] = row_data["updated_at"].replace(tzinfo=timezone.utc)
 
-    # If this is a configured vector table, parse the embedding column
+    # If this is a configured vector table, decode its embedding columns
     if is_vector_table:
-        embedding_column = json.loads(configuration["VECTOR_TABLES_DATA"])[table_name]["vector_column"]
-        raw_embeddings = row_data.get(embedding_column)
-        emb_list = parse_embedding_string_to_list(raw_embeddings)
-        if emb_list is not None:
-            # Put the parsed list into a JSON-friendly Python list; Fivetran will
-            # write it as JSON to destinations that support JSON types.
-            row_data[embedding_column] = emb_list
+        output_format = get_vector_output_format(configuration)
+        vector_table = get_vector_tables(configuration)[table_name]
+        for embedding_column in vector_table["vector_columns"]:
+            values = decode_vector(row_data.get(embedding_column), vector_table["dimension"])
+            if values is not None:
+                # JSON-friendly list by default; Fivetran writes it as JSON to
+                # destinations that support JSON types.
+                row_data[embedding_column] = encode_vector(values, output_format)
 
     return row_data
 
 
 # -----------------------------
-# Core ingestion: fetch and upsert
+# Keyset pagination
 # -----------------------------
-# Fetch rows newer than the stored state and upsert them to the destination
-# using the Fivetran operations API.
-def fetch_and_upsert_data(cursor: TiDBClient, table_name: str, state: dict, configuration:dict, is_vector_table: bool = False):
-    # Read last processed timestamp for this table from state (string)
-    last_created = state.get(f"{table_name}_last_created", "1990-01-01T00:00:00Z")
-    last_created_timestamp = parse_state_timestamp(timestamp_str=last_created)
+# Rows are read in pages ordered by (cursor column, primary key), the cursor
+# column being created_at, or updated_at for CDC tables. Each page starts
+# strictly after the last row of the previous one, so rows sharing a timestamp
+# are never skipped or read twice, and every page is an index range scan no
+# matter how far into the table the sync is.
+DEFAULT_PAGE_SIZE = 1000
+
+
+def get_page_size(configuration: dict):
+    return int(configuration.get("PAGE_SIZE") or DEFAULT_PAGE_SIZE)
+
+
+def build_page_query(table_name: str, primary_key_column: str, has_last_pk: bool, cursor_column: str = "created_at"):
+    if has_last_pk:
+        after_last_row = (
+            f"({cursor_column} > :last_cursor OR ({cursor_column} = :last_cursor AND {primary_key_column} > :last_pk))"
+        )
+    else:
+        # State written before pagination only carries the timestamp
+        after_last_row = f"{cursor_column} > :last_cursor"
+    return text(
+        f"SELECT * FROM {table_name} WHERE {after_last_row} "
+        f"ORDER BY {cursor_column}, {primary_key_column} LIMIT :page_size"
+    )
 
-    tidb_timestamp = last_created.replace("T", " ").replace("Z", "")
 
-    tidb_query = f"SELECT * FROM {table_name} WHERE created_at > '{tidb_timestamp}' ORDER BY created_at"
-    
-    # Execute query and expect an iterable of dict-like rows
-    query_result = cursor.query(tidb_query).to_list()
+def get_state_keys(table_name: str, cursor_column: str):
+    """State keys holding the (cursor, primary key) position of a table."""
+    if cursor_column == "created_at":
+        return f"{table_name}_last_created", f"{table_name}_last_pk"
+    return f"{table_name}_last_updated", f"{table_name}_last_updated_pk"
+
 
-    for row in query_result:
-        # Process the row (normalize datetimes, parse embeddings)
-        row_data = process_row(row, table_name, configuration, is_vector_table)
-        # Upsert into destination using Fivetran's operations API
+# -----------------------------
+# Operation emitters
+# -----------------------------
+# Table syncs never call the SDK directly. The single-threaded path uses the
+# DirectEmitter; parallel workers share one QueueEmitter whose queue is drained
+# on the thread that called update(), so upserts and checkpoints reach the SDK
+# one at a time and every checkpoint follows the upserts of its page.
+class DirectEmitter:
+    def __init__(self, state: dict):
+        self.state = state
+
+    def upsert(self, table_name: str, row_data: dict):
         op.upsert(table=table_name, data=row_data)
 
-        # If the row has a created_at and it's newer than our last seen
-        if row_data.get("created_at") and row_data["created_at"] > last_created_timestamp:
-            last_created_timestamp = row_data["created_at"]
+    def delete(self, table_name: str, keys: dict):
+        op.delete(table=table_name, keys=keys)
 
-    # Persist the last processed timestamp back to state
-    state[f"{table_name}_last_created"] = last_created_timestamp.isoformat()
+    def checkpoint(self, table_state: dict):
+        self.state.update(table_state)
+        op.checkpoint(self.state)
 
-    # Instruct the connector framework to checkpoint (persist) state
-    op.checkpoint(state)
+
+class QueueEmitter:
+    def __init__(self, state: dict, max_pending: int):
+        self.state = state
+        # Bounded so fast readers wait for the emitter instead of piling rows up in memory
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._aborted = threading.Event()
+
+    def _put(self, item):
+        while not self._aborted.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Sync aborted by the emitter")
+
+    def upsert(self, table_name: str, row_data: dict):
+        self._put(("upsert", table_name, row_data))
+
+    def delete(self, table_name: str, keys: dict):
+        self._put(("delete", table_name, keys))
+
+    def checkpoint(self, table_state: dict):
+        self._put(("checkpoint", table_state))
+
+    def done(self, table_name: str, error=None):
+        self._put(("done", table_name, error))
+
+    def run(self, table_count: int):
+        """Emit operations until `table_count` workers are done; returns {table_name: error} of failed tables."""
+        errors = {}
+        finished = 0
+        try:
+            while finished < table_count:
+                item = self._queue.get()
+                if item[0] == "upsert":
+                    op.upsert(table=item[1], data=item[2])
+                elif item[0] == "delete":
+                    op.delete(table=item[1], keys=item[2])
+                elif item[0] == "checkpoint":
+                    self.state.update(item[1])
+                    op.checkpoint(self.state)
+                else:
+                    finished += 1
+                    if item[2] is not None:
+                        errors[item[1]] = item[2]
+        except BaseException:
+            # Unblock the workers, nothing will drain the queue anymore
+            self._aborted.set()
+            raise
+        return errors
+
+
+# -----------------------------
+# Core ingestion: fetch and upsert
+# -----------------------------
+# Fetch rows newer than the stored state page by page and upsert them to the
+# destination using the Fivetran operations API. Rows are streamed from a
+# server-side cursor and state is checkpointed after every page, so memory stays
+# flat and a crashed sync resumes from the last completed page. Operations go
+# through `emitter` (see below); by default they are sent straight to the SDK.
+def fetch_and_upsert_data(cursor: TiDBClient, table_name: str, primary_key_column: str, state: dict, configuration:dict, is_vector_table: bool = False, emitter=None, cursor_column: str = "created_at"):
+    emitter = emitter or DirectEmitter(state)
+    cursor_state_key, pk_state_key = get_state_keys(table_name, cursor_column)
+
+    # Read last processed (cursor column, primary key) for this table from state
+    last_cursor = state.get(cursor_state_key, "1990-01-01T00:00:00Z")
+    last_cursor_timestamp = parse_state_timestamp(timestamp_str=last_cursor)
+    last_pk = state.get(pk_state_key)
+    page_size = get_page_size(configuration)
+
+    while True:
+        params = {
+            # TiDB DATETIME columns are naive UTC
+            "last_cursor": last_cursor_timestamp.astimezone(timezone.utc).replace(tzinfo=None),
+            "last_pk": last_pk,
+            "page_size": page_size,
+        }
+        page_query = build_page_query(table_name, primary_key_column, has_last_pk=last_pk is not None, cursor_column=cursor_column)
+
+        rows_in_page, page_keys = 0, []
+        with cursor.db_engine.connect() as conn:
+            # stream_results uses an unbuffered server-side cursor, so rows are
+            # fetched from TiDB as they are upserted instead of all at once
+            result = conn.execution_options(stream_results=True).execute(page_query, params)
+            for row in result.mappings():
+                # Process the row (normalize datetimes, parse embeddings)
+                row_data = process_row(dict(row), table_name, configuration, is_vector_table)
+                # Upsert into destination using Fivetran's operations API
+                emitter.upsert(table_name, row_data)
+
+                # Rows arrive in (cursor column, primary key) order, the last one is the new position
+                last_cursor_timestamp = row_data[cursor_column]
+                last_pk = row_data[primary_key_column]
+                page_keys.append(last_pk)
+                rows_in_page += 1
+
+        if rows_in_page == 0:
+            break
+
+        # Persist the position of the last upserted row and checkpoint the page
+        table_state = {
+            cursor_state_key: last_cursor_timestamp.isoformat(),
+            pk_state_key: last_pk,
+        }
+        synced = note_synced_keys(table_name, state, page_keys)
+        if synced is not None:
+            table_state[f"{table_name}_synced_keys"] = synced
+            # Parallel workers read from a snapshot of the state, keep it in step for the delete check
+            state[f"{table_name}_synced_keys"] = synced
+        emitter.checkpoint(table_state)
+        log.info(f"{table_name}: synced a page of {rows_in_page} rows up to {cursor_column}={last_cursor_timestamp.isoformat()}")
+
+        if rows_in_page < page_size:
+            break
+
+
+# -----------------------------
+# Update-aware CDC
+# -----------------------------
+# Tables listed in CDC_TABLES are cursored on updated_at instead of created_at,
+# so edits (e.g. a safe-zone change through the webapp) are synced too. Deletes
+# can't be seen through a cursor; they come from two places:
+#   * an optional TOMBSTONE_TABLE (tombstone_id, table_name, primary_key_value,
+#     deleted_at) that writers fill when they delete rows, read incrementally;
+#   * a periodic checksum diff. The primary key space of a table is split into
+#     chunks of at most CHECKSUM_CHUNK_SIZE keys, whose first and last key are at
+#     most CHECKSUM_MAX_CHUNK_SPAN apart, and state keeps, per chunk, only its
+#     bounds, a COUNT + BIT_XOR(CRC32(pk, updated_at)) checksum and its first and
+#     last key, so it grows with the number of chunks, not with the keys. Every
+#     DELETE_CHECK_INTERVAL_MINUTES the checksums are recomputed in TiDB; only
+#     chunks whose checksum moved, or that the incremental sync upserted rows
+#     into since (state keeps the lowest and highest such key per chunk, so a
+#     row inserted and deleted again between two checks is seen too), are
+#     re-read and upserted, and every key of their range that is gone now is
+#     deleted: at most CHECKSUM_MAX_CHUNK_SPAN keys from its lower bound plus
+#     its old first to last key and the synced keys (deleting a key that never
+#     existed is a no-op; integer keys only). A chunk's keys or rows
+#     and its checksum are read in one consistent snapshot, so a concurrent
+#     write can't slip in between them.
+DEFAULT_DELETE_CHECK_INTERVAL_MINUTES = 360
+DEFAULT_CHECKSUM_CHUNK_SIZE = 1000
+
+
+def get_cdc_tables(configuration: dict):
+    return set(json.loads(configuration.get("CDC_TABLES") or "[]"))
+
+
+def split_into_chunks(keys: list, chunk_size: int, max_span=None, lo=None, hi=None):
+    """
+    Cut sorted keys into [lo, hi) ranges of at most chunk_size keys, and for
+    integer keys at most max_span apart from first to last; None bounds are
+    open-ended. Returns (lo, hi, first key, last key) per range.
+    """
+    chunks, start = [], 0
+    while start < len(keys) or not chunks:
+        end = min(start + chunk_size, len(keys))
+        if max_span and start < end and isinstance(keys[start], int):
+            end = bisect.bisect_left(keys, keys[start] + max_span, start, end)
+        chunk_lo = lo if start == 0 else keys[start]
+        chunk_hi = keys[end] if end < len(keys) else hi
+        chunks.append((chunk_lo, chunk_hi, keys[start] if start < end else None, keys[end - 1] if start < end else None))
+        start = end
+    return chunks
+
+
+@contextmanager
+def consistent_snapshot(conn):
+    """Run the reads inside on one snapshot of the database (TiDB and MySQL alike)."""
+    conn.execute(text("START TRANSACTION WITH CONSISTENT SNAPSHOT"))
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+
+def build_range_clause(primary_key_column: str, lo, hi):
+    clauses = []
+    if lo is not None:
+        clauses.append(f"{primary_key_column} >= :lo")
+    if hi is not None:
+        clauses.append(f"{primary_key_column} < :hi")
+    return " AND ".join(clauses) or "1 = 1"
+
+
+def chunk_checksum(conn, table_name: str, primary_key_column: str, lo, hi):
+    row = conn.execute(
+        text(
+            f"SELECT COUNT(*) AS row_count, BIT_XOR(CRC32(CONCAT_WS('#', {primary_key_column}, updated_at))) AS checksum "
+            f"FROM {table_name} WHERE {build_range_clause(primary_key_column, lo, hi)}"
+        ),
+        {"lo": lo, "hi": hi},
+    ).mappings().one()
+    return f"{row['row_count']}:{row['checksum'] or 0}"
+
+
+def is_delete_check_due(table_name: str, state: dict, configuration: dict):
+    interval_minutes = float(configuration.get("DELETE_CHECK_INTERVAL_MINUTES") or DEFAULT_DELETE_CHECK_INTERVAL_MINUTES)
+    last_check = state.get(f"{table_name}_last_delete_check")
+    if not last_check:
+        return True
+    elapsed = datetime.now(timezone.utc) - parse_state_timestamp(timestamp_str=last_check)
+    return elapsed.total_seconds() >= interval_minutes * 60
+
+
+def get_checksum_chunk_limits(configuration: dict):
+    chunk_size = int(configuration.get("CHECKSUM_CHUNK_SIZE") or DEFAULT_CHECKSUM_CHUNK_SIZE)
+    # Bounds the keys enumerated for deletes in a changed chunk
+    max_span = int(configuration.get("CHECKSUM_MAX_CHUNK_SPAN") or 2 * chunk_size)
+    return chunk_size, max_span
+
+
+def record_chunks(conn, table_name: str, primary_key_column: str, chunk_size: int, max_span: int):
+    """Walk the primary key index one chunk at a time, holding at most chunk_size + 1 keys."""
+    chunks, lo = [], None
+    while True:
+        with consistent_snapshot(conn):
+            keys = [
+                row[0] for row in conn.execute(
+                    text(f"SELECT {primary_key_column} FROM {table_name} WHERE {build_range_clause(primary_key_column, lo, None)} "
+                         f"ORDER BY {primary_key_column} LIMIT :limit"),
+                    {"lo": lo, "limit": chunk_size + 1},
+                )
+            ]
+            chunk_lo, chunk_hi, first_key, last_key = split_into_chunks(keys, chunk_size, max_span, lo)[0]
+            chunks.append([chunk_lo, chunk_hi, chunk_checksum(conn, table_name, primary_key_column, chunk_lo, chunk_hi), first_key, last_key])
+        if chunk_hi is None:
+            return chunks
+        lo = chunk_hi
+
+
+def note_synced_keys(table_name: str, state: dict, keys: list):
+    """
+    Per checksum chunk (by index), the lowest and highest key upserted since the
+    last delete check, so the check also looks at chunks whose rows the
+    destination got in between even if their checksum ends up unchanged (a row
+    inserted and deleted again). None for tables without recorded chunks.
+    """
+    chunks = state.get(f"{table_name}_chunks")
+    if not chunks or not keys:
+        return None
+    synced = dict(state.get(f"{table_name}_synced_keys") or {})
+    bounds = [chunk[0] for chunk in chunks[1:]]
+    for key in keys:
+        index = str(bisect.bisect_right(bounds, key))
+        low, high = synced.get(index, (key, key))
+        synced[index] = [min(low, key), max(high, key)]
+    return synced
+
+
+def delete_scan_range(lo, hi, first_key, last_key, keys: list, max_span: int, synced=None):
+    """
+    Integer keys [start, stop) of a changed chunk to look for deletes in: its
+    whole [lo, hi) range, so rows inserted since the last check outside its old
+    first and last key are covered too, clipped to max_span keys from the lower
+    bound but always covering the old first to last key and the keys synced
+    since the last check. None for non-integer keys.
+    """
+    synced = synced or []
+    known = [key for key in (lo, first_key, keys[0] if keys else None, *synced) if key is not None]
+    if not known or not all(isinstance(key, int) for key in known):
+        return None
+    start = lo if lo is not None else min(known)
+    stop = start + max_span if hi is None else min(hi, start + max_span)
+    if isinstance(last_key, int):
+        stop = max(stop, last_key + 1)
+    if synced:
+        start, stop = min(start, synced[0]), max(stop, synced[1] + 1)
+    return start, stop
+
+
+def check_deleted_rows(cursor: TiDBClient, table_name: str, primary_key_column: str, state: dict, configuration: dict, is_vector_table: bool = False, emitter=None):
+    emitter = emitter or DirectEmitter(state)
+    chunk_size, max_span = get_checksum_chunk_limits(configuration)
+    chunks = state.get(f"{table_name}_chunks") or []
+    synced = state.get(f"{table_name}_synced_keys") or {}
+    checked_at = datetime.now(timezone.utc).isoformat()
+
+    with cursor.db_engine.connect() as conn:
+        if not chunks:
+            # First check: record the chunk layout, there is nothing to compare against yet
+            new_chunks = record_chunks(conn, table_name, primary_key_column, chunk_size, max_span)
+            log.info(f"{table_name}: recorded {len(new_chunks)} checksum chunks for delete detection")
+        else:
+            new_chunks, changed, deleted = [], 0, 0
+            for index, (lo, hi, checksum, first_key, last_key) in enumerate(chunks):
+                synced_keys = synced.get(str(index))
+                if synced_keys is None and chunk_checksum(conn, table_name, primary_key_column, lo, hi) == checksum:
+                    new_chunks.append([lo, hi, checksum, first_key, last_key])
+                    continue
+
+                # Only this range changed (or got synced rows): re-read it and re-cut it (so chunks that grew stay small), in one snapshot
+                changed += 1
+                with consistent_snapshot(conn):
+                    rows = conn.execute(
+                        text(f"SELECT * FROM {table_name} WHERE {build_range_clause(primary_key_column, lo, hi)} ORDER BY {primary_key_column}"),
+                        {"lo": lo, "hi": hi},
+                    ).mappings().all()
+                    keys = [row[primary_key_column] for row in rows]
+                    for sub_lo, sub_hi, sub_first, sub_last in split_into_chunks(keys, chunk_size, max_span, lo, hi):
+                        new_chunks.append([sub_lo, sub_hi, chunk_checksum(conn, table_name, primary_key_column, sub_lo, sub_hi), sub_first, sub_last])
+
+                for row in rows:
+                    emitter.upsert(table_name, process_row(dict(row), table_name, configuration, is_vector_table))
+                scan = delete_scan_range(lo, hi, first_key, last_key, keys, max_span, synced_keys)
+                if scan is None:
+                    if lo is not None or first_key is not None or keys:
+                        log.warning(f"{table_name}: deletes can't be detected on non-integer primary keys, use TOMBSTONE_TABLE")
+                    continue
+                present = set(keys)
+                for key in range(*scan):
+                    if key not in present:
+                        emitter.delete(table_name, {primary_key_column: key})
+                        deleted += 1
+            log.info(f"{table_name}: {changed} of {len(chunks)} checksum chunks changed or synced into, {deleted} deletes emitted")
+
+    # Chunk indices change with the new layout, and everything synced so far has been checked
+    emitter.checkpoint({f"{table_name}_chunks": new_chunks, f"{table_name}_synced_keys": {}, f"{table_name}_last_delete_check": checked_at})
+    state[f"{table_name}_synced_keys"] = {}
+
+
+def fetch_tombstones(cursor: TiDBClient, state: dict, configuration: dict, emitter=None):
+    emitter = emitter or DirectEmitter(state)
+    tombstone_table = configuration["TOMBSTONE_TABLE"]
+    primary_key_columns = {table_name: primary_key_column for table_name, primary_key_column, _ in get_sync_tasks(configuration)}
+    last_id = state.get("tombstones_last_id", 0)
+    page_size = get_page_size(configuration)
+
+    while True:
+        with cursor.db_engine.connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT tombstone_id, table_name, primary_key_value FROM {tombstone_table} "
+                     f"WHERE tombstone_id > :last_id ORDER BY tombstone_id LIMIT :page_size"),
+                {"last_id": last_id, "page_size": page_size},
+            ).mappings().all()
+        for row in rows:
+            primary_key_column = primary_key_columns.get(row["table_name"])
+            if primary_key_column is not None:
+                key = row["primary_key_value"]
+                key = int(key) if str(key).lstrip("-").isdigit() else key
+                emitter.delete(row["table_name"], {primary_key_column: key})
+            last_id = row["tombstone_id"]
+        if not rows:
+            break
+        emitter.checkpoint({"tombstones_last_id": last_id})
+        if len(rows) < page_size:
+            break
+
+
+# -----------------------------
+# Chunked initial backfill
+# -----------------------------
+# The first sync of a table listed in BACKFILL_TABLES is not one ordered scan
+# over the whole table. Instead:
+#   * a watermark is taken, the last (cursor column, primary key) of the table;
+#   * the primary key space is cut into ranges of BACKFILL_RANGE_SIZE keys;
+#   * BACKFILL_WORKERS threads read the ranges in parallel, each on its own
+#     connection, keyset-paginating on the primary key and skipping rows past the
+#     watermark;
+#   * state keeps, per range, its bounds, its last synced key and whether it is
+#     done, checkpointed after every page, so a restarted sync resumes mid-table;
+#   * once every range is done the table cursor is set to the watermark and the
+#     incremental sync picks up everything written since.
+# With parallel table workers a table being backfilled opens up to
+# BACKFILL_WORKERS connections of its own. Only tables that have the cursor
+# column (created_at, or updated_at for CDC tables) can be listed, so not
+# mri_image_embeddings.
+DEFAULT_BACKFILL_RANGE_SIZE = 100000
+DEFAULT_BACKFILL_WORKERS = 4
+
+
+def get_backfill_tables(configuration: dict):
+    return set(json.loads(configuration.get("BACKFILL_TABLES") or "[]"))
+
+
+def get_backfill_workers(configuration: dict):
+    return max(1, int(configuration.get("BACKFILL_WORKERS") or DEFAULT_BACKFILL_WORKERS))
+
+
+def needs_backfill(table_name: str, state: dict, configuration: dict, cursor_column: str = "created_at"):
+    if state.get(f"{table_name}_backfill"):
+        # A backfill is in progress
+        return True
+    cursor_state_key, _ = get_state_keys(table_name, cursor_column)
+    return table_name in get_backfill_tables(configuration) and cursor_state_key not in state
+
+
+def plan_backfill_ranges(conn, table_name: str, primary_key_column: str, range_size: int):
+    """Cut the primary key space into [lo, hi) ranges of range_size keys, walking the primary key index only."""
+    bounds = []
+    boundary = conn.execute(
+        text(f"SELECT {primary_key_column} FROM {table_name} ORDER BY {primary_key_column} LIMIT 1 OFFSET :skip"),
+        {"skip": range_size},
+    ).first()
+    while boundary is not None:
+        bounds.append(boundary[0])
+        boundary = conn.execute(
+            text(f"SELECT {primary_key_column} FROM {table_name} WHERE {primary_key_column} > :after "
+                 f"ORDER BY {primary_key_column} LIMIT 1 OFFSET :skip"),
+            {"after": boundary[0], "skip": range_size - 1},
+        ).first()
+    edges = [None] + bounds + [None]
+    # [lo, hi, last synced key, done]
+    return [[lo, hi, None, False] for lo, hi in zip(edges, edges[1:])]
+
+
+def plan_backfill(cursor: TiDBClient, table_name: str, primary_key_column: str, configuration: dict, cursor_column: str = "created_at"):
+    range_size = int(configuration.get("BACKFILL_RANGE_SIZE") or DEFAULT_BACKFILL_RANGE_SIZE)
+    with cursor.db_engine.connect() as conn:
+        last_row = conn.execute(
+            text(f"SELECT {cursor_column}, {primary_key_column} FROM {table_name} "
+                 f"ORDER BY {cursor_column} DESC, {primary_key_column} DESC LIMIT 1")
+        ).first()
+        if last_row is None:
+            return None
+        ranges = plan_backfill_ranges(conn, table_name, primary_key_column, range_size)
+
+    watermark = last_row[0]
+    if watermark.tzinfo is None:
+        watermark = watermark.replace(tzinfo=timezone.utc)
+    return {
+        "cursor_column": cursor_column,
+        "watermark": watermark.isoformat(),
+        "watermark_pk": last_row[1],
+        "ranges": ranges,
+    }
+
+
+def build_backfill_page_query(table_name: str, primary_key_column: str, lo, hi, has_last_pk: bool, cursor_column: str = "created_at"):
+    clauses = [build_range_clause(primary_key_column, lo, hi)]
+    if has_last_pk:
+        clauses.append(f"{primary_key_column} > :last_pk")
+    # Rows past the watermark are left to the incremental sync
+    clauses.append(f"({cursor_column} < :watermark OR ({cursor_column} = :watermark AND {primary_key_column} <= :watermark_pk))")
+    return text(
+        f"SELECT * FROM {table_name} WHERE {' AND '.join(clauses)} "
+        f"ORDER BY {primary_key_column} LIMIT :page_size"
+    )
+
+
+class BackfillProgress:
+    """Range positions of one table's backfill, shared by its range workers."""
+
+    def __init__(self, table_name: str, backfill: dict, emitter):
+        self.table_name = table_name
+        self.backfill = backfill
+        self.emitter = emitter
+        self._lock = threading.Lock()
+
+    def advance(self, index: int, last_pk, done: bool = False):
+        # Checkpoints are put under the lock so a later one never carries older positions
+        with self._lock:
+            self.backfill["ranges"][index][2:] = [last_pk, done]
+            snapshot = dict(self.backfill, ranges=[list(r) for r in self.backfill["ranges"]])
+            self.emitter.checkpoint({f"{self.table_name}_backfill": snapshot})
+
+
+def backfill_range(cursor: TiDBClient, table_name: str, primary_key_column: str, configuration: dict, is_vector_table: bool, progress: BackfillProgress, index: int):
+    backfill = progress.backfill
+    lo, hi, last_pk, _ = backfill["ranges"][index]
+    cursor_column = backfill["cursor_column"]
+    page_size = get_page_size(configuration)
+    params = {
+        "lo": lo,
+        "hi": hi,
+        # TiDB DATETIME columns are naive UTC
+        "watermark": parse_state_timestamp(timestamp_str=backfill["watermark"]).astimezone(timezone.utc).replace(tzinfo=None),
+        "watermark_pk": backfill["watermark_pk"],
+        "page_size": page_size,
+    }
+
+    while True:
+        params["last_pk"] = last_pk
+        page_query = build_backfill_page_query(table_name, primary_key_column, lo, hi, has_last_pk=last_pk is not None, cursor_column=cursor_column)
+
+        rows_in_page, page_keys = 0, []
+        with cursor.db_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(page_query, params)
+            for row in result.mappings():
+                row_data = process_row(dict(row), table_name, configuration, is_vector_table)
+                progress.emitter.upsert(table_name, row_data)
+                last_pk = row_data[primary_key_column]
+                page_keys.append(last_pk)
+                rows_in_page += 1
+
+        # Persist the range position and checkpoint the page
+        done = rows_in_page < page_size
+        progress.advance(index, last_pk, done)
+        if done:
+            break
+
+
+def backfill_range_worker(configuration: dict, table_name: str, primary_key_column: str, is_vector_table: bool, progress: BackfillProgress, index: int):
+    # Every range gets its own connection so ranges are read concurrently
+    try:
+        connection = create_tidb_connection(configuration=configuration)
+        try:
+            backfill_range(cursor=connection, table_name=table_name, primary_key_column=primary_key_column, configuration=configuration,
+                           is_vector_table=is_vector_table, progress=progress, index=index)
+        finally:
+            connection.disconnect()
+    except Exception as e:
+        log.severe(f"{table_name}: backfill of range {index} failed: {e}")
+        return e
+    return None
+
+
+def backfill_table(cursor: TiDBClient, table_name: str, primary_key_column: str, state: dict, configuration: dict, is_vector_table: bool = False, emitter=None, cursor_column: str = "created_at"):
+    emitter = emitter or DirectEmitter(state)
+    backfill_key = f"{table_name}_backfill"
+
+    backfill = state.get(backfill_key)
+    if backfill:
+        backfill = dict(backfill, ranges=[list(r) for r in backfill["ranges"]])
+    else:
+        backfill = plan_backfill(cursor, table_name, primary_key_column, configuration, cursor_column)
+        if backfill is None:
+            # Empty table, the incremental sync starts from scratch
+            return
+        emitter.checkpoint({backfill_key: backfill})
+        log.info(f"{table_name}: backfilling {len(backfill['ranges'])} primary key ranges up to {backfill['cursor_column']}={backfill['watermark']}")
+
+    pending = [index for index, (_, _, _, done) in enumerate(backfill["ranges"]) if not done]
+    workers = min(get_backfill_workers(configuration), len(pending))
+
+    if workers <= 1:
+        progress = BackfillProgress(table_name, backfill, emitter)
+        for index in pending:
+            backfill_range(cursor=cursor, table_name=table_name, primary_key_column=primary_key_column, configuration=configuration,
+                           is_vector_table=is_vector_table, progress=progress, index=index)
+    else:
+        # Range workers never call the SDK: they feed the QueueEmitter update()
+        # already drains, or one drained here on the calling thread
+        range_emitter = emitter if isinstance(emitter, QueueEmitter) else QueueEmitter(state, max_pending=get_page_size(configuration) * workers)
+        progress = BackfillProgress(table_name, backfill, range_emitter)
+
+        def run_range(index):
+            error = backfill_range_worker(configuration, table_name, primary_key_column, is_vector_table, progress, index)
+            if range_emitter is not emitter:
+                range_emitter.done(table_name, error)
+            return error
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"backfill-{table_name}") as pool:
+            futures = [pool.submit(run_range, index) for index in pending]
+            if range_emitter is not emitter:
+                range_emitter.run(len(futures))
+        errors = [future.result() for future in futures if future.result() is not None]
+        if errors:
+            # Finished ranges stay checkpointed, the next sync resumes the others
+            raise RuntimeError(f"{table_name}: backfill failed for {len(errors)} of {len(pending)} ranges: {errors[0]}")
+
+    # Hand over to the incremental sync at the watermark
+    cursor_state_key, pk_state_key = get_state_keys(table_name, backfill["cursor_column"])
+    table_state = {cursor_state_key: backfill["watermark"], pk_state_key: backfill["watermark_pk"], backfill_key: None}
+    emitter.checkpoint(table_state)
+    # Parallel workers read from a snapshot of the state, keep it in step
+    state.update(table_state)
+    log.info(f"{table_name}: backfill complete, switching to incremental sync")
+
+
+# -----------------------------
+# Table sync
+# -----------------------------
+def sync_table(cursor: TiDBClient, table_name: str, primary_key_column: str, state: dict, configuration: dict, is_vector_table: bool = False, emitter=None):
+    emitter = emitter or DirectEmitter(state)
+    is_cdc_table = table_name in get_cdc_tables(configuration)
+    cursor_column = "updated_at" if is_cdc_table else "created_at"
+
+    if needs_backfill(table_name, state, configuration, cursor_column):
+        backfill_table(cursor=cursor, table_name=table_name, primary_key_column=primary_key_column, state=state,
+                       configuration=configuration, is_vector_table=is_vector_table, emitter=emitter, cursor_column=cursor_column)
+
+    fetch_and_upsert_data(cursor=cursor, table_name=table_name, primary_key_column=primary_key_column, state=state,
+                          configuration=configuration, is_vector_table=is_vector_table, emitter=emitter, cursor_column=cursor_column)
+    if is_cdc_table and is_delete_check_due(table_name, state, configuration):
+        check_deleted_rows(cursor=cursor, table_name=table_name, primary_key_column=primary_key_column, state=state,
+                           configuration=configuration, is_vector_table=is_vector_table, emitter=emitter)
 
 
 # -----------------------------
@@ -186,6 +901,45 @@ def create_tidb_connection(configuration:dict):
     return connection
 
 
+# -----------------------------
+# Parallel table sync
+# -----------------------------
+DEFAULT_SYNC_WORKERS = 4
+
+
+def get_sync_workers(configuration: dict):
+    return max(1, int(configuration.get("SYNC_WORKERS") or DEFAULT_SYNC_WORKERS))
+
+
+def get_sync_tasks(configuration: dict):
+    """(table_name, primary_key_column, is_vector_table) for every configured table, non-vector tables first."""
+    tasks = [
+        (table_name, primary_key_column, False)
+        for table_name, primary_key_column in json.loads(configuration["TABLES_PRIMARY_KEY_COLUMNS"]).items()
+    ]
+    tasks += [
+        (table_name, table_data["primary_key_column"], True)
+        for table_name, table_data in get_vector_tables(configuration).items()
+    ]
+    return tasks
+
+
+def sync_table_worker(configuration: dict, state: dict, emitter: QueueEmitter, table_name: str, primary_key_column: str, is_vector_table: bool):
+    # Every table gets its own connection so tables are read concurrently
+    error = None
+    try:
+        connection = create_tidb_connection(configuration=configuration)
+        try:
+            sync_table(cursor=connection, table_name=table_name, primary_key_column=primary_key_column, state=state,
+                       configuration=configuration, is_vector_table=is_vector_table, emitter=emitter)
+        finally:
+            connection.disconnect()
+    except Exception as e:
+        log.severe(f"{table_name}: sync failed: {e}")
+        error = e
+    emitter.done(table_name, error)
+
+
 # -----------------------------
 # Update function called by the connector
 # -----------------------------
@@ -193,23 +947,39 @@ def create_tidb_connection(configuration:dict):
 # and should be robust to retries. Keep the function small and push heavy work
 # into helper functions so errors can be handled in isolation.
 def update(configuration: dict, state: dict):
-    # Create a TiDB connection
-    connection = create_tidb_connection(configuration=configuration)
-
-    # Read list of tables from configuration. Expect a dict mapping table->pk
-    tables = json.loads(configuration["TABLES_PRIMARY_KEY_COLUMNS"]).keys()
-
-    # Iterate the non-vector tables first
-    for table_name in tables:
-        fetch_and_upsert_data(cursor=connection, table_name=table_name, state=state, configuration=configuration)
-    
-    # Process optional vector tables
-    if configuration.get("VECTOR_TABLES_DATA"):
-
-        vector_tables = json.loads(configuration["VECTOR_TABLES_DATA"]).keys()
-
-        for table_name in vector_tables:
-            fetch_and_upsert_data(cursor=connection, table_name=table_name, state=state, configuration=configuration, is_vector_table=True)
+    tasks = get_sync_tasks(configuration)
+    workers = min(get_sync_workers(configuration), len(tasks))
+
+    if workers <= 1:
+        # Create a TiDB connection and sync the tables one after another
+        connection = create_tidb_connection(configuration=configuration)
+        for table_name, primary_key_column, is_vector_table in tasks:
+            sync_table(cursor=connection, table_name=table_name, primary_key_column=primary_key_column, state=state,
+                       configuration=configuration, is_vector_table=is_vector_table)
+        if configuration.get("TOMBSTONE_TABLE"):
+            fetch_tombstones(cursor=connection, state=state, configuration=configuration)
+        return
+
+    # Tables are independent: sync them concurrently and emit from this thread.
+    # Workers only read their own table's keys, from a snapshot of the state.
+    emitter = QueueEmitter(state, max_pending=get_page_size(configuration) * workers)
+    state_snapshot = dict(state)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tidb-sync") as pool:
+        for table_name, primary_key_column, is_vector_table in tasks:
+            pool.submit(sync_table_worker, configuration, state_snapshot, emitter, table_name, primary_key_column, is_vector_table)
+        errors = emitter.run(len(tasks))
+
+    # Deletes recorded by writers go after the upserts of this sync
+    if configuration.get("TOMBSTONE_TABLE"):
+        connection = create_tidb_connection(configuration=configuration)
+        try:
+            fetch_tombstones(cursor=connection, state=state, configuration=configuration)
+        finally:
+            connection.disconnect()
+
+    if errors:
+        # Tables that finished keep their checkpoints; fail the sync so the rest are retried
+        raise RuntimeError(f"Sync failed for tables {sorted(errors)}: {next(iter(errors.values()))}")
 
 
 # -----------------------------
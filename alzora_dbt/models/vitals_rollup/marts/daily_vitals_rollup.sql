@@ -0,0 +1,47 @@
+-- models/marts/daily_vitals_rollup.sql
+-- Per-patient daily aggregates of the raw watch vitals. The dashboard (chartData)
+-- and the weekly report read a bounded window of days from here instead of
+-- re-aggregating the whole patient_vitals history on every request.
+{{ config(
+    materialized='incremental',
+    incremental_strategy='insert_overwrite',
+    partition_by={"field": "day", "data_type": "date"},
+    cluster_by=["patient_id"]
+) }}
+
+with vitals as (
+  select
+    value_patient_id as patient_id,
+    date(`timestamp`) as day,
+    value_heart_rate as heart_rate,
+    value_step_count as step_count,
+    value_sp_o_2 as spo2,
+    cast(value_fall_flag as int64) as fall_flag
+  from {{ source('patients_vitals', 'patient_vitals') }}
+  where value_patient_id is not null
+    and `timestamp` is not null
+
+  {% if is_incremental() %}
+    -- late-arriving samples only touch the last few days, so only those partitions are rebuilt
+    and date(`timestamp`) >= date_sub(current_date(), interval {{ var('vitals_rollup_lookback_days', 3) }} day)
+  {% endif %}
+)
+
+select
+  patient_id,
+  day,
+  round(avg(heart_rate), 2) as avg_heart_rate,
+  min(heart_rate) as min_heart_rate,
+  max(heart_rate) as max_heart_rate,
+  round(avg(step_count), 2) as avg_step_count,
+  min(step_count) as min_step_count,
+  max(step_count) as max_step_count,
+  sum(step_count) as total_step_count,
+  round(avg(spo2), 2) as avg_spO2_level,
+  min(spo2) as min_spO2_level,
+  max(spo2) as max_spO2_level,
+  coalesce(sum(fall_flag), 0) as total_fall_flag,
+  count(*) as sample_count,
+  current_timestamp() as rolled_up_at
+from vitals
+group by patient_id, day
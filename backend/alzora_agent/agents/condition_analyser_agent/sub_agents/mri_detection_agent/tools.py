@@ -1,7 +1,7 @@
 from google.adk.tools import ToolContext
 from alzora_agent.setup import *
-from PIL import Image
-import io
+from alzora_agent.embedding_service import load_image_for_embedding
+from alzora_agent.mri_index import classify_mri
 
 
 def mri_search(tool_context: ToolContext, query: str):
@@ -12,30 +12,17 @@ def mri_search(tool_context: ToolContext, query: str):
             if hasattr(part, "inline_data") and part.inline_data:
                 blob = part.inline_data
                 file_bytes = blob.data
-                image_obj = Image.open(io.BytesIO(file_bytes))
+                image_obj = load_image_for_embedding(file_bytes)
                 print("Assinged Image Object")
 
         embeddings = get_image_embeddings(image_obj, query)
 
-        search_results = get_bigquery_data(f'''
-                WITH query_emb AS (
-                    SELECT {embeddings["Image Embedding"]} AS q_emb
-                )
-                SELECT
-                    base.mri_scan_type,
-                    distance
-                    FROM VECTOR_SEARCH(
-                        TABLE `MRI_Embeddings_Dataset.mri_embeddings`,
-                        'mri_embeddings',
-                        TABLE query_emb,
-                        top_k => 1,
-                        distance_type => 'COSINE'
-                    );
-        ''')
+        # Exact k-NN vote over the in-process reference set instead of a VECTOR_SEARCH job per scan
+        result = classify_mri(embeddings["Image Embedding"])
 
-        tool_context.state["mri_condition"] = dict(list(search_results)[0])["mri_scan_type"]
+        tool_context.state["mri_condition"] = result["label"]
 
-        return {"Detected Condition": tool_context.state["mri_condition"]}
+        return {"Detected Condition": result["label"], "Confidence": result["confidence"]}
 
     except Exception as e:
         print("Exception is: " + str(e))
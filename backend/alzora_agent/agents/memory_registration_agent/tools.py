@@ -1,7 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from google.adk.tools import ToolContext
 from alzora_agent.setup import *
-from PIL import Image
-import io
+from alzora_agent.memory_index import add_memory_to_index
+from alzora_agent.embedding_service import load_image_for_embedding
 
 from datetime import datetime
 
@@ -15,19 +17,23 @@ def register_memory(tool_context: ToolContext, text_content: str):
             if hasattr(part, "inline_data") and part.inline_data:
                 blob = part.inline_data
                 file_bytes = blob.data
-                image_obj = Image.open(io.BytesIO(file_bytes))
+                image_obj = load_image_for_embedding(file_bytes)
 
         table = get_tidb_table("memories")
 
         image_embeddings = None
 
+        # text_embedding always holds the text model's vector, image_embedding the
+        # multimodal image vector, so every column is a single embedding space
         if image_obj:
-            embeddings = get_image_embeddings(image_obj, text_content)
-            image_embeddings = embeddings["Image Embedding"]
-            text_embeddings = embeddings["Text Embedding"]
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                text_embeddings = pool.submit(get_text_embeddings, text_content)
+                embeddings = pool.submit(get_image_embeddings, image_obj, text_content)
+            text_embeddings = text_embeddings.result()
+            image_embeddings = embeddings.result()["Image Embedding"]
         else:
             text_embeddings = get_text_embeddings(text_content)
-        table.insert(
+        memory = table.insert(
             {
                 "patient_id": patient_id,
                 "text_content": text_content,
@@ -37,7 +43,9 @@ def register_memory(tool_context: ToolContext, text_content: str):
                 "updated_at": str(datetime.now()),
             }
         )
-    
+
+        add_memory_to_index(patient_id, memory.memory_id, text_content, text_embeddings, image_embeddings)
+
         return "Memory Registered Successfully!"
 
     except Exception as e:
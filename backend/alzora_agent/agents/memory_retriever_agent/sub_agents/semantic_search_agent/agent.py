@@ -12,12 +12,15 @@ semantic_search_agent = Agent(
        You have to strictly use the tool `search_memory` with the user query without any thought. 
        This tool is also capable of searching memory using image.
 
-       Once you have the response from the tool summarize the `text_content` in complete detail.
+       The tool returns the best matching `memories`, most relevant first. Summarize the
+       `text_content` of the first one in complete detail, and mention the others only
+       if they are clearly about the same thing.
 
        Make sure to give as detailed instructions as possible as your user is a alzheimer's patient.
 
        IMPORTANT:
-       If you can't find the thing mentioned by user then TRANSFER THE CONTROL TO THE PARENT AGENT.
+       If the tool reports that no memory matched closely enough, or you can't find the thing
+       mentioned by user, then TRANSFER THE CONTROL TO THE PARENT AGENT.
 
        For making the response more customized use the below patient's information:
        {patient_information}
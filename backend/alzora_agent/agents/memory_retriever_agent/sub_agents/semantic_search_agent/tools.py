@@ -1,17 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from google.adk.tools import ToolContext
 from alzora_agent.setup import *
-from PIL import Image
-import io
-
-
-def get_memory_details(query_result):
-    memory_id = dict(list(query_result)[0])["memory_id"]
-    memory_details = get_bigquery_data(f'''
-        SELECT memory_id, patient_id, text_content 
-        FROM alzora_datawarehouse.memories
-        WHERE memory_id={memory_id}
-    ''')
-    return dict(list(memory_details)[0])
+from alzora_agent.memory_index import hybrid_search_patient_memories
+from alzora_agent.embedding_service import load_image_for_embedding
 
 
 def search_memory(tool_context: ToolContext, query: str):
@@ -23,60 +15,49 @@ def search_memory(tool_context: ToolContext, query: str):
             if hasattr(part, "inline_data") and part.inline_data:
                 blob = part.inline_data
                 file_bytes = blob.data
-                image_obj = Image.open(io.BytesIO(file_bytes))
+                image_obj = load_image_for_embedding(file_bytes)
                 print("Assinged Image Object")
-        
-        print("Image object is:", image_obj)
+
+        print("Image object size:", len(image_obj) if image_obj else None)
         text_content = query
 
+        # Query both vector columns in one pass, each with a vector from the model
+        # that filled it: text_embedding with the text model, image_embedding with
+        # the multimodal one (the image itself, or the query text for a text query)
         if image_obj:
-            embeddings = get_image_embeddings(image_obj, text_content)
-
-            search_results = get_bigquery_data(f'''
-                    WITH query_emb AS (
-                        SELECT {embeddings["Image Embedding"]} AS q_emb
-                    )
-                    SELECT
-                        base.memory_id,
-                        distance
-                        FROM VECTOR_SEARCH(
-                            (
-                                SELECT *
-                                FROM `Alzora_Embeddings_Dataset_alzora_datawarehouse.memories_embeddings`
-                                WHERE patient_id = {patient_id} AND ARRAY_LENGTH(image_embedding) != 0
-                            ),
-                        'image_embedding',
-                        TABLE query_emb,
-                        top_k => 1,
-                        distance_type => 'COSINE'
-                    );
-            ''')
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                text_embeddings = pool.submit(get_text_embeddings, text_content)
+                embeddings = pool.submit(get_image_embeddings, image_obj, text_content)
+            queries = {"image_embedding": embeddings.result()["Image Embedding"], "text_embedding": text_embeddings.result()}
+            same_modality_column = "image_embedding"
         else:
-            embeddings = get_text_embeddings(text_content)
-            search_results = get_bigquery_data(f'''
-                    WITH query_emb AS (
-                        SELECT {embeddings} AS q_emb
-                    )
-                    SELECT
-                        base.memory_id,
-                        distance
-                        FROM VECTOR_SEARCH(
-                            (
-                                SELECT *
-                                FROM `Alzora_Embeddings_Dataset_alzora_datawarehouse.memories_embeddings`
-                                WHERE patient_id = {patient_id} AND ARRAY_LENGTH(text_embedding) != 0
-                            ),
-                        'text_embedding',
-                        TABLE query_emb,
-                        top_k => 1,
-                        distance_type => 'COSINE'
-                    );
-            ''')
-
-        memory_details = get_memory_details(search_results)
-
-        return memory_details
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                text_embeddings = pool.submit(get_text_embeddings, text_content)
+                multimodal_embeddings = pool.submit(get_image_embeddings, None, text_content)
+            multimodal_embeddings = multimodal_embeddings.result()
+            queries = {
+                "text_embedding": text_embeddings.result(),
+                "image_embedding": multimodal_embeddings["Text Embedding"] if multimodal_embeddings else None,
+            }
+            same_modality_column = "text_embedding"
+
+        search_results = hybrid_search_patient_memories(patient_id, queries, same_modality_column)
+
+        if not search_results:
+            return "No memory matched this query closely enough"
+
+        return {
+            "memories": [
+                {
+                    "memory_id": memory_details["memory_id"],
+                    "patient_id": memory_details["patient_id"],
+                    "text_content": memory_details["text_content"],
+                    "score": round(memory_details["score"], 4),
+                }
+                for memory_details in search_results
+            ]
+        }
 
     except Exception as e:
         print("Exception is: " + str(e))
-        return "Couldn't parse your image file"
\ No newline at end of file
+        return "Couldn't parse your image file"
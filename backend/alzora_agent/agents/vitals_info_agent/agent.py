@@ -22,6 +22,8 @@ vitals_info_agent = LlmAgent(
         RULES TO GENERATE QUERY:
         - Pass the query to the tool which can be executed directly.
         - DO NOT INCLUDE ANY EXPLANATION OR MARKDOWN.
+        - Always bound the timestamp column to the period the user asks about. Without a bound the tool only returns the last 7 days.
+        - Select only the columns you need and aggregate in SQL where possible. Queries that would scan too much data are rejected; if that happens, narrow the time range or the columns and try again.
 
 
         FINAL SUMMARY OUTPUT INSTRUCTIONS:
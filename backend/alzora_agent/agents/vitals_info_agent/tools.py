@@ -1,12 +1,15 @@
-from alzora_agent.setup import get_bigquery_data
+from google.adk.tools import ToolContext
+from alzora_agent.query_gateway import QueryRejected, get_vitals_query_gateway
 
 
-def query_information_database(sql_query: str):
+def query_information_database(tool_context: ToolContext, sql_query: str):
     """To get the information from bigquery database"""
-    sql_query = sql_query.replace("```", "").replace("sql","")
+    patient_id = tool_context.state["patient_information"]["patient_id"]
     try:
-        search_results = get_bigquery_data(sql_query)
-        return [dict(row) for row in search_results]
+        return get_vitals_query_gateway().run(sql_query, patient_id)
+    except QueryRejected as e:
+        print("Query rejected: " + str(e))
+        return f"Query rejected: {e}"
     except Exception as e:
         print("Exception is: " + str(e))
-        return "Couldn't parse your image file"
\ No newline at end of file
+        return "Couldn't run the query on the vitals data"
@@ -0,0 +1,275 @@
+import io
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from .ttl_cache import TTLCache, content_hash
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+EMBEDDING_BACKEND = os.getenv("ALZORA_EMBEDDING_BACKEND", "vertex")  # "vertex" or "stub"
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("ALZORA_EMBEDDING_BATCH_WINDOW_MS", "15"))
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("ALZORA_EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_IMAGE_WORKERS = int(os.getenv("ALZORA_EMBEDDING_IMAGE_WORKERS", "4"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("ALZORA_EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("ALZORA_EMBEDDING_CACHE_TTL_SECONDS", "3600"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+PROJECT_ID = "alzora-474820"
+LOCATION = "us-central1"
+TEXT_EMBEDDING_MODEL = "text-embedding-005"
+IMAGE_EMBEDDING_MODEL = "multimodalembedding@001"
+
+
+# Image formats the multimodal model accepts as-is; anything else is re-encoded to PNG.
+VERTEX_IMAGE_FORMATS = {"PNG", "JPEG", "GIF", "BMP"}
+
+
+def load_image_for_embedding(file_bytes):
+    """Validate uploaded image bytes and return bytes the embedding model accepts."""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(file_bytes))
+    if image.format in VERTEX_IMAGE_FORMATS:
+        return bytes(file_bytes)
+    return image_to_bytes(image)
+
+
+def image_to_bytes(image):
+    """Return encoded image bytes, only re-encoding PIL images that have no source bytes."""
+    if image is None or isinstance(image, (bytes, bytearray)):
+        return image
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format=image.format if image.format in VERTEX_IMAGE_FORMATS else "PNG")
+    return img_bytes.getvalue()
+
+
+class EmbeddingCache(TTLCache):
+    """Embedding vectors keyed by content hash, sized by the ALZORA_EMBEDDING_CACHE_* settings."""
+
+    def __init__(self, max_entries=EMBEDDING_CACHE_SIZE, ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS):
+        super().__init__(max_entries, ttl_seconds)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent submissions into batched handler calls.
+
+    The first caller to arrive waits `window_seconds` for others to join and then
+    drains the queue in chunks of at most `max_batch_size` until its own payloads
+    are done, so callers that arrive within the window share one backend request. `handler` receives a list of
+    payloads and must return a list of results in the same order.
+    """
+
+    def __init__(self, handler, window_seconds, max_batch_size):
+        self.handler = handler
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._draining = False
+        self._lock = threading.Lock()
+
+    def submit(self, payloads):
+        futures = [Future() for _ in payloads]
+        with self._lock:
+            self._pending.extend(zip(payloads, futures))
+            leader = not self._draining
+            if leader:
+                self._draining = True
+
+        if leader:
+            if self.window_seconds > 0:
+                time.sleep(self.window_seconds)
+            self._drain(futures)
+
+        return [future.result() for future in futures]
+
+    def _drain(self, own=None):
+        """
+        Run batches until the caller's `own` futures are resolved; later arrivals
+        are left to a worker thread so the caller returns under sustained load.
+        Without `own` (the worker) the queue is drained until it is empty.
+        """
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._draining = False
+                    return
+                if own is not None and all(future.done() for future in own):
+                    threading.Thread(target=self._drain, name="micro-batcher", daemon=True).start()
+                    return
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._run(batch)
+
+    def _run(self, batch):
+        try:
+            results = list(self.handler([payload for payload, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        if len(results) != len(batch):
+            # Results can't be matched to payloads anymore, fail the batch instead of leaving callers waiting
+            error = RuntimeError(f"Batch handler returned {len(results)} results for {len(batch)} payloads")
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class VertexEmbeddingBackend:
+    """Vertex AI text-embedding-005 and multimodalembedding@001 models."""
+
+    name = "vertex"
+
+    def __init__(self, dimension=512, image_workers=EMBEDDING_IMAGE_WORKERS):
+        self.dimension = dimension
+        self.text_model = None
+        self.image_model = None
+        self._executor = ThreadPoolExecutor(max_workers=image_workers, thread_name_prefix="image-embedding")
+        self._init_lock = threading.Lock()
+
+    def _initialize(self):
+        import vertexai
+        from vertexai.language_models import TextEmbeddingModel
+        from vertexai.vision_models import MultiModalEmbeddingModel
+
+        with self._init_lock:
+            if self.text_model is None or self.image_model is None:
+                vertexai.init(project=PROJECT_ID, location=LOCATION)
+                self.text_model = TextEmbeddingModel.from_pretrained(TEXT_EMBEDDING_MODEL)
+                self.image_model = MultiModalEmbeddingModel.from_pretrained(IMAGE_EMBEDDING_MODEL)
+                print("Initialising Embedding Models ...")
+
+    def embed_texts(self, texts):
+        if self.text_model is None:
+            self._initialize()
+        embeddings = self.text_model.get_embeddings(texts=list(texts), output_dimensionality=self.dimension)
+        return [embedding.values for embedding in embeddings]
+
+    def _embed_image(self, item):
+        from vertexai.vision_models import Image
+
+        image_bytes, contextual_text = item
+        embeddings = self.image_model.get_embeddings(
+            image=Image(image_bytes=image_bytes) if image_bytes is not None else None,
+            contextual_text=contextual_text,
+            dimension=self.dimension,
+        )
+        return {"Image Embedding": embeddings.image_embedding, "Text Embedding": embeddings.text_embedding}
+
+    def embed_images(self, items):
+        # The multimodal model takes one image per request, so a batch is fanned
+        # out over a small worker pool instead of being sent sequentially.
+        if self.image_model is None:
+            self._initialize()
+        return list(self._executor.map(self._embed_image, items))
+
+
+class StubEmbeddingBackend:
+    """Deterministic, offline embeddings derived from the content hash. Meant for tests and local runs."""
+
+    name = "stub"
+
+    def __init__(self, dimension=512):
+        self.dimension = dimension
+        self.calls = 0
+
+    def _vector(self, *parts):
+        seed = int(content_hash(*parts)[:16], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).astype(np.float32).tolist()
+
+    def embed_texts(self, texts):
+        self.calls += 1
+        return [self._vector("text", text) for text in texts]
+
+    def embed_images(self, items):
+        self.calls += 1
+        return [
+            {
+                "Image Embedding": self._vector("image", image_bytes) if image_bytes is not None else None,
+                "Text Embedding": self._vector("multimodal-text", contextual_text) if contextual_text else None,
+            }
+            for image_bytes, contextual_text in items
+        ]
+
+
+def create_backend(name=EMBEDDING_BACKEND, dimension=512):
+    if name == "vertex":
+        return VertexEmbeddingBackend(dimension=dimension)
+    if name == "stub":
+        return StubEmbeddingBackend(dimension=dimension)
+    raise ValueError(f"Unknown embedding backend '{name}', expected 'vertex' or 'stub'")
+
+
+class EmbeddingService:
+    """
+    Shared embedding entry point for memory registration, memory search and MRI search.
+
+    Requests are answered from a content-hash cache where possible; the remaining
+    unique inputs are coalesced with concurrent callers into micro-batches.
+    """
+
+    def __init__(self, backend, cache=None, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch_size=EMBEDDING_MAX_BATCH_SIZE):
+        self.backend = backend
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self._text_batcher = MicroBatcher(self._embed_text_batch, window_ms / 1000.0, max_batch_size)
+        self._image_batcher = MicroBatcher(self._embed_image_batch, window_ms / 1000.0, max_batch_size)
+
+    def _embed_text_batch(self, payloads):
+        unique = list(dict.fromkeys(payloads))
+        results = dict(zip(unique, self.backend.embed_texts(unique)))
+        return [results[text] for text in payloads]
+
+    def _embed_image_batch(self, payloads):
+        unique = {key: item for key, item in payloads}
+        results = dict(zip(unique.keys(), self.backend.embed_images(list(unique.values()))))
+        return [results[key] for key, _ in payloads]
+
+    def _cached(self, keys, compute_missing):
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = compute_missing(missing)
+            for i, value in zip(missing, computed):
+                results[i] = value
+                self.cache.put(keys[i], value)
+        return results
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_hash("text", self.backend.name, text) for text in texts]
+        return self._cached(keys, lambda missing: self._text_batcher.submit([texts[i] for i in missing]))
+
+    def embed_images(self, images: List, contextual_texts: Optional[List[Optional[str]]] = None) -> List[dict]:
+        """Embed images (encoded bytes or PIL images) with optional contextual texts."""
+        if contextual_texts is None:
+            contextual_texts = [None] * len(images)
+        items = [(image_to_bytes(image), text) for image, text in zip(images, contextual_texts)]
+        keys = [content_hash("image", self.backend.name, image_bytes, text) for image_bytes, text in items]
+        return self._cached(keys, lambda missing: self._image_batcher.submit([(keys[i], items[i]) for i in missing]))
+
+
+_embedding_service = None
+_embedding_service_lock = threading.Lock()
+
+
+def get_embedding_service(dimension=512):
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_service_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(create_backend(dimension=dimension))
+    return _embedding_service
+
+
+def set_embedding_service(service):
+    """Swap the process-wide service, e.g. for one backed by StubEmbeddingBackend."""
+    global _embedding_service
+    _embedding_service = service
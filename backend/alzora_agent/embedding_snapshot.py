@@ -0,0 +1,370 @@
+"""
+Memory-mappable embedding snapshots of the Alzora vector tables.
+
+A snapshot of a table is a directory of plain .npy files plus a small JSON header:
+
+    <root>/<table>/CURRENT                 name of the live version directory
+    <root>/<table>/v000003/header.json     table, row count, dimension, dtype, watermark, ...
+    <root>/<table>/v000003/ids.npy         int64 primary keys
+    <root>/<table>/v000003/patient_ids.npy int64 (tables with a patient column)
+    <root>/<table>/v000003/<column>.npy    (rows, dim) float32 or int8 matrix per vector column
+    <root>/<table>/v000003/<column>.scales.npy   float32 per-row scale (int8 only)
+    <root>/<table>/v000003/<column>.present.npy  bool, False where the row had no vector
+    <root>/<table>/v000003/<label>.npy     str labels (e.g. mri_scan_type)
+
+Every array is contiguous and opened with mmap_mode="r", so opening a snapshot
+costs a few page faults instead of parsing JSON text. A rebuild re-reads the rows
+from EMBEDDING_SNAPSHOT_OVERLAP_SECONDS before the stored created_at watermark on
+(rows committed late with an older or equal created_at are picked up, the ones
+already there are replaced by id), merges them into the previous version and
+publishes a new version directory by atomically rewriting CURRENT.
+
+An incremental rebuild only ever adds rows: deleted memories, and rows updated
+in place without a new created_at (e.g. by reembed_memories), are only
+reflected after a rebuild with `export --full`.
+
+    python -m alzora_agent.embedding_snapshot export memories memories_embeddings --root snapshots --dtype int8
+    python -m alzora_agent.embedding_snapshot info --root snapshots
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+EMBEDDING_SNAPSHOT_DIR = os.getenv("EMBEDDING_SNAPSHOT_DIR", "")
+# dbt model alzora_dbt/models/vector_transformation/marts/memories_embeddings.sql
+MEMORIES_EMBEDDINGS_TABLE = os.getenv("MEMORIES_EMBEDDINGS_TABLE", "Alzora_Embeddings_Dataset_alzora_datawarehouse.memories_embeddings")
+EMBEDDING_SNAPSHOT_PAGE_SIZE = int(os.getenv("EMBEDDING_SNAPSHOT_PAGE_SIZE", "5000"))
+# How far before the watermark an incremental rebuild starts reading, for rows committed after newer ones
+EMBEDDING_SNAPSHOT_OVERLAP_SECONDS = float(os.getenv("EMBEDDING_SNAPSHOT_OVERLAP_SECONDS", "300"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_DTYPES = ("float32", "int8")
+
+SNAPSHOT_TABLES = {
+    "memories": {
+        "source": "tidb",
+        "table": "memories",
+        "id_column": "memory_id",
+        "patient_column": "patient_id",
+        "vector_columns": ["text_embedding", "image_embedding"],
+        "label_columns": [],
+        "cursor_column": "created_at",
+    },
+    "mri_image_embeddings": {
+        "source": "tidb",
+        "table": "mri_image_embeddings",
+        "id_column": "id",
+        "patient_column": None,
+        "vector_columns": ["embedding"],
+        "label_columns": ["mri_scan_type"],
+        # No created_at: a few hundred reference rows, always rebuilt in full
+        "cursor_column": None,
+    },
+    "memories_embeddings": {
+        "source": "bigquery",
+        "table": MEMORIES_EMBEDDINGS_TABLE,
+        "id_column": "memory_id",
+        "patient_column": "patient_id",
+        "vector_columns": ["text_embedding", "image_embedding"],
+        "label_columns": [],
+        "cursor_column": "created_at",
+    },
+}
+
+
+def quantize_int8(matrix):
+    """Symmetric per-row int8 quantization: matrix ~= values * scales[:, None]."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    max_abs = np.abs(matrix).max(axis=1) if matrix.size else np.zeros(len(matrix), dtype=np.float32)
+    scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+    values = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return values, scales
+
+
+class EmbeddingSnapshot:
+    """Read-only view of one published snapshot version; all arrays are memory-mapped."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "header.json")) as fh:
+            self.header = json.load(fh)
+        if self.header.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format {self.header.get('format_version')} in {path}")
+        # (sorted ids, their row numbers), built on the first id lookup
+        self._id_order = None
+
+    @classmethod
+    def open(cls, root, table):
+        """Open the live version of `table` under `root`, or return None when there is none."""
+        table_dir = os.path.join(root, table)
+        try:
+            with open(os.path.join(table_dir, "CURRENT")) as fh:
+                version = fh.read().strip()
+        except FileNotFoundError:
+            return None
+        return cls(os.path.join(table_dir, version))
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.header["rows"]
+
+    @property
+    def watermark(self):
+        return self.header.get("watermark")
+
+    @property
+    def ids(self):
+        return self._load("ids")
+
+    @property
+    def patient_ids(self):
+        return self._load("patient_ids") if self.header["patient_column"] else None
+
+    def labels(self, column):
+        return self._load(column)
+
+    def rows_of(self, ids):
+        """Row numbers of `ids` in this snapshot, -1 for ids it doesn't hold."""
+        if self._id_order is None:
+            all_ids = np.asarray(self.ids)
+            order = np.argsort(all_ids, kind="stable")
+            self._id_order = (all_ids[order], order)
+        sorted_ids, order = self._id_order
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == ids, order[positions], -1)
+
+    def present(self, column):
+        return self._load(f"{column}.present")
+
+    def raw_vectors(self, column):
+        """The stored matrix (float32 or int8) and, for int8, its per-row scales."""
+        scales = self._load(f"{column}.scales") if self.header["dtype"] == "int8" else None
+        return self._load(column), scales
+
+    def vectors(self, column, rows=None):
+        """float32 vectors of `column`, optionally only `rows` (index array or boolean mask)."""
+        matrix, scales = self.raw_vectors(column)
+        if rows is not None:
+            matrix = matrix[rows]
+            scales = scales[rows] if scales is not None else None
+        if scales is None:
+            return np.asarray(matrix, dtype=np.float32)
+        return matrix.astype(np.float32) * scales[:, None]
+
+
+def open_snapshot(table, root=EMBEDDING_SNAPSHOT_DIR):
+    if not root:
+        return None
+    return EmbeddingSnapshot.open(root, table)
+
+
+def rows_to_columns(rows, spec, dimension=None):
+    """Turn row dicts into the snapshot's column arrays (float32 vectors, zero rows where missing)."""
+    from .memory_index import to_vector
+
+    columns = {"ids": np.array([int(row[spec["id_column"]]) for row in rows], dtype=np.int64)}
+    if spec["patient_column"]:
+        columns["patient_ids"] = np.array([int(row[spec["patient_column"]]) for row in rows], dtype=np.int64)
+    for label in spec["label_columns"]:
+        columns[label] = np.array([str(row[label]) for row in rows], dtype=str)
+    for column in spec["vector_columns"]:
+        vectors = [to_vector(row.get(column)) for row in rows]
+        if dimension is None:
+            dimension = next((len(v) for v in vectors if v is not None), 0)
+        matrix = np.zeros((len(rows), dimension), dtype=np.float32)
+        present = np.zeros(len(rows), dtype=bool)
+        for i, vector in enumerate(vectors):
+            if vector is not None:
+                matrix[i] = vector
+                present[i] = True
+        columns[column] = matrix
+        columns[f"{column}.present"] = present
+    return columns, dimension
+
+
+def write_snapshot(root, table, spec, columns, dtype, dimension, watermark):
+    """Write `columns` as a new version of `table` and make it the live one."""
+    if dtype not in SNAPSHOT_DTYPES:
+        raise ValueError(f"dtype must be one of {SNAPSHOT_DTYPES}, got '{dtype}'")
+    table_dir = os.path.join(root, table)
+    os.makedirs(table_dir, exist_ok=True)
+    previous = EmbeddingSnapshot.open(root, table)
+    version_number = previous.header["version"] + 1 if previous else 1
+    version = f"v{version_number:06d}"
+    path = os.path.join(table_dir, version)
+    # A version directory left behind by a crashed export is simply overwritten
+    os.makedirs(path, exist_ok=True)
+
+    for name, array in columns.items():
+        if name in spec["vector_columns"] and dtype == "int8" and array.dtype != np.int8:
+            array, scales = quantize_int8(array)
+            np.save(os.path.join(path, f"{name}.scales.npy"), scales)
+        np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(array))
+
+    header = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "version": version_number,
+        "table": table,
+        "rows": int(len(columns["ids"])),
+        "dimension": int(dimension),
+        "dtype": dtype,
+        "id_column": spec["id_column"],
+        "patient_column": spec["patient_column"],
+        "vector_columns": spec["vector_columns"],
+        "label_columns": spec["label_columns"],
+        "cursor_column": spec["cursor_column"],
+        "watermark": watermark,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(path, "header.json"), "w") as fh:
+        json.dump(header, fh, indent=2)
+
+    # Publish: readers either see the old CURRENT or the new one, never a half-written version
+    current_tmp = os.path.join(table_dir, "CURRENT.tmp")
+    with open(current_tmp, "w") as fh:
+        fh.write(version)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(current_tmp, os.path.join(table_dir, "CURRENT"))
+
+    # Keep the previous version for readers that opened it a moment ago, drop older ones
+    for name in os.listdir(table_dir):
+        if name.startswith("v") and name not in (version, previous and os.path.basename(previous.path)):
+            shutil.rmtree(os.path.join(table_dir, name), ignore_errors=True)
+    return EmbeddingSnapshot(path)
+
+
+def merge_columns(previous, columns, spec):
+    """Previous version's arrays with the rows re-read since (same ids replaced) appended."""
+    keep = ~np.isin(previous.ids, columns["ids"])
+    merged = {"ids": np.concatenate([previous.ids[keep], columns["ids"]])}
+    if spec["patient_column"]:
+        merged["patient_ids"] = np.concatenate([previous.patient_ids[keep], columns["patient_ids"]])
+    for label in spec["label_columns"]:
+        merged[label] = np.concatenate([previous.labels(label)[keep], columns[label]])
+    for column in spec["vector_columns"]:
+        old, old_scales = previous.raw_vectors(column)
+        new = columns[column]
+        if old_scales is not None:
+            # Old rows stay quantized as they were, only the new ones are quantized now
+            new, new_scales = quantize_int8(new)
+            merged[f"{column}.scales"] = np.concatenate([old_scales[keep], new_scales])
+        merged[column] = np.concatenate([old[keep], new])
+        merged[f"{column}.present"] = np.concatenate([previous.present(column)[keep], columns[f"{column}.present"]])
+    return merged
+
+
+def overlap_start(watermark, overlap_seconds=EMBEDDING_SNAPSHOT_OVERLAP_SECONDS):
+    """The cursor value an incremental read from `watermark` starts at, `overlap_seconds` before it."""
+    if watermark is None:
+        return None
+    try:
+        return str(datetime.fromisoformat(str(watermark)) - timedelta(seconds=overlap_seconds))
+    except ValueError:
+        return watermark
+
+
+def fetch_tidb_rows(spec, watermark=None, page_size=EMBEDDING_SNAPSHOT_PAGE_SIZE):
+    """Rows of a TiDB table from the overlap window before `watermark` on, read in (cursor, id) keyset pages."""
+    from .setup import query_tidb
+
+    selected = [spec["id_column"]] + ([spec["patient_column"]] if spec["patient_column"] else []) + spec["label_columns"] + spec["vector_columns"]
+    id_column, cursor_column = spec["id_column"], spec["cursor_column"]
+    if cursor_column is None:
+        return query_tidb(f"SELECT {', '.join(selected)} FROM {spec['table']} ORDER BY {id_column}").to_list()
+
+    rows, last = [], None
+    while True:
+        if last is None and watermark is None:
+            where, params = "", {}
+        elif last is None:
+            where, params = f"WHERE {cursor_column} >= :since", {"since": overlap_start(watermark)}
+        else:
+            where = f"WHERE ({cursor_column} > :last_cursor OR ({cursor_column} = :last_cursor AND {id_column} > :last_id))"
+            params = {"last_cursor": last[0], "last_id": last[1]}
+        page = query_tidb(
+            f"SELECT {', '.join(selected + [cursor_column])} FROM {spec['table']} {where} "
+            f"ORDER BY {cursor_column}, {id_column} LIMIT {int(page_size)}",
+            params,
+        ).to_list()
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        last = (page[-1][cursor_column], page[-1][id_column])
+
+
+def fetch_bigquery_rows(spec, watermark=None):
+    from .setup import get_bigquery_data
+
+    selected = [spec["id_column"]] + ([spec["patient_column"]] if spec["patient_column"] else []) + spec["label_columns"] + spec["vector_columns"]
+    query = f"SELECT {', '.join(selected + [spec['cursor_column']])} FROM `{spec['table']}`"
+    if watermark is not None:
+        query += f" WHERE cast({spec['cursor_column']} as timestamp) >= timestamp('{overlap_start(watermark)}')"
+    return [dict(row.items()) for row in get_bigquery_data(query)]
+
+
+def export_table(root, table, dtype="float32", full=False):
+    """Build or incrementally refresh the snapshot of `table`; returns the published EmbeddingSnapshot."""
+    spec = SNAPSHOT_TABLES[table]
+    previous = EmbeddingSnapshot.open(root, table)
+    incremental = (
+        not full and previous is not None and spec["cursor_column"] is not None
+        and previous.header["dtype"] == dtype and previous.watermark is not None
+    )
+    watermark = previous.watermark if incremental else None
+
+    fetch = fetch_tidb_rows if spec["source"] == "tidb" else fetch_bigquery_rows
+    rows = fetch(spec, watermark)
+    # The overlap window returns rows the snapshot already has; merge_columns replaces them by id
+    if incremental and all(np.isin([int(row[spec["id_column"]]) for row in rows], previous.ids)):
+        print(f"{table}: no new rows since {watermark}, snapshot v{previous.header['version']} is current")
+        return previous
+
+    dimension = previous.header["dimension"] if incremental else None
+    columns, dimension = rows_to_columns(rows, spec, dimension)
+    cursors = [row[spec["cursor_column"]] for row in rows if row.get(spec["cursor_column"]) is not None] if spec["cursor_column"] else []
+    if cursors:
+        latest = max(cursors)
+        # Never move back, e.g. when the newest rows have been deleted since
+        if watermark is None or datetime.fromisoformat(str(latest)) > datetime.fromisoformat(str(watermark)):
+            watermark = str(latest)
+    if incremental:
+        columns = merge_columns(previous, columns, spec)
+
+    snapshot = write_snapshot(root, table, spec, columns, dtype, dimension, watermark)
+    print(f"{table}: wrote snapshot v{snapshot.header['version']} with {len(snapshot)} rows "
+          f"({len(rows)} {'re-read' if incremental else 'total'}), watermark {watermark}")
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "info"])
+    parser.add_argument("tables", nargs="*", default=list(SNAPSHOT_TABLES))
+    parser.add_argument("--root", default=EMBEDDING_SNAPSHOT_DIR or "snapshots")
+    parser.add_argument("--dtype", choices=SNAPSHOT_DTYPES, default="float32")
+    parser.add_argument("--full", action="store_true", help="rebuild from scratch instead of from the watermark; needed to drop deleted rows")
+    args = parser.parse_args()
+
+    for table in args.tables:
+        if args.command == "export":
+            export_table(args.root, table, dtype=args.dtype, full=args.full)
+        else:
+            snapshot = EmbeddingSnapshot.open(args.root, table)
+            print(f"{table}: " + (json.dumps(snapshot.header) if snapshot else "no snapshot"))
+
+
+if __name__ == "__main__":
+    main()
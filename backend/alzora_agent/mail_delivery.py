@@ -0,0 +1,440 @@
+"""
+Outbound mail for the weekly reports and the safe-zone alerts.
+
+Callers build an EmailMessage (new_message sets the sender) and hand it to
+MailService.send, which writes it to a SQLite outbox and returns at once.
+A dispatcher thread delivers due messages over a pool of logged-in SMTP
+connections and reschedules failed ones with exponential backoff; anything
+still in the outbox when the process dies is delivered by the next process
+that opens it. Delivery is at-least-once: a crash between the server
+accepting a message and the outbox recording it sends that message again.
+
+Only the standard library and certifi are used, so Misc/mail_alert_kafka.py
+imports this file directly, outside the alzora_agent package.
+"""
+import json
+import os
+import queue
+import random
+import smtplib
+import sqlite3
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.utils import formataddr, getaddresses, parseaddr
+
+import certifi
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+MAIL_SENDER_EMAIL = os.getenv("MAIL_SENDER_EMAIL", "nikhilsmankani@gmail.com")
+MAIL_SENDER_NAME = os.getenv("MAIL_SENDER_NAME", "Alzora Team")
+MAIL_SMTP_HOST = os.getenv("MAIL_SMTP_HOST", "smtp.gmail.com")
+MAIL_SMTP_PORT = int(os.getenv("MAIL_SMTP_PORT", "465"))
+# "ssl" for SMTP_SSL, "plain" for a local debugging server (python -m aiosmtpd -n)
+MAIL_SMTP_MODE = os.getenv("MAIL_SMTP_MODE", "ssl")
+MAIL_SMTP_PASSWORD = os.getenv("GAPP_PASS")
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", "4"))
+MAIL_IDLE_CHECK_SECONDS = float(os.getenv("MAIL_IDLE_CHECK_SECONDS", "60"))
+MAIL_OUTBOX_PATH = os.getenv("MAIL_OUTBOX_PATH", "mail_outbox.sqlite3")
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "8"))
+MAIL_RETRY_BACKOFF_SECONDS = float(os.getenv("MAIL_RETRY_BACKOFF_SECONDS", "5"))
+MAIL_RETRY_MAX_BACKOFF_SECONDS = float(os.getenv("MAIL_RETRY_MAX_BACKOFF_SECONDS", "900"))
+# A message claimed by a process that died goes back to pending after this long
+MAIL_CLAIM_LEASE_SECONDS = float(os.getenv("MAIL_CLAIM_LEASE_SECONDS", "300"))
+# How often the outbox is polled for messages queued by other processes
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "5"))
+MAIL_KEEP_SENT_SECONDS = float(os.getenv("MAIL_KEEP_SENT_SECONDS", str(7 * 86400)))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+
+def new_message(to, subject, body):
+    """EmailMessage from the configured sender; `to` is an address or a list of them."""
+    msg = EmailMessage()
+    msg["From"] = formataddr((MAIL_SENDER_NAME, MAIL_SENDER_EMAIL))
+    msg["To"] = to if isinstance(to, str) else ", ".join(to)
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
+
+
+def is_permanent_failure(error):
+    """5xx rejections of the message itself will fail the same way on every retry."""
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    # A rejected login is a configuration problem; keep the message until it is fixed
+    if isinstance(error, smtplib.SMTPResponseException) and not isinstance(error, smtplib.SMTPAuthenticationError):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+class SMTPConnectionPool:
+    """Keeps up to `size` logged-in SMTP connections open and reuses them across messages."""
+
+    def __init__(self, host=MAIL_SMTP_HOST, port=MAIL_SMTP_PORT, mode=MAIL_SMTP_MODE, username=MAIL_SENDER_EMAIL, password=MAIL_SMTP_PASSWORD, size=MAIL_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.mode = mode
+        self.username = username
+        self.password = password
+        self.size = size
+        self.connections_opened = 0
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        if self.mode == "ssl":
+            context = ssl.create_default_context(cafile=certifi.where())
+            server = smtplib.SMTP_SSL(self.host, self.port, context=context)
+        else:
+            server = smtplib.SMTP(self.host, self.port)
+        if self.password:
+            server.login(self.username, self.password)
+        self.connections_opened += 1
+        return server
+
+    def _checkout(self):
+        while True:
+            try:
+                server, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - last_used < MAIL_IDLE_CHECK_SECONDS:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except smtplib.SMTPException:
+                pass
+            self._discard(server)
+
+    @staticmethod
+    def _discard(server):
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+    def send(self, sender, recipients, data):
+        with self._slots:
+            server = self._checkout()
+            try:
+                server.sendmail(sender, recipients, data)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server answered (and sendmail reset the session), the connection is still good
+                self._idle.put((server, time.monotonic()))
+                raise
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # Stale connection, one retry on a fresh one
+                self._discard(server)
+                server = self._connect()
+                try:
+                    server.sendmail(sender, recipients, data)
+                except Exception:
+                    self._discard(server)
+                    raise
+            self._idle.put((server, time.monotonic()))
+
+    def close(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(server)
+
+
+class Outbox:
+    """
+    SQLite table of outgoing messages: pending -> sending -> sent / failed.
+
+    Claims are made in one write transaction, so several processes can share
+    the file without sending a message twice; a claim older than `lease_seconds`
+    is considered abandoned and handed out again.
+    """
+
+    def __init__(self, path=MAIL_OUTBOX_PATH, lease_seconds=MAIL_CLAIM_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    sender TEXT NOT NULL,
+                    recipients TEXT NOT NULL,
+                    message BLOB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_at REAL,
+                    sent_at REAL,
+                    last_error TEXT
+                )
+            """)
+            self._db.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+
+    def add(self, kind, sender, recipients, data):
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (kind, sender, recipients, message, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, sender, json.dumps(recipients), data, now, now),
+            )
+        return cursor.lastrowid
+
+    def claim(self, limit):
+        """Mark up to `limit` due messages as sending and return them as dicts."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < ?",
+                    (now - self.lease_seconds,),
+                )
+                rows = self._db.execute(
+                    "SELECT id, kind, sender, recipients, message, attempts, created_at FROM outbox"
+                    " WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                    (now, limit),
+                ).fetchall()
+                self._db.executemany(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        columns = ("id", "kind", "sender", "recipients", "message", "attempts", "created_at")
+        claimed = [dict(zip(columns, row)) for row in rows]
+        for item in claimed:
+            item["recipients"] = json.loads(item["recipients"])
+        return claimed
+
+    def next_due(self):
+        with self._lock:
+            row = self._db.execute("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'").fetchone()
+        return row[0]
+
+    def mark_sent(self, message_id, attempts):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?",
+                (attempts, time.time(), message_id),
+            )
+
+    def mark_retry(self, message_id, attempts, next_attempt_at, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, error, message_id),
+            )
+
+    def mark_failed(self, message_id, attempts, error):
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, error, message_id),
+            )
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: 0 for status in ("pending", "sending", "sent", "failed")} | dict(rows)
+
+    def unfinished(self, message_ids):
+        """How many of these messages are still pending or sending."""
+        message_ids = list(message_ids)
+        count = 0
+        with self._lock:
+            # Chunked below SQLite's bound parameter limit
+            for start in range(0, len(message_ids), 500):
+                chunk = message_ids[start:start + 500]
+                count += self._db.execute(
+                    f"SELECT COUNT(*) FROM outbox WHERE status IN ('pending', 'sending') AND id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchone()[0]
+        return count
+
+    def prune(self, keep_sent_seconds=MAIL_KEEP_SENT_SECONDS):
+        with self._lock:
+            self._db.execute("DELETE FROM outbox WHERE status = 'sent' AND sent_at < ?", (time.time() - keep_sent_seconds,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class MailService:
+    """
+    Non-blocking mail delivery: send() persists the message and returns its outbox id.
+
+    A dispatcher thread claims due messages from the outbox and delivers them on
+    `workers` threads through `pool`. Failures are retried with exponential
+    backoff and jitter up to `max_attempts`; permanent rejections fail at once.
+    """
+
+    def __init__(
+        self,
+        outbox=None,
+        pool=None,
+        workers=MAIL_POOL_SIZE,
+        max_attempts=MAIL_MAX_ATTEMPTS,
+        backoff_seconds=MAIL_RETRY_BACKOFF_SECONDS,
+        max_backoff_seconds=MAIL_RETRY_MAX_BACKOFF_SECONDS,
+        poll_seconds=MAIL_POLL_SECONDS,
+    ):
+        self.outbox = outbox or Outbox()
+        self.pool = pool or SMTPConnectionPool(size=workers)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.stats = {"queued": 0, "attempts": 0, "sent": 0, "retried": 0, "failed": 0, "delivery_seconds_total": 0.0, "delivery_seconds_max": 0.0}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mail")
+        self._wake = threading.Condition()
+        self._signaled = False
+        self._stopping = False
+        self._inflight = 0
+        self.outbox.prune()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="mail-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def send(self, msg, kind="mail"):
+        recipients = [address for _, address in getaddresses(msg.get_all("To", []) + msg.get_all("Cc", []) + msg.get_all("Bcc", [])) if address]
+        if not recipients:
+            raise ValueError(f"{kind} message '{msg['Subject']}' has no recipients")
+        sender = parseaddr(msg["From"] or "")[1] or MAIL_SENDER_EMAIL
+        del msg["Bcc"]
+        # sendmail passes bytes through as-is, so they must already use SMTP line endings
+        data = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+        message_id = self.outbox.add(kind, sender, recipients, data)
+        with self._wake:
+            self.stats["queued"] += 1
+        self._signal()
+        return message_id
+
+    def _signal(self):
+        with self._wake:
+            self._signaled = True
+            self._wake.notify_all()
+
+    def _dispatch(self):
+        while True:
+            with self._wake:
+                if self._stopping:
+                    return
+                free = self.workers - self._inflight
+            claimed = self.outbox.claim(free) if free > 0 else []
+            for item in claimed:
+                with self._wake:
+                    self._inflight += 1
+                self._executor.submit(self._deliver, item)
+            if claimed:
+                continue
+
+            # Sleep until something is queued, a worker frees up or the next retry is due
+            timeout = self.poll_seconds
+            next_due = self.outbox.next_due() if free > 0 else None
+            if next_due is not None:
+                timeout = min(timeout, max(next_due - time.time(), 0.01))
+            with self._wake:
+                if not self._signaled and not self._stopping:
+                    self._wake.wait(timeout)
+                self._signaled = False
+
+    def _deliver(self, item):
+        attempts = item["attempts"] + 1
+        try:
+            with self._wake:
+                self.stats["attempts"] += 1
+            self.pool.send(item["sender"], item["recipients"], item["message"])
+            self.outbox.mark_sent(item["id"], attempts)
+            latency = time.time() - item["created_at"]
+            with self._wake:
+                self.stats["sent"] += 1
+                self.stats["delivery_seconds_total"] += latency
+                self.stats["delivery_seconds_max"] = max(self.stats["delivery_seconds_max"], latency)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if is_permanent_failure(e) or attempts >= self.max_attempts:
+                print(f"Giving up on {item['kind']} message {item['id']} to {item['recipients']} after {attempts} attempts:", error)
+                self.outbox.mark_failed(item["id"], attempts, error)
+                with self._wake:
+                    self.stats["failed"] += 1
+            else:
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                print(f"Couldn't send {item['kind']} message {item['id']} (attempt {attempts}), retrying in {delay:.0f}s:", error)
+                self.outbox.mark_retry(item["id"], attempts, time.time() + delay, error)
+                with self._wake:
+                    self.stats["retried"] += 1
+        finally:
+            with self._wake:
+                self._inflight -= 1
+            self._signal()
+
+    def metrics(self):
+        """Delivery counters of this process plus the outbox backlog shared by all processes."""
+        with self._wake:
+            metrics = dict(self.stats)
+            metrics["inflight"] = self._inflight
+        metrics["delivery_seconds_avg"] = metrics["delivery_seconds_total"] / metrics["sent"] if metrics["sent"] else 0.0
+        metrics["connections_opened"] = self.pool.connections_opened
+        metrics["outbox"] = self.outbox.counts()
+        return metrics
+
+    def flush(self, timeout=None, message_ids=None):
+        """
+        Wait until the outbox holds nothing pending or sending, or with
+        `message_ids` (as returned by `send`) until just those are done.
+        Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if message_ids is not None:
+                done = self.outbox.unfinished(message_ids) == 0
+            else:
+                counts = self.outbox.counts()
+                done = counts["pending"] == 0 and counts["sending"] == 0
+            if done:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def close(self):
+        """Stop dispatching; messages not yet delivered stay in the outbox for the next run."""
+        with self._wake:
+            self._stopping = True
+            self._wake.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+        self.outbox.close()
+
+
+_mail_service = None
+_mail_service_lock = threading.Lock()
+
+
+def get_mail_service():
+    global _mail_service
+    if _mail_service is None:
+        with _mail_service_lock:
+            if _mail_service is None:
+                _mail_service = MailService()
+    return _mail_service
+
+
+def set_mail_service(service):
+    """Swap the process-wide service, e.g. for tests or to send through a local stand-in server."""
+    global _mail_service
+    _mail_service = service
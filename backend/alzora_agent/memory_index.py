@@ -0,0 +1,502 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .setup import query_tidb, embedding_dimension
+from .embedding_snapshot import open_snapshot, overlap_start, quantize_int8
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# "none" keeps float32 vectors in memory, "int8" keeps int8 codes and re-ranks
+# the best candidates on exact float vectors
+MEMORY_INDEX_COMPRESSION = os.getenv("MEMORY_INDEX_COMPRESSION", "none")
+MEMORY_INDEX_RERANK_CANDIDATES = int(os.getenv("MEMORY_INDEX_RERANK_CANDIDATES", "32"))
+# Hybrid text + image search: "rrf" (reciprocal rank fusion) or "weighted" (summed cosine similarity)
+MEMORY_SEARCH_FUSION = os.getenv("MEMORY_SEARCH_FUSION", "rrf")
+MEMORY_SEARCH_TOP_K = int(os.getenv("MEMORY_SEARCH_TOP_K", "3"))
+MEMORY_SEARCH_FUSION_CANDIDATES = int(os.getenv("MEMORY_SEARCH_FUSION_CANDIDATES", "50"))
+# Weight of the column searched across modalities (text query -> image_embedding and vice versa)
+MEMORY_SEARCH_CROSS_MODAL_WEIGHT = float(os.getenv("MEMORY_SEARCH_CROSS_MODAL_WEIGHT", "0.5"))
+# Cosine distance a hit must be within in the same-modality / cross-modality column to count as a match
+MEMORY_SEARCH_MAX_DISTANCE = float(os.getenv("MEMORY_SEARCH_MAX_DISTANCE", "0.6"))
+MEMORY_SEARCH_MAX_CROSS_MODAL_DISTANCE = float(os.getenv("MEMORY_SEARCH_MAX_CROSS_MODAL_DISTANCE", "0.85"))
+# A loaded index picks up rows other workers registered at most this long ago
+MEMORY_INDEX_REFRESH_SECONDS = float(os.getenv("MEMORY_INDEX_REFRESH_SECONDS", "30"))
+# Rows created this long before the newest one seen are re-read too: created_at is
+# set by the registering worker, so rows can commit out of created_at order
+MEMORY_INDEX_REFRESH_OVERLAP_SECONDS = float(os.getenv("MEMORY_INDEX_REFRESH_OVERLAP_SECONDS", "60"))
+# After this long the index is reloaded in full, which also drops deleted memories
+MEMORY_INDEX_MAX_AGE_SECONDS = float(os.getenv("MEMORY_INDEX_MAX_AGE_SECONDS", "3600"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+MEMORY_INDEX_COMPRESSIONS = ("none", "int8")
+RRF_K = 60
+# int8 codes are widened to float32 this many rows at a time while scoring
+INT8_SCORE_BLOCK_ROWS = 4096
+
+# Columns of the `memories` table that hold vectors and can be searched. Each
+# holds a single embedding space: text_embedding is text-embedding-005 of the
+# text, image_embedding the multimodal image vector (rows registered before this
+# was so are fixed with `python -m alzora_agent.reembed_memories`).
+VECTOR_COLUMNS = ("text_embedding", "image_embedding")
+
+
+def to_vector(value):
+    """Convert a TiDB vector value ("[0.1,0.2,...]", bytes or list) to a float32 array, or None."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8")
+    if isinstance(value, str):
+        value = value.strip()
+        if value in ("", "[]", "null"):
+            return None
+        value = json.loads(value)
+    vector = np.asarray(value, dtype=np.float32)
+    if vector.size == 0:
+        return None
+    return vector
+
+
+def normalize(vector):
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+def to_datetime(value):
+    """A created_at value (datetime or its string form) as a datetime, or None."""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class PatientMemoryIndex:
+    """
+    In-process cosine index over the memories of a single patient.
+
+    Every vector column is kept as an L2-normalised float32 matrix whose rows line
+    up with `memory_ids` / `text_contents`. Rows without a vector for a column are
+    masked out of that column's search.
+
+    With compression="int8" the matrices hold int8 codes plus a float32 scale per
+    row (a quarter of the memory). A search then scores every row on the codes,
+    keeps the best `rerank_candidates` and re-ranks those exactly on float vectors
+    fetched through `rerank_source(memory_ids, column)`; without a source the
+    approximate ranking is returned as is.
+
+    Adding a memory_id that is already in the index is a no-op, so overlapping
+    reads can be added as they are. `latest_created_at` is the newest created_at
+    of the added rows, from where a refresh reads on.
+    """
+
+    def __init__(self, patient_id, dimension=embedding_dimension, compression=MEMORY_INDEX_COMPRESSION,
+                 rerank_source=None, rerank_candidates=MEMORY_INDEX_RERANK_CANDIDATES):
+        if compression not in MEMORY_INDEX_COMPRESSIONS:
+            raise ValueError(f"compression must be one of {MEMORY_INDEX_COMPRESSIONS}, got '{compression}'")
+        self.patient_id = patient_id
+        self.dimension = dimension
+        self.compression = compression
+        self.rerank_source = rerank_source
+        self.rerank_candidates = rerank_candidates
+        self.memory_ids = np.empty(0, dtype=np.int64)
+        self.text_contents = np.empty(0, dtype=object)
+        matrix_dtype = np.int8 if compression == "int8" else np.float32
+        self.vectors = {column: np.empty((0, dimension), dtype=matrix_dtype) for column in VECTOR_COLUMNS}
+        self.scales = {column: np.empty(0, dtype=np.float32) for column in VECTOR_COLUMNS}
+        self.masks = {column: np.empty(0, dtype=bool) for column in VECTOR_COLUMNS}
+        self.latest_created_at = None
+        self.loaded_at = self.refreshed_at = time.monotonic()
+        self._known_ids = set()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.memory_ids)
+
+    @property
+    def nbytes(self):
+        return sum(self.vectors[column].nbytes + self.scales[column].nbytes for column in VECTOR_COLUMNS)
+
+    def _row(self, vector):
+        if vector is None:
+            return np.zeros(self.dimension, dtype=np.float32), False
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Expected a {self.dimension}-dim vector, got shape {vector.shape}")
+        return normalize(vector), True
+
+    def note_created_at(self, value):
+        created_at = to_datetime(value)
+        if created_at is not None and (self.latest_created_at is None or created_at > self.latest_created_at):
+            self.latest_created_at = created_at
+
+    def add_many(self, rows):
+        """Append rows of dicts with memory_id, text_content, the vector columns and optionally created_at."""
+        with self._lock:
+            rows = list({int(r["memory_id"]): r for r in rows if int(r["memory_id"]) not in self._known_ids}.values())
+            for r in rows:
+                self.note_created_at(r.get("created_at"))
+            if not rows:
+                return
+            self._known_ids.update(int(r["memory_id"]) for r in rows)
+            self.memory_ids = np.concatenate([self.memory_ids, np.array([int(r["memory_id"]) for r in rows], dtype=np.int64)])
+            self.text_contents = np.concatenate([self.text_contents, np.array([r.get("text_content") for r in rows], dtype=object)])
+            for column in VECTOR_COLUMNS:
+                converted = [self._row(to_vector(r.get(column))) for r in rows]
+                matrix = np.stack([vector for vector, _ in converted])
+                mask = np.array([present for _, present in converted], dtype=bool)
+                if self.compression == "int8":
+                    matrix, scales = quantize_int8(matrix)
+                    self.scales[column] = np.concatenate([self.scales[column], scales])
+                self.vectors[column] = np.concatenate([self.vectors[column], matrix])
+                self.masks[column] = np.concatenate([self.masks[column], mask])
+
+    def add(self, memory_id, text_content, text_embedding=None, image_embedding=None):
+        self.add_many([{
+            "memory_id": memory_id,
+            "text_content": text_content,
+            "text_embedding": text_embedding,
+            "image_embedding": image_embedding,
+        }])
+
+    @staticmethod
+    def _top(scores, top_k):
+        top_k = min(top_k, scores.size)
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        return best[np.argsort(-scores[best])]
+
+    def _column_scores(self, query, column, shortlist_size, matrix, scales, mask, memory_ids):
+        """
+        Cosine similarity of every row to `query` (-inf where the row has no vector) and
+        the indices of the best `shortlist_size` rows, best first. int8 scores are
+        approximate, except on the shortlist when a re-rank source is set.
+        """
+        # Score every row and mask afterwards: indexing the matrix first would copy it
+        if self.compression == "int8":
+            scores = np.empty(len(matrix), dtype=np.float32)
+            for start in range(0, len(matrix), INT8_SCORE_BLOCK_ROWS):
+                block = matrix[start:start + INT8_SCORE_BLOCK_ROWS]
+                scores[start:start + len(block)] = block.astype(np.float32) @ query
+            scores *= scales
+        else:
+            scores = matrix @ query
+        scores[~mask] = -np.inf
+
+        shortlist_size = min(shortlist_size, int(mask.sum()))
+        if shortlist_size == 0:
+            return scores, np.empty(0, dtype=np.int64)
+        if self.compression == "int8" and self.rerank_source is not None:
+            shortlist = self._top(scores, max(shortlist_size, self.rerank_candidates))
+            shortlist = shortlist[np.isfinite(scores[shortlist])]
+            exact = np.asarray(self.rerank_source(memory_ids[shortlist], column), dtype=np.float32)
+            norms = np.linalg.norm(exact, axis=1)
+            scores[shortlist] = (exact @ query) / np.where(norms == 0, 1.0, norms)
+            return scores, shortlist[np.argsort(-scores[shortlist])][:shortlist_size]
+        return scores, self._top(scores, shortlist_size)
+
+    def _arrays(self, column):
+        with self._lock:
+            return self.vectors[column], self.scales[column], self.masks[column], self.memory_ids, self.text_contents
+
+    def search(self, query_vector, column="text_embedding", top_k=1):
+        """
+        Cosine top-k over one vector column, exact unless compressed without a re-rank source.
+        Returns a list of dicts with memory_id, patient_id, text_content and distance
+        (cosine distance, 1 - similarity, the same measure BigQuery VECTOR_SEARCH reports).
+        """
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        matrix, scales, mask, memory_ids, text_contents = self._arrays(column)
+        scores, best = self._column_scores(query, column, top_k, matrix, scales, mask, memory_ids)
+        return [
+            {
+                "memory_id": int(memory_ids[i]),
+                "patient_id": self.patient_id,
+                "text_content": text_contents[i],
+                "distance": float(1.0 - scores[i]),
+            }
+            for i in best
+        ]
+
+    def hybrid_search(self, queries, top_k=MEMORY_SEARCH_TOP_K, fusion=MEMORY_SEARCH_FUSION, weights=None,
+                      max_distances=None, candidates=MEMORY_SEARCH_FUSION_CANDIDATES):
+        """
+        Search several vector columns in one pass and fuse the rankings.
+
+        `queries` maps a column to its query vector (None to skip it). With
+        fusion="rrf" every column contributes weight / (RRF_K + rank) for its best
+        `candidates` rows; with fusion="weighted" the weighted cosine similarities are
+        summed. A hit is kept only if, in at least one searched column, its distance
+        is within `max_distances[column]`, so an empty result means "no good match".
+        Hits carry memory_id, patient_id, text_content, the fused score and the
+        per-column cosine distances.
+        """
+        weights = weights or {}
+        max_distances = max_distances or {}
+        if fusion not in ("rrf", "weighted"):
+            raise ValueError(f"Unknown fusion '{fusion}', expected 'rrf' or 'weighted'")
+
+        with self._lock:
+            arrays = {column: (self.vectors[column], self.scales[column], self.masks[column]) for column in VECTOR_COLUMNS}
+            memory_ids, text_contents = self.memory_ids, self.text_contents
+
+        column_scores = {}
+        fused = np.zeros(len(memory_ids), dtype=np.float64)
+        matched = np.zeros(len(memory_ids), dtype=bool)
+        for column, query_vector in queries.items():
+            if query_vector is None:
+                continue
+            query = normalize(np.asarray(query_vector, dtype=np.float32))
+            matrix, scales, mask = arrays[column]
+            scores, shortlist = self._column_scores(query, column, candidates, matrix, scales, mask, memory_ids)
+            column_scores[column] = scores
+            weight = weights.get(column, 1.0)
+            if fusion == "rrf":
+                fused[shortlist] += weight / (RRF_K + np.arange(1, len(shortlist) + 1))
+                matched[shortlist] = True
+            else:
+                fused += weight * np.where(mask, scores, 0.0)
+                matched |= mask
+
+        if not matched.any():
+            return []
+        fused[~matched] = -np.inf
+
+        hits = []
+        for i in self._top(fused, int(matched.sum())):
+            distances = {
+                column: float(1.0 - scores[i]) for column, scores in column_scores.items() if np.isfinite(scores[i])
+            }
+            if not any(distance <= max_distances.get(column, np.inf) for column, distance in distances.items()):
+                continue
+            hits.append({
+                "memory_id": int(memory_ids[i]),
+                "patient_id": self.patient_id,
+                "text_content": text_contents[i],
+                "score": float(fused[i]),
+                "distances": distances,
+            })
+            if len(hits) == top_k:
+                break
+        return hits
+
+
+def fetch_memory_vectors(memory_ids, column):
+    """Float vectors of `column` for `memory_ids` from TiDB, aligned with memory_ids (zeros where missing)."""
+    if column not in VECTOR_COLUMNS:
+        raise ValueError(f"Unknown vector column '{column}'")
+    id_list = ", ".join(str(int(memory_id)) for memory_id in memory_ids)
+    rows = query_tidb(f"SELECT memory_id, {column} FROM memories WHERE memory_id IN ({id_list})").to_list()
+    vectors = {int(row["memory_id"]): to_vector(row[column]) for row in rows}
+    matrix = np.zeros((len(memory_ids), embedding_dimension), dtype=np.float32)
+    for i, memory_id in enumerate(memory_ids):
+        if vectors.get(int(memory_id)) is not None:
+            matrix[i] = vectors[int(memory_id)]
+    return matrix
+
+
+def snapshot_rerank_source(snapshot):
+    """Re-rank from a float32 `memories` snapshot (page cache, not heap), falling back to TiDB for newer rows."""
+
+    def rerank_source(memory_ids, column):
+        rows = snapshot.rows_of(memory_ids)
+        if (rows < 0).any():
+            return fetch_memory_vectors(memory_ids, column)
+        return snapshot.vectors(column, rows)
+
+    return rerank_source
+
+
+# snapshot version path -> re-rank source shared by every patient index loaded from that version,
+# so the snapshot's id lookup exists once per process rather than once per patient
+_snapshot_rerank_sources = {}
+_snapshot_rerank_sources_lock = threading.Lock()
+
+
+def shared_snapshot_rerank_source(snapshot):
+    with _snapshot_rerank_sources_lock:
+        source = _snapshot_rerank_sources.get(snapshot.path)
+        if source is None:
+            # Indexes loaded from an older version keep their own reference to it
+            _snapshot_rerank_sources.clear()
+            source = _snapshot_rerank_sources[snapshot.path] = snapshot_rerank_source(snapshot)
+        return source
+
+
+# patient_id -> PatientMemoryIndex, populated lazily on first search
+_patient_indexes = {}
+_patient_indexes_lock = threading.Lock()
+# patient_id -> lock held while that patient's index is (re)loaded, so one load never stalls other patients
+_patient_load_locks = {}
+# patient_id -> rows registered while that patient's index is being loaded
+_loading = {}
+_loading_lock = threading.Lock()
+
+def load_snapshot_rows(snapshot, patient_id):
+    """
+    A patient's memories with vectors taken from the `memories` embedding snapshot.
+    Only text contents and rows from the snapshot's overlap window on come from
+    TiDB, so the vectors are not transferred and parsed as text on every load.
+    """
+    texts = {
+        int(row["memory_id"]): row["text_content"]
+        for row in query_tidb("SELECT memory_id, text_content FROM memories WHERE patient_id = :patient_id", {"patient_id": patient_id}).to_list()
+    }
+    selected = np.flatnonzero(snapshot.patient_ids == patient_id)
+    memory_ids = snapshot.ids[selected]
+    vectors = {column: snapshot.vectors(column, selected) for column in VECTOR_COLUMNS}
+    present = {column: snapshot.present(column)[selected] for column in VECTOR_COLUMNS}
+
+    rows = [
+        dict(
+            memory_id=int(memory_id),
+            text_content=texts[int(memory_id)],
+            **{column: vectors[column][i] if present[column][i] else None for column in VECTOR_COLUMNS},
+        )
+        # Memories deleted since the snapshot was taken are skipped
+        for i, memory_id in enumerate(memory_ids) if int(memory_id) in texts
+    ]
+    known = {row["memory_id"] for row in rows}
+    newer = query_tidb(
+        "SELECT memory_id, text_content, text_embedding, image_embedding, created_at FROM memories "
+        "WHERE patient_id = :patient_id AND created_at >= :since ORDER BY memory_id",
+        {"patient_id": patient_id, "since": overlap_start(snapshot.watermark)},
+    ).to_list()
+    rows.extend(row for row in newer if int(row["memory_id"]) not in known)
+    return rows
+
+
+def load_patient_index(patient_id):
+    patient_id = int(patient_id)
+    snapshot = open_snapshot("memories")
+    if snapshot is not None and snapshot.watermark is not None:
+        rows = load_snapshot_rows(snapshot, patient_id)
+    else:
+        rows = query_tidb(
+            "SELECT memory_id, text_content, text_embedding, image_embedding, created_at FROM memories WHERE patient_id = :patient_id ORDER BY memory_id",
+            {"patient_id": patient_id},
+        ).to_list()
+
+    rerank_source = fetch_memory_vectors
+    if snapshot is not None and snapshot.header["dtype"] == "float32":
+        rerank_source = shared_snapshot_rerank_source(snapshot)
+    index = PatientMemoryIndex(patient_id, rerank_source=rerank_source)
+    index.add_many(rows)
+    if snapshot is not None:
+        index.note_created_at(snapshot.watermark)
+    print(f"Loaded memory index for patient {patient_id} with {len(index)} memories")
+    return index
+
+
+def refresh_patient_index(index):
+    """
+    Add the patient's rows created since the newest one in the index (minus
+    MEMORY_INDEX_REFRESH_OVERLAP_SECONDS), e.g. registered by another worker.
+    Skipped when another thread is already refreshing this index.
+    """
+    if not index._refresh_lock.acquire(blocking=False):
+        return
+    try:
+        sql = "SELECT memory_id, text_content, text_embedding, image_embedding, created_at FROM memories WHERE patient_id = :patient_id"
+        params = {"patient_id": index.patient_id}
+        if index.latest_created_at is not None:
+            sql += " AND created_at >= :since"
+            params["since"] = str(index.latest_created_at - timedelta(seconds=MEMORY_INDEX_REFRESH_OVERLAP_SECONDS))
+        before = len(index)
+        index.add_many(query_tidb(sql + " ORDER BY memory_id", params).to_list())
+        index.refreshed_at = time.monotonic()
+        if len(index) > before:
+            print(f"Refreshed memory index for patient {index.patient_id}: {len(index) - before} new memories")
+    finally:
+        index._refresh_lock.release()
+
+
+def get_patient_index(patient_id):
+    """
+    The patient's index, loaded on first use and reloaded after
+    MEMORY_INDEX_MAX_AGE_SECONDS; rows added by other workers are picked up
+    every MEMORY_INDEX_REFRESH_SECONDS.
+    """
+    patient_id = int(patient_id)
+    index = _patient_indexes.get(patient_id)
+    now = time.monotonic()
+    if index is not None and now - index.loaded_at <= MEMORY_INDEX_MAX_AGE_SECONDS:
+        if now - index.refreshed_at > MEMORY_INDEX_REFRESH_SECONDS:
+            refresh_patient_index(index)
+        return index
+
+    with _patient_indexes_lock:
+        load_lock = _patient_load_locks.setdefault(patient_id, threading.Lock())
+    with load_lock:
+        current = _patient_indexes.get(patient_id)
+        if current is not None and current is not index:
+            # Another thread (re)loaded it while this one waited
+            return current
+        with _loading_lock:
+            _loading[patient_id] = []
+        index = None
+        try:
+            index = load_patient_index(patient_id)
+        finally:
+            with _loading_lock:
+                pending = _loading.pop(patient_id)
+                if index is not None:
+                    # Rows registered while the load ran may have been missed by its queries
+                    index.add_many(pending)
+                    _patient_indexes[patient_id] = index
+    return index
+
+
+def add_memory_to_index(patient_id, memory_id, text_content, text_embedding=None, image_embedding=None):
+    """Keep this process's index in sync with a newly inserted memory row."""
+    row = {
+        "memory_id": memory_id,
+        "text_content": text_content,
+        "text_embedding": text_embedding,
+        "image_embedding": image_embedding,
+    }
+    patient_id = int(patient_id)
+    with _loading_lock:
+        if patient_id in _loading:
+            # Added to the index once its load finishes
+            _loading[patient_id].append(row)
+            return
+        index = _patient_indexes.get(patient_id)
+    if index is not None:
+        index.add_many([row])
+    # Not loaded yet: the lazy load will pick the new row up from TiDB
+
+
+def invalidate_patient_index(patient_id=None):
+    with _patient_indexes_lock:
+        if patient_id is None:
+            _patient_indexes.clear()
+        else:
+            _patient_indexes.pop(int(patient_id), None)
+
+
+def search_patient_memories(patient_id, query_vector, column="text_embedding", top_k=1):
+    return get_patient_index(patient_id).search(query_vector, column=column, top_k=top_k)
+
+
+def hybrid_search_patient_memories(patient_id, queries, same_modality_column, top_k=MEMORY_SEARCH_TOP_K, fusion=MEMORY_SEARCH_FUSION):
+    """
+    Search a patient's memories on both vector columns at once. `same_modality_column`
+    is the column matching the query's modality (image_embedding for an image query,
+    text_embedding for a text one); the other column is weighted and cut off as a
+    cross-modal match.
+    """
+    weights, max_distances = {}, {}
+    for column in VECTOR_COLUMNS:
+        same = column == same_modality_column
+        weights[column] = 1.0 if same else MEMORY_SEARCH_CROSS_MODAL_WEIGHT
+        max_distances[column] = MEMORY_SEARCH_MAX_DISTANCE if same else MEMORY_SEARCH_MAX_CROSS_MODAL_DISTANCE
+    return get_patient_index(patient_id).hybrid_search(queries, top_k=top_k, fusion=fusion, weights=weights, max_distances=max_distances)
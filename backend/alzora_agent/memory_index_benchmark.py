@@ -0,0 +1,86 @@
+"""
+Recall@k and latency of the int8-compressed memory index against the float32 one.
+
+Memories are synthetic and shaped like Misc/misc_tables.py output: 512-dim
+text and image vectors drawn from np.random.rand. Queries are stored vectors
+with noise added, the way a paraphrased question lands near its memory. The
+exact float32 top-k is the ground truth.
+
+    python -m alzora_agent.memory_index_benchmark --memories 50000 --queries 500 --top-k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .memory_index import PatientMemoryIndex, VECTOR_COLUMNS
+
+
+def synthetic_memories(count, dimension, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "memory_id": i,
+            "text_content": f"memory {i}",
+            "text_embedding": rng.random(dimension).astype(np.float32),
+            "image_embedding": rng.random(dimension).astype(np.float32),
+        }
+        for i in range(count)
+    ]
+
+
+def timed_searches(index, queries, column, top_k):
+    started = time.perf_counter()
+    results = [[hit["memory_id"] for hit in index.search(query, column=column, top_k=top_k)] for query in queries]
+    return results, (time.perf_counter() - started) / len(queries) * 1000.0
+
+
+def recall_at_k(results, truth):
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--memories", type=int, default=50000, help="memories of one patient")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--dimension", type=int, default=512)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--noise", type=float, default=0.05, help="std of the noise added to a stored vector to make a query")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[8, 16, 32, 64], help="re-rank shortlist sizes")
+    args = parser.parse_args()
+
+    print(f"Generating {args.memories} memories with {args.dimension}-dim text and image vectors")
+    rows = synthetic_memories(args.memories, args.dimension)
+    rng = np.random.default_rng(1)
+    picks = rng.integers(0, len(rows), args.queries)
+    # Float vectors the re-rank reads, as a float32 snapshot would serve them
+    floats = {column: np.stack([row[column] for row in rows]) for column in VECTOR_COLUMNS}
+
+    def rerank_source(memory_ids, column):
+        return floats[column][memory_ids]
+
+    baseline = PatientMemoryIndex(1, dimension=args.dimension, compression="none")
+    baseline.add_many(rows)
+    compressed = PatientMemoryIndex(1, dimension=args.dimension, compression="int8")
+    compressed.add_many(rows)
+    print(f"index memory: float32 {baseline.nbytes / 2**20:.1f} MiB, int8 {compressed.nbytes / 2**20:.1f} MiB")
+
+    for column in VECTOR_COLUMNS:
+        queries = floats[column][picks] + rng.normal(0.0, args.noise, (args.queries, args.dimension)).astype(np.float32)
+        truth, latency = timed_searches(baseline, queries, column, args.top_k)
+        print(f"\n{column}: recall@{args.top_k}")
+        print(f"  {'float32 exact':<28} recall 1.0000  {latency:7.2f} ms/query")
+
+        compressed.rerank_source = None
+        results, latency = timed_searches(compressed, queries, column, args.top_k)
+        print(f"  {'int8, no re-rank':<28} recall {recall_at_k(results, truth):.4f}  {latency:7.2f} ms/query")
+
+        compressed.rerank_source = rerank_source
+        for candidates in args.candidates:
+            compressed.rerank_candidates = candidates
+            results, latency = timed_searches(compressed, queries, column, args.top_k)
+            print(f"  {f'int8, re-rank top {candidates}':<28} recall {recall_at_k(results, truth):.4f}  {latency:7.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from .embedding_snapshot import open_snapshot
+from .memory_index import normalize, to_vector
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# Prefix of the reference snapshot: <prefix>_vectors.npy and <prefix>_labels.npy.
+# When the files exist they are memory-mapped instead of querying BigQuery.
+MRI_REFERENCE_PATH = os.getenv("MRI_REFERENCE_PATH", "")
+MRI_REFERENCE_TABLE = os.getenv("MRI_REFERENCE_TABLE", "MRI_Embeddings_Dataset.mri_embeddings")
+MRI_KNN_K = int(os.getenv("MRI_KNN_K", "5"))
+MRI_KNN_WEIGHTING = os.getenv("MRI_KNN_WEIGHTING", "distance")  # "distance" or "majority"
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+
+def reference_paths(prefix):
+    return f"{prefix}_vectors.npy", f"{prefix}_labels.npy"
+
+
+class MriReferenceIndex:
+    """
+    Exact cosine k-NN classifier over the fixed set of labelled MRI reference embeddings.
+
+    `vectors` is an L2-normalised float32 matrix (possibly a read-only memmap) whose
+    rows line up with `labels`. The reference set is a few hundred rows, so a
+    single matrix-vector product per scan is all a search costs.
+    """
+
+    def __init__(self, vectors, labels):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(labels):
+            raise ValueError(f"Expected a (n, dim) matrix with one label per row, got {vectors.shape} and {len(labels)} labels")
+        norms = np.linalg.norm(vectors, axis=1)
+        if not np.allclose(norms[norms > 0], 1.0, atol=1e-4):
+            # Normalising copies a memmap into memory; save() writes normalised rows so it never has to
+            vectors = vectors / np.where(norms == 0, 1.0, norms)[:, None]
+        self.vectors = vectors
+        self.labels = np.asarray(labels, dtype=str)
+        self.classes = sorted(set(self.labels.tolist()))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @classmethod
+    def from_rows(cls, rows, vector_column="mri_embeddings", label_column="mri_scan_type"):
+        vectors, labels = [], []
+        for row in rows:
+            vector = to_vector(row[vector_column])
+            if vector is not None:
+                vectors.append(normalize(vector))
+                labels.append(row[label_column])
+        return cls(np.stack(vectors), labels)
+
+    @classmethod
+    def from_snapshot(cls, snapshot, vector_column="embedding", label_column="mri_scan_type"):
+        """Reference set from an `mri_image_embeddings` embedding snapshot (see embedding_snapshot.py)."""
+        present = np.asarray(snapshot.present(vector_column))
+        return cls(snapshot.vectors(vector_column, present), np.asarray(snapshot.labels(label_column))[present])
+
+    @classmethod
+    def load(cls, prefix, mmap=True):
+        vectors_path, labels_path = reference_paths(prefix)
+        vectors = np.load(vectors_path, mmap_mode="r" if mmap else None)
+        labels = np.load(labels_path)
+        return cls(vectors, labels)
+
+    def save(self, prefix):
+        vectors_path, labels_path = reference_paths(prefix)
+        np.save(vectors_path, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        np.save(labels_path, self.labels)
+
+    def search(self, query_vector, top_k=MRI_KNN_K):
+        """Exact cosine top-k: (row indices, cosine distances), nearest first."""
+        query = normalize(np.asarray(query_vector, dtype=np.float32))
+        scores = self.vectors @ query
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return best, 1.0 - scores[best]
+
+    def classify(self, query_vector, k=MRI_KNN_K, weighting=MRI_KNN_WEIGHTING):
+        """
+        Vote among the k nearest references.
+        Returns the winning label, a per-class confidence (vote shares summing to 1)
+        and the neighbours with their cosine distances.
+        """
+        best, distances = self.search(query_vector, top_k=k)
+        votes = Counter()
+        for i, distance in zip(best, distances):
+            if weighting == "majority":
+                votes[self.labels[i]] += 1.0
+            elif weighting == "distance":
+                votes[self.labels[i]] += 1.0 / (max(float(distance), 0.0) + 1e-6)
+            else:
+                raise ValueError(f"Unknown weighting '{weighting}', expected 'distance' or 'majority'")
+
+        total = sum(votes.values())
+        confidence = {label: round(votes.get(label, 0.0) / total, 4) for label in self.classes}
+        # Ties go to the class of the nearest neighbour
+        nearest_rank = {}
+        for rank, i in enumerate(best):
+            nearest_rank.setdefault(self.labels[i], rank)
+        label = max(votes, key=lambda c: (votes[c], -nearest_rank[c]))
+
+        return {
+            "label": str(label),
+            "confidence": confidence,
+            "neighbors": [{"mri_scan_type": str(self.labels[i]), "distance": float(d)} for i, d in zip(best, distances)],
+        }
+
+
+def load_reference_from_bigquery(table=MRI_REFERENCE_TABLE):
+    from .setup import get_bigquery_data
+
+    rows = get_bigquery_data(f"SELECT mri_scan_type, mri_embeddings FROM `{table}`")
+    index = MriReferenceIndex.from_rows(dict(row.items()) for row in rows)
+    print(f"Loaded {len(index)} MRI reference embeddings from {table}")
+    return index
+
+
+_reference_index = None
+_reference_index_lock = threading.Lock()
+
+
+def get_reference_index():
+    """
+    The process-wide reference index: memory-mapped from MRI_REFERENCE_PATH if present,
+    else from the mri_image_embeddings snapshot, else read once from BigQuery.
+    """
+    global _reference_index
+    if _reference_index is None:
+        with _reference_index_lock:
+            if _reference_index is None:
+                snapshot = open_snapshot("mri_image_embeddings")
+                if MRI_REFERENCE_PATH and os.path.exists(reference_paths(MRI_REFERENCE_PATH)[0]):
+                    _reference_index = MriReferenceIndex.load(MRI_REFERENCE_PATH)
+                    print(f"Memory-mapped {len(_reference_index)} MRI reference embeddings from {MRI_REFERENCE_PATH}")
+                elif snapshot is not None:
+                    _reference_index = MriReferenceIndex.from_snapshot(snapshot)
+                    print(f"Loaded {len(_reference_index)} MRI reference embeddings from snapshot {snapshot.path}")
+                else:
+                    _reference_index = load_reference_from_bigquery()
+    return _reference_index
+
+
+def set_reference_index(index):
+    """Swap the process-wide reference index, e.g. for tests or after the reference set is rebuilt."""
+    global _reference_index
+    _reference_index = index
+
+
+def classify_mri(query_vector, k=MRI_KNN_K, weighting=MRI_KNN_WEIGHTING):
+    return get_reference_index().classify(query_vector, k=k, weighting=weighting)
+
+
+if __name__ == "__main__":
+    # python -m alzora_agent.mri_index <prefix>: snapshot the BigQuery reference set to .npy files
+    import sys
+
+    prefix = sys.argv[1] if len(sys.argv) > 1 else (MRI_REFERENCE_PATH or "mri_reference")
+    load_reference_from_bigquery().save(prefix)
+    print(f"Wrote {', '.join(reference_paths(prefix))}")
@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from .setup import get_bigquery_data, query_tidb
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+PATIENT_CACHE_TTL_SECONDS = float(os.getenv("PATIENT_CACHE_TTL_SECONDS", "900"))
+# How often TiDB is checked for patients changed through the webapp
+PATIENT_CACHE_INVALIDATION_POLL_SECONDS = float(os.getenv("PATIENT_CACHE_INVALIDATION_POLL_SECONDS", "30"))
+# How long a changed patient is read from TiDB before BigQuery is trusted again (Fivetran sync lag)
+PATIENT_CACHE_SYNC_LAG_SECONDS = float(os.getenv("PATIENT_CACHE_SYNC_LAG_SECONDS", "900"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+# Watermark used while the patients table is empty
+PATIENT_CACHE_MIN_WATERMARK = datetime(1970, 1, 1)
+
+
+class PatientCache:
+    """
+    Read-through cache of `alzora_datawarehouse.patients` rows keyed by patient_id.
+
+    Entries expire after `ttl_seconds`. Edits made through the webapp
+    (updatePatientInfo / addPatient) bump `patients.updated_at` in TiDB; the cache
+    polls for those rows at most every `poll_seconds`, evicts them, and serves them
+    from TiDB until the Fivetran copy in BigQuery has had time to catch up.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds=PATIENT_CACHE_TTL_SECONDS,
+        poll_seconds=PATIENT_CACHE_INVALIDATION_POLL_SECONDS,
+        sync_lag_seconds=PATIENT_CACHE_SYNC_LAG_SECONDS,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        self.sync_lag_seconds = sync_lag_seconds
+        self._entries = {}
+        self._read_from_tidb_until = {}
+        self._watermark = None
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+
+    def _store(self, patient_info):
+        with self._lock:
+            self._entries[int(patient_info["patient_id"])] = (time.monotonic() + self.ttl_seconds, patient_info)
+
+    def _cached(self, patient_id):
+        entry = self._entries.get(patient_id)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def invalidate(self, patient_id=None):
+        with self._lock:
+            if patient_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(int(patient_id), None)
+
+    def sync_invalidations(self, force=False):
+        """Evict patients whose TiDB row changed since the last poll."""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now < self._next_poll:
+                return []
+            self._next_poll = now + self.poll_seconds
+            watermark = self._watermark
+
+        try:
+            if watermark is None:
+                # An empty table has no MAX; start from the epoch so the next poll doesn't bootstrap again
+                watermark = query_tidb("SELECT MAX(updated_at) FROM patients").scalar() or PATIENT_CACHE_MIN_WATERMARK
+                with self._lock:
+                    if self._watermark is None or watermark > self._watermark:
+                        self._watermark = watermark
+                return []
+            changed = query_tidb(
+                "SELECT patient_id, updated_at FROM patients WHERE updated_at > :watermark",
+                {"watermark": watermark},
+            ).to_list()
+        except Exception as e:
+            print("Couldn't check patients for changes: " + str(e))
+            return []
+
+        changed_ids = [int(row["patient_id"]) for row in changed]
+        with self._lock:
+            for row in changed:
+                self._entries.pop(int(row["patient_id"]), None)
+                self._read_from_tidb_until[int(row["patient_id"])] = now + self.sync_lag_seconds
+                # Concurrent polls may finish out of order; the watermark only moves forward
+                if row["updated_at"] is not None and row["updated_at"] > self._watermark:
+                    self._watermark = row["updated_at"]
+        if changed_ids:
+            print("Invalidated cached patients:", changed_ids)
+        return changed_ids
+
+    def _fetch(self, patient_id):
+        if self._read_from_tidb_until.get(patient_id, 0.0) > time.monotonic():
+            rows = query_tidb("SELECT * FROM patients WHERE patient_id = :patient_id", {"patient_id": patient_id}).to_list()
+            return rows[0] if rows else None
+
+        rows = list(get_bigquery_data(f'''SELECT * from `alzora_datawarehouse.patients` WHERE patient_id={patient_id}'''))
+        return dict(rows[0]) if rows else None
+
+    def preload_caretaker(self, caretaker_id):
+        """Load every patient of a caretaker with one query. Returns the loaded patient ids."""
+        rows = get_bigquery_data(f'''
+            SELECT p.*
+            FROM `alzora_datawarehouse.patients` p
+            JOIN `alzora_datawarehouse.caretakers` c
+            ON p.patient_id IN UNNEST(
+                ARRAY(
+                    SELECT CAST(TRIM(pid) AS INT64)
+                    FROM UNNEST(SPLIT(REGEXP_REPLACE(c.patient_ids, r'[\\[\\]]', ''))) AS pid
+                    WHERE TRIM(pid) != ''
+                )
+            )
+            WHERE c.caretaker_id = {int(caretaker_id)}
+        ''')
+
+        loaded = []
+        for row in rows:
+            patient_info = dict(row)
+            patient_id = int(patient_info["patient_id"])
+            # Keep the TiDB copy for patients that were just edited
+            if self._read_from_tidb_until.get(patient_id, 0.0) > time.monotonic():
+                continue
+            self._store(patient_info)
+            loaded.append(patient_id)
+        return loaded
+
+    def get(self, patient_id, caretaker_id=None):
+        """
+        Return the patient row, loading it on a miss. When `caretaker_id` is given,
+        a miss preloads all of that caretaker's patients in the same round trip.
+        """
+        patient_id = int(patient_id)
+        self.sync_invalidations()
+
+        patient_info = self._cached(patient_id)
+        if patient_info is not None:
+            return patient_info
+
+        if caretaker_id is not None and int(caretaker_id) != patient_id:
+            self.preload_caretaker(caretaker_id)
+            patient_info = self._cached(patient_id)
+            if patient_info is not None:
+                return patient_info
+
+        patient_info = self._fetch(patient_id)
+        if patient_info is None:
+            raise KeyError(f"Patient {patient_id} not found")
+        self._store(patient_info)
+        return patient_info
+
+
+patient_cache = PatientCache()
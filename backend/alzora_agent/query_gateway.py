@@ -0,0 +1,249 @@
+import os
+import re
+import threading
+
+import sqlglot
+from google.cloud import bigquery
+from sqlglot import exp
+
+from .ttl_cache import TTLCache
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# Queries estimated (dry run) above this are rejected; also set as maximum_bytes_billed on the job
+VITALS_QUERY_MAX_BYTES_BILLED = int(os.getenv("VITALS_QUERY_MAX_BYTES_BILLED", str(1 << 30)))
+# Window applied to queries that don't bound `timestamp` themselves
+VITALS_QUERY_DEFAULT_LOOKBACK_DAYS = int(os.getenv("VITALS_QUERY_DEFAULT_LOOKBACK_DAYS", "7"))
+VITALS_QUERY_CACHE_TTL_SECONDS = float(os.getenv("VITALS_QUERY_CACHE_TTL_SECONDS", "300"))
+VITALS_QUERY_CACHE_SIZE = int(os.getenv("VITALS_QUERY_CACHE_SIZE", "512"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+VITALS_DATASET = "patients_vitals"
+VITALS_TABLE_NAME = "patient_vitals"
+VITALS_TABLE = f"{VITALS_DATASET}.{VITALS_TABLE_NAME}"
+
+_CODE_FENCE = re.compile(r"^\s*```[\w-]*\s*|\s*```\s*$")
+# Statements that can appear nested inside a query expression but write or run code
+_FORBIDDEN_NODES = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Create, exp.Drop, exp.Alter, exp.Command)
+
+
+class QueryRejected(ValueError):
+    """The query was refused before reaching BigQuery; the message is meant for the model."""
+
+
+def clean_sql(text):
+    """Strip a markdown code fence and trailing semicolons from model-written SQL."""
+    return _CODE_FENCE.sub("", text.strip()).strip().rstrip(";").strip()
+
+
+def parse_query(sql):
+    """The single SELECT statement in `sql` as a sqlglot tree, or QueryRejected."""
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="bigquery") if statement is not None]
+    except sqlglot.errors.ParseError as e:
+        raise QueryRejected(f"The query couldn't be parsed: {e}")
+    if len(statements) != 1:
+        raise QueryRejected("Only a single SQL statement can be run")
+    tree = statements[0]
+    if not isinstance(tree, exp.Query) or tree.find(*_FORBIDDEN_NODES) is not None:
+        raise QueryRejected("Only SELECT queries can be run")
+    return tree
+
+
+def vitals_tables(tree):
+    """
+    Every table reference in the query, which must all be the vitals table
+    itself (no project prefix, wildcard or partition decorator) or a CTE.
+    """
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    tables = []
+    for table in tree.find_all(exp.Table):
+        if not table.catalog and not table.db and table.name in ctes:
+            continue
+        if table.catalog or table.db != VITALS_DATASET or table.name != VITALS_TABLE_NAME:
+            raise QueryRejected(f"Only {VITALS_TABLE} can be queried, not {table.sql(dialect='bigquery')}")
+        tables.append(table)
+    if not tables:
+        raise QueryRejected(f"The query must read from {VITALS_TABLE}")
+    return tables
+
+
+def _is_column(node, name):
+    return isinstance(node, exp.Column) and node.name.lower() == name
+
+
+def _mentions_column(node, name):
+    return _is_column(node, name) or any(_is_column(column, name) for column in node.find_all(exp.Column))
+
+
+def filtered_patient_ids(tree):
+    """Patient ids the query compares value_patient_id against with = or IN."""
+    ids = set()
+    for node in tree.find_all(exp.EQ, exp.In):
+        if isinstance(node, exp.EQ):
+            sides = [(node.left, [node.right]), (node.right, [node.left])]
+        else:
+            sides = [(node.this, node.expressions)]
+        for column, values in sides:
+            if _is_column(column, "value_patient_id"):
+                ids.update(value.to_py() for value in values if isinstance(value, exp.Literal))
+    return ids
+
+
+def time_bounds(tree):
+    """
+    (lower, upper): whether `timestamp` (bare or inside a function such as DATE())
+    is bounded from below and from above. BETWEEN, IN and = against a value
+    (not a join on another column) bound it both ways.
+    """
+    lower = upper = False
+    for node in tree.find_all(exp.GT, exp.GTE, exp.LT, exp.LTE, exp.EQ, exp.Between, exp.In):
+        if isinstance(node, (exp.Between, exp.In)):
+            if _mentions_column(node.this, "timestamp"):
+                lower = upper = True
+        elif isinstance(node, exp.EQ):
+            for column_side, value_side in ((node.left, node.right), (node.right, node.left)):
+                if _mentions_column(column_side, "timestamp") and value_side.find(exp.Column) is None:
+                    lower = upper = True
+        elif _mentions_column(node.left, "timestamp"):
+            # timestamp > x is a lower bound, timestamp < x an upper one
+            if isinstance(node, (exp.GT, exp.GTE)):
+                lower = True
+            else:
+                upper = True
+        elif _mentions_column(node.right, "timestamp"):
+            if isinstance(node, (exp.LT, exp.LTE)):
+                lower = True
+            else:
+                upper = True
+    return lower, upper
+
+
+def scope_to_patient(tree, tables, patient_id, lookback_days=None):
+    """
+    Replace every reference to the vitals table with a subquery holding only this
+    patient's rows (and, with `lookback_days`, only that many recent days), so no
+    join or subquery can read another patient's vitals. The subquery keeps the
+    table's alias, or its name, so qualified column references still resolve.
+    """
+    condition = f"value_patient_id = {int(patient_id)}"
+    if lookback_days is not None:
+        condition += f" AND `timestamp` >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(lookback_days)} DAY)"
+    for table in tables:
+        scoped = (
+            exp.select("*")
+            .from_(exp.table_(VITALS_TABLE_NAME, db=VITALS_DATASET))
+            .where(condition, dialect="bigquery")
+            .subquery(table.alias or VITALS_TABLE_NAME)
+        )
+        table.replace(scoped)
+    return tree
+
+
+class VitalsQueryGateway:
+    """
+    Guarded, cached execution of model-written SQL against the vitals table.
+
+    Every query is checked to be a single read of patients_vitals.patient_vitals,
+    scoped to the session's patient, given a default time window when it has
+    none (a query bounded only from above is rejected instead), priced with a
+    dry run and rejected above `max_bytes_billed`, which is also set on the
+    real job. Queries are parsed, not pattern-matched: any
+    table other than the vitals table is rejected. Results are cached per
+    patient by the regenerated SQL for `cache_ttl_seconds`.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_bytes_billed=VITALS_QUERY_MAX_BYTES_BILLED,
+        default_lookback_days=VITALS_QUERY_DEFAULT_LOOKBACK_DAYS,
+        cache=None,
+    ):
+        self._client = client
+        self.max_bytes_billed = max_bytes_billed
+        self.default_lookback_days = default_lookback_days
+        self.cache = cache if cache is not None else TTLCache(VITALS_QUERY_CACHE_SIZE, VITALS_QUERY_CACHE_TTL_SECONDS)
+        self.stats = {"queries": 0, "cache_hits": 0, "rejected": 0, "bytes_estimated": 0}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            from .setup import bigquery_client
+
+            self._client = bigquery_client
+        return self._client
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def prepare(self, sql, patient_id):
+        """The SQL that will actually run for this patient, or QueryRejected."""
+        tree = parse_query(clean_sql(sql))
+        tables = vitals_tables(tree)
+
+        other_patients = {p for p in filtered_patient_ids(tree) if str(p) != str(int(patient_id))}
+        if other_patients:
+            raise QueryRejected(f"The query may only read the vitals of patient {int(patient_id)}")
+
+        lower, upper = time_bounds(tree)
+        if upper and not lower:
+            # A default window ANDed with an old upper bound would quietly return nothing
+            raise QueryRejected("The query only bounds `timestamp` from above; add a lower bound such as `timestamp >= '...'`")
+        lookback_days = None if lower else self.default_lookback_days
+        # Generated SQL is canonical, which also makes it the cache key
+        return scope_to_patient(tree, tables, patient_id, lookback_days).sql(dialect="bigquery")
+
+    def estimate_bytes(self, sql):
+        job = self.client.query(sql, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+        return job.total_bytes_processed or 0
+
+    def run(self, sql, patient_id):
+        """Rows of the guarded query as dicts; raises QueryRejected when it is refused."""
+        self._count("queries")
+        try:
+            sql = self.prepare(sql, patient_id)
+        except QueryRejected:
+            self._count("rejected")
+            raise
+
+        key = (int(patient_id), sql)
+        rows = self.cache.get(key)
+        if rows is not None:
+            self._count("cache_hits")
+            return [dict(row) for row in rows]
+
+        estimated = self.estimate_bytes(sql)
+        self._count("bytes_estimated", estimated)
+        if estimated > self.max_bytes_billed:
+            self._count("rejected")
+            raise QueryRejected(
+                f"The query would scan {estimated / 2**20:.0f} MiB, above the {self.max_bytes_billed / 2**20:.0f} MiB limit; "
+                "narrow the time range or select fewer columns"
+            )
+
+        job_config = bigquery.QueryJobConfig(maximum_bytes_billed=self.max_bytes_billed)
+        rows = [dict(row) for row in self.client.query(sql, job_config=job_config).result()]
+        self.cache.put(key, rows)
+        return [dict(row) for row in rows]
+
+
+_vitals_query_gateway = None
+_vitals_query_gateway_lock = threading.Lock()
+
+
+def get_vitals_query_gateway():
+    global _vitals_query_gateway
+    if _vitals_query_gateway is None:
+        with _vitals_query_gateway_lock:
+            if _vitals_query_gateway is None:
+                _vitals_query_gateway = VitalsQueryGateway()
+    return _vitals_query_gateway
+
+
+def set_vitals_query_gateway(gateway):
+    """Swap the process-wide gateway, e.g. for tests or a different byte limit."""
+    global _vitals_query_gateway
+    _vitals_query_gateway = gateway
@@ -0,0 +1,60 @@
+"""
+Re-embed the text_embedding of every memory with text-embedding-005.
+
+The original get_text_embeddings passed `list(text_content)` to the model,
+i.e. one text per character, and kept the first result, so text-only memories
+hold the embedding of their first character. Memories registered with an image
+held the multimodal model's contextual-text vector instead, another embedding
+space. Both are rewritten here the way register_memory now stores every row.
+Rerunning it is harmless. Rows keep their created_at, so rebuild the memories
+snapshots with `embedding_snapshot export --full` afterwards.
+
+    python -m alzora_agent.reembed_memories
+    python -m alzora_agent.reembed_memories --patients 60002 --dry-run
+"""
+import argparse
+from datetime import datetime
+
+from .embedding_service import get_embedding_service
+from .setup import embedding_dimension, get_tidb_table, query_tidb
+
+# Texts per embedding request
+REEMBED_BATCH_SIZE = 100
+
+
+def rows_to_reembed(patient_ids=None):
+    sql = "SELECT memory_id, text_content FROM memories WHERE text_content IS NOT NULL AND text_content != ''"
+    if patient_ids:
+        sql += f" AND patient_id IN ({', '.join(str(int(p)) for p in patient_ids)})"
+    return query_tidb(sql + " ORDER BY memory_id").to_list()
+
+
+def run(patient_ids=None, batch_size=REEMBED_BATCH_SIZE, dry_run=False):
+    rows = rows_to_reembed(patient_ids)
+    print(f"{len(rows)} memories to re-embed")
+    if dry_run or not rows:
+        return len(rows)
+
+    table = get_tidb_table("memories")
+    service = get_embedding_service(embedding_dimension)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        vectors = service.embed_texts([row["text_content"] for row in batch])
+        for row, vector in zip(batch, vectors):
+            # updated_at moves so the change is synced on to the warehouse
+            table.update(values={"text_embedding": vector, "updated_at": str(datetime.now())}, filters={"memory_id": row["memory_id"]})
+        print(f"Re-embedded {start + len(batch)}/{len(rows)}")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, nargs="+", help="only these patient ids")
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows")
+    args = parser.parse_args()
+    run(args.patients, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import io
+import json
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .ttl_cache import TTLCache, content_hash
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+# Processes rendering report charts; 0 renders in the calling thread
+REPORT_CHART_WORKERS = int(os.getenv("REPORT_CHART_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Rendered chart sets kept in memory, keyed by (patient_id, week, data hash)
+REPORT_CHART_CACHE_SIZE = int(os.getenv("REPORT_CHART_CACHE_SIZE", "256"))
+REPORT_CHART_CACHE_TTL_SECONDS = float(os.getenv("REPORT_CHART_CACHE_TTL_SECONDS", "86400"))
+REPORT_CHART_DPI = int(os.getenv("REPORT_CHART_DPI", "100"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+# (vitals column, chart title, graph type); rendered charts are keyed by the column
+WEEKLY_CHARTS = (
+    ("avg_heart_rate", "Average Heart Rate", "line"),
+    ("avg_spO2_level", "Average spO2 levels", "bar"),
+    ("avg_step_count", "Average Step Count", "bar"),
+    ("total_fall_flag", "Total Fall Events", "line"),
+)
+
+
+def render_chart(x, y, graph_title, graph_type="line", dpi=REPORT_CHART_DPI):
+    """
+    Render one chart to PNG bytes.
+
+    Uses a standalone Figure on an Agg canvas rather than pyplot, so nothing is
+    shared between renders and it is safe in threads and worker processes.
+    """
+    figure = Figure(figsize=(8, 5))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+
+    if graph_type == "line":
+        axes.plot(x, y, marker="o", linestyle="-")
+    elif graph_type == "bar":
+        axes.bar(x, y)
+    else:
+        raise ValueError("graph_type must be 'line' or 'bar'")
+
+    axes.set_title(graph_title)
+    axes.set_xlabel("Day")
+    axes.set_ylabel(graph_title)
+    axes.tick_params(axis="x", labelrotation=45)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png", dpi=dpi)
+    return buffer.getvalue()
+
+
+def _render_chart_job(job):
+    return render_chart(*job)
+
+
+def weekly_series(data_collection):
+    """
+    Day labels and per-chart values from the weekly vitals, sorted by day.
+    Accepts the rollup DataFrame or an iterable of row dicts.
+    """
+    rows = data_collection.to_dict("records") if hasattr(data_collection, "to_dict") else [dict(row) for row in data_collection]
+    rows.sort(key=lambda row: str(row["day"]))
+    days = [str(row["day"]) for row in rows]
+    series = {}
+    for column, _, _ in WEEKLY_CHARTS:
+        values = []
+        for row in rows:
+            value = row.get(column)
+            # Days without readings come back as NULL/NaN; plot them as gaps of 0
+            values.append(0.0 if value is None or (isinstance(value, float) and math.isnan(value)) else float(value))
+        series[column] = values
+    return days, series
+
+
+def week_label(days):
+    return f"{days[0]}..{days[-1]}" if days else ""
+
+
+def series_hash(days, series):
+    return content_hash(json.dumps([days, series], sort_keys=True))
+
+
+class ChartRenderer:
+    """
+    Renders the weekly report charts as in-memory PNGs.
+
+    The charts of one report are rendered in parallel on a process pool and the
+    finished set is cached by (patient_id, week, data hash), so regenerating a
+    report for unchanged data costs nothing. Nothing touches the filesystem, so
+    concurrent reports cannot clobber each other.
+    """
+
+    def __init__(self, workers=REPORT_CHART_WORKERS, cache=None, dpi=REPORT_CHART_DPI):
+        self.workers = workers
+        self.dpi = dpi
+        self.cache = cache if cache is not None else TTLCache(REPORT_CHART_CACHE_SIZE, REPORT_CHART_CACHE_TTL_SECONDS)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def map(self, jobs):
+        """Render (x, y, title, graph_type) jobs, in order."""
+        jobs = [(x, y, title, graph_type, self.dpi) for x, y, title, graph_type in jobs]
+        if self.workers <= 0:
+            return [_render_chart_job(job) for job in jobs]
+        return list(self._executor().map(_render_chart_job, jobs))
+
+    def render_weekly(self, patient_id, days, series):
+        """{column: PNG bytes} for every chart in WEEKLY_CHARTS."""
+        key = (int(patient_id), week_label(days), series_hash(days, series))
+        charts = self.cache.get(key)
+        if charts is None:
+            images = self.map((days, series[column], title, graph_type) for column, title, graph_type in WEEKLY_CHARTS)
+            charts = {column: image for (column, _, _), image in zip(WEEKLY_CHARTS, images)}
+            self.cache.put(key, charts)
+        return charts
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+_chart_renderer = None
+_chart_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer():
+    global _chart_renderer
+    if _chart_renderer is None:
+        with _chart_renderer_lock:
+            if _chart_renderer is None:
+                _chart_renderer = ChartRenderer()
+    return _chart_renderer
+
+
+def set_chart_renderer(renderer):
+    """Swap the process-wide renderer, e.g. for tests or to render inline (workers=0)."""
+    global _chart_renderer
+    _chart_renderer = renderer
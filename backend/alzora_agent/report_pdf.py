@@ -0,0 +1,134 @@
+import io
+import json
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .report_charts import WEEKLY_CHARTS
+
+
+# Section heading and unit per chart column, in report order
+SECTIONS = {
+    "avg_heart_rate": ("Heart Rate", "bpm"),
+    "avg_step_count": ("Step Count", "steps"),
+    "avg_spO2_level": ("spO2 Levels", "%"),
+    "total_fall_flag": ("Fall Events", "falls"),
+}
+NARRATIVE_KEYS = ("overview",) + tuple(SECTIONS)
+
+# Patient fields shown in the information table, in order
+PATIENT_FIELDS = (
+    ("patient_id", "Patient ID"),
+    ("age", "Age"),
+    ("gender", "Gender"),
+    ("safe_radius_meters", "Safe zone radius (m)"),
+)
+
+
+def _styles():
+    styles = getSampleStyleSheet()
+    return {
+        "title": styles["Title"],
+        "subtitle": ParagraphStyle("Subtitle", parent=styles["Heading2"], alignment=1, textColor=colors.grey),
+        "heading": styles["Heading1"],
+        "stats": ParagraphStyle("Stats", parent=styles["BodyText"], textColor=colors.darkslategray),
+        "body": ParagraphStyle("Narrative", parent=styles["BodyText"], fontSize=11, leading=16),
+        "cell": ParagraphStyle("Cell", parent=styles["BodyText"], fontSize=18, leading=24),
+    }
+
+
+def _paragraphs(text, style):
+    # Narrative is model output: escape it so stray markup can't break the layout
+    return [Paragraph(escape(part.strip()), style) for part in str(text).split("\n\n") if part.strip()]
+
+
+def section_stats(column, values):
+    if not values:
+        return "No readings this week."
+    _, unit = SECTIONS[column]
+    if column == "total_fall_flag":
+        return f"Total: {sum(values):g} {unit} over {len(values)} days, {sum(1 for v in values if v > 0)} days with a fall."
+    return f"Average: {sum(values) / len(values):.1f} {unit} · Lowest: {min(values):g} · Highest: {max(values):g}"
+
+
+def default_narrative(patient_info, days, series):
+    """Plain, data-only narrative used when the model's narrative is missing a section."""
+    name = patient_info.get("first_name") or "The patient"
+    narrative = {"overview": f"{name}'s vitals summary for {days[0]} to {days[-1]}." if days else f"No vitals were recorded for {name} this week."}
+    for column, (heading, _) in SECTIONS.items():
+        narrative[column] = f"{heading}: {section_stats(column, series.get(column, []))}"
+    return narrative
+
+
+def parse_narrative(narrative, patient_info, days, series):
+    """
+    The model's narrative as {key: text} for NARRATIVE_KEYS. Accepts a dict or
+    a JSON string; missing or empty sections fall back to default_narrative.
+    """
+    if isinstance(narrative, str):
+        try:
+            narrative = json.loads(narrative)
+        except ValueError:
+            narrative = {"overview": narrative}
+    narrative = narrative if isinstance(narrative, dict) else {}
+    fallback = default_narrative(patient_info, days, series)
+    return {key: str(narrative.get(key) or "").strip() or fallback[key] for key in NARRATIVE_KEYS}
+
+
+def report_file_name(patient_info, days):
+    return f"{patient_info['patient_id']}_weekly_alzora_report-{days[0]}-{days[-1]}.pdf"
+
+
+def render_weekly_report(patient_info, days, series, charts, narrative):
+    """
+    Assemble the weekly report PDF and return its bytes.
+
+    `charts` are the in-memory PNGs from report_charts (keyed like WEEKLY_CHARTS),
+    `narrative` the text the model wrote for each section (see parse_narrative).
+    The layout is fixed here; nothing the model writes is executed.
+    """
+    styles = _styles()
+    narrative = parse_narrative(narrative, patient_info, days, series)
+    name = " ".join(filter(None, [patient_info.get("first_name"), patient_info.get("last_name")]))
+
+    story = [
+        Paragraph("Weekly Report Alzora", styles["title"]),
+        Paragraph(f"{days[0]} to {days[-1]}" if days else "No readings this week", styles["subtitle"]),
+        Spacer(1, 0.8 * cm),
+    ]
+
+    rows = [[Paragraph("Name", styles["cell"]), Paragraph(escape(name), styles["cell"])]]
+    for field, label in PATIENT_FIELDS:
+        if patient_info.get(field) is not None:
+            rows.append([Paragraph(label, styles["cell"]), Paragraph(escape(str(patient_info[field])), styles["cell"])])
+    table = Table(rows, colWidths=[7 * cm, 10 * cm])
+    table.setStyle(TableStyle([
+        ("GRID", (0, 0), (-1, -1), 0.75, colors.lightgrey),
+        ("BACKGROUND", (0, 0), (0, -1), colors.whitesmoke),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("TOPPADDING", (0, 0), (-1, -1), 14),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 14),
+    ]))
+    story += [table, Spacer(1, 0.8 * cm)]
+    story += _paragraphs(narrative["overview"], styles["body"])
+
+    chart_columns = [column for column, _, _ in WEEKLY_CHARTS]
+    for column, (heading, _) in SECTIONS.items():
+        story += [PageBreak(), Paragraph(f"Weekly Vitals Summary: {heading}", styles["heading"])]
+        story.append(Paragraph(section_stats(column, series.get(column, [])), styles["stats"]))
+        story.append(Spacer(1, 0.4 * cm))
+        if column in chart_columns and charts.get(column):
+            story += [Image(io.BytesIO(charts[column]), width=16 * cm, height=10 * cm), Spacer(1, 0.6 * cm)]
+        story += _paragraphs(narrative[column], styles["body"])
+
+    buffer = io.BytesIO()
+    document = SimpleDocTemplate(
+        buffer, pagesize=A4, title=f"Weekly Report Alzora - {name}",
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm,
+    )
+    document.build(story)
+    return buffer.getvalue()
@@ -1,15 +1,12 @@
 from google.cloud import bigquery
-from pytidb import TiDBClient
 from pytidb.schema import TableModel, Field, VectorField, DistanceMetric
 import os
 from typing import List, Optional
 from google.adk.agents import Agent
 from google.adk.tools import google_search
 import certifi
-import vertexai
-from vertexai.vision_models import MultiModalEmbeddingModel, Image
-from vertexai.language_models import TextEmbeddingModel
-import io
+from .embedding_service import get_embedding_service
+from .tidb_pool import TiDBPool
 
 
 
@@ -20,18 +17,18 @@ TIDB_PASS = os.getenv("TIDB_PASS")
 TIDB_PORT = os.getenv("TIDB_PORT")
 TIDB_DATABASE = os.getenv("TIDB_DATABASE")
 JINA_AI_API_KEY = os.getenv("JINA_AI_API_KEY")
+# dbt model alzora_dbt/models/vitals_rollup/marts/daily_vitals_rollup.sql
+VITALS_DAILY_ROLLUP_TABLE = os.getenv("VITALS_DAILY_ROLLUP_TABLE", "Alzora_Embeddings_Dataset_alzora_vitals_rollup.daily_vitals_rollup")
 # ── END CONFIG ────────────────────────────────────────────────────────────
 
 
 TIDB_DATABASE_URL=f"mysql+pymysql://{TIDB_USER}:{TIDB_PASS}@{TIDB_HOST}:{TIDB_PORT}/{TIDB_DATABASE}?ssl_ca={certifi.where()}"
 
-db = TiDBClient.connect(TIDB_DATABASE_URL)
+tidb_pool = TiDBPool(TIDB_DATABASE_URL)
 
 bigquery_client = bigquery.Client()
 
 embedding_dimension = 512
-image_embedding_model = None
-text_embedding_model = None
 
 search_agent = Agent(
     name="search_agent",
@@ -59,66 +56,19 @@ def get_bigquery_data(query):
     rows = query_job.result()
     return rows
 
-def reconnect_db():
-    global db
-    print("Refreshing database connection..")
-    db = TiDBClient.connect(TIDB_DATABASE_URL)
-    return db
-
-def query_tidb(query):
-    try:
-        res = db.query(query)
-    except Exception as e:
-        db = reconnect_db()
-        res = db.query(query)
-    return res
+def query_tidb(query, params=None):
+    return tidb_pool.query(query, params)
 
 def get_tidb_table(table_name):
-    try:
-        current_table = db.open_table(table_name)
-    except Exception as e:
-        reconnect_db()
-        current_table = db.open_table(table_name)
-    return current_table
-
-
-def initialize_image_embedding_model():
-    global image_embedding_model
-    PROJECT_ID = "alzora-474820"
-    vertexai.init(project=PROJECT_ID, location="us-central1")
-    image_embedding_model = MultiModalEmbeddingModel.from_pretrained("multimodalembedding@001")
-    print("Initialising Image Embedding Model ...")
-
-
-def initialize_text_embedding_model():
-    global text_embedding_model
-    PROJECT_ID = "alzora-474820"
-    vertexai.init(project=PROJECT_ID, location="us-central1")
-    text_embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-005")
-    print("Initialising Text Embedding Model ...")
+    return tidb_pool.open_table(table_name)
 
 
 def get_image_embeddings(image_blob, text_content):
-    global image_embedding_model
-
-    if image_embedding_model is None:
-        initialize_image_embedding_model()
-
+    """Embed one image (encoded bytes or PIL image) with its contextual text"""
     try:
-        img_bytes = io.BytesIO()
-        image_blob.save(img_bytes, format="PNG")
-        img_bytes = img_bytes.getvalue()
-        vertex_image = Image(image_bytes=img_bytes)
-
-        embeddings = image_embedding_model.get_embeddings(
-            image=vertex_image,
-            contextual_text=text_content,
-            dimension=embedding_dimension,
-        )
-
+        embeddings = get_embedding_service(embedding_dimension).embed_images([image_blob], [text_content])[0]
         print("Got the embeddings")
-
-        return {"Image Embedding": embeddings.image_embedding, "Text Embedding": embeddings.text_embedding}
+        return embeddings
 
     except Exception as e:
         print("Encountered Exception while embedding image!!")
@@ -127,16 +77,11 @@ def get_image_embeddings(image_blob, text_content):
     return None
 
 def get_text_embeddings(text_content):
-    global text_embedding_model
-    
-    if text_embedding_model is None:
-        initialize_text_embedding_model()
-
     try:
-        text_embeddings = text_embedding_model.get_embeddings(texts=list(text_content), output_dimensionality=512)
+        text_embeddings = get_embedding_service(embedding_dimension).embed_texts([text_content])
         print("Got the text Embeddings!")
-        return text_embeddings[0].values
+        return text_embeddings[0]
     except Exception as e:
         print("Encountered Exception while embedding text!!")
         print(e)
-    return None
\ No newline at end of file
+    return None
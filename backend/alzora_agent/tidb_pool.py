@@ -0,0 +1,174 @@
+import os
+import random
+import threading
+import time
+from functools import lru_cache
+
+from pytidb import TiDBClient
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+TIDB_POOL_SIZE = int(os.getenv("TIDB_POOL_SIZE", "5"))
+TIDB_POOL_MAX_OVERFLOW = int(os.getenv("TIDB_POOL_MAX_OVERFLOW", "0"))
+TIDB_POOL_TIMEOUT_SECONDS = float(os.getenv("TIDB_POOL_TIMEOUT_SECONDS", "10"))
+TIDB_POOL_RECYCLE_SECONDS = int(os.getenv("TIDB_POOL_RECYCLE_SECONDS", "300"))
+TIDB_QUERY_RETRIES = int(os.getenv("TIDB_QUERY_RETRIES", "3"))
+TIDB_RETRY_BACKOFF_SECONDS = float(os.getenv("TIDB_RETRY_BACKOFF_SECONDS", "0.2"))
+TIDB_SLOW_QUERY_SECONDS = float(os.getenv("TIDB_SLOW_QUERY_SECONDS", "1.0"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+
+# MySQL / TiDB error codes worth retrying: dropped connections, lock and
+# write conflicts, and TiKV/PD hiccups. Everything else (syntax errors,
+# missing tables, constraint violations) is raised immediately.
+TRANSIENT_ERROR_CODES = {
+    1040,  # too many connections
+    1205,  # lock wait timeout
+    1213,  # deadlock
+    2003,  # can't connect
+    2006,  # server has gone away
+    2013,  # lost connection during query
+    2055,  # lost connection
+    8022,  # transaction retry
+    8028,  # information schema changed
+    9001,  # PD server timeout
+    9002,  # TiKV server timeout
+    9005,  # region unavailable
+    9007,  # write conflict
+}
+
+
+def is_transient_error(error):
+    if isinstance(error, DisconnectionError):
+        return True
+    if isinstance(error, DBAPIError):
+        if error.connection_invalidated:
+            return True
+        args = getattr(error.orig, "args", ())
+        if args and isinstance(args[0], int):
+            return args[0] in TRANSIENT_ERROR_CODES
+    return False
+
+
+@lru_cache(maxsize=256)
+def prepared_statement(sql):
+    """Parsed text() construct for a SQL string with :named parameters, reused across calls."""
+    return text(sql)
+
+
+class QueryMetrics:
+    """Per-label call counts, errors, retries and timings."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, label, seconds, error=False, retries=0):
+        with self._lock:
+            stats = self._stats.setdefault(label, {"count": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["retries"] += retries
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                label: dict(stats, avg_seconds=stats["total_seconds"] / stats["count"])
+                for label, stats in self._stats.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class TiDBPool:
+    """
+    Bounded, health-checked access to TiDB shared by all agent tools.
+
+    Wraps one TiDBClient whose SQLAlchemy engine holds at most
+    `pool_size + max_overflow` connections; connections are pinged on checkout
+    and recycled periodically so a dropped connection never reaches a tool.
+    Reads are retried with exponential backoff on transient errors only.
+    Any SQLAlchemy URL works, e.g. `sqlite:///local.db` for a local stand-in.
+    """
+
+    def __init__(
+        self,
+        url,
+        pool_size=TIDB_POOL_SIZE,
+        max_overflow=TIDB_POOL_MAX_OVERFLOW,
+        pool_timeout=TIDB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=TIDB_POOL_RECYCLE_SECONDS,
+        retries=TIDB_QUERY_RETRIES,
+        backoff_seconds=TIDB_RETRY_BACKOFF_SECONDS,
+        connect=TiDBClient.connect,
+    ):
+        engine_options = {"pool_pre_ping": True}
+        if url.startswith("mysql"):
+            engine_options.update(
+                pool_size=pool_size,
+                max_overflow=max_overflow,
+                pool_timeout=pool_timeout,
+                pool_recycle=pool_recycle,
+            )
+        self.client = connect(url, **engine_options)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.metrics = QueryMetrics()
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+
+    def run(self, operation, label):
+        """Run `operation()` with retry on transient errors, recording timing under `label`."""
+        attempt = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                result = operation()
+            except Exception as e:
+                if attempt >= self.retries or not is_transient_error(e):
+                    self.metrics.record(label, time.perf_counter() - start, error=True, retries=attempt)
+                    raise
+                delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random())
+                attempt += 1
+                print(f"Transient TiDB error on '{label}', retrying in {delay:.2f}s ({attempt}/{self.retries}): {e}")
+                time.sleep(delay)
+                continue
+
+            elapsed = time.perf_counter() - start
+            self.metrics.record(label, elapsed, retries=attempt)
+            if elapsed > TIDB_SLOW_QUERY_SECONDS:
+                print(f"Slow TiDB query '{label}' took {elapsed:.2f}s")
+            return result
+
+    def query(self, sql, params=None, label=None):
+        statement = prepared_statement(sql)
+        return self.run(lambda: self.client.query(statement, params), label or " ".join(sql.split())[:80])
+
+    def open_table(self, table_name):
+        table = self._tables.get(table_name)
+        if table is None:
+            with self._tables_lock:
+                table = self._tables.get(table_name)
+                if table is None:
+                    table = self.run(lambda: self.client.open_table(table_name), f"open_table {table_name}")
+                    if table is None:
+                        raise ValueError(f"No table model registered for '{table_name}'")
+                    self._tables[table_name] = table
+        return table
+
+    def health_check(self):
+        try:
+            self.client.query(prepared_statement("SELECT 1")).scalar()
+            return True
+        except Exception as e:
+            print("TiDB health check failed:", e)
+            return False
+
+    def close(self):
+        self.client.disconnect()
@@ -1,13 +1,16 @@
 from .setup import *
+from .patient_cache import patient_cache
 from google.adk.tools import ToolContext
 
 
 def set_patient_information(tool_context: ToolContext, patient_id: str):
 
-    patient_info = get_bigquery_data(f'''SELECT * from `alzora_datawarehouse.patients` WHERE patient_id={patient_id}''')
+    # The webapp stores the caretaker (or the patient themselves) who opened the chat in the session state
+    caretaker_id = str(tool_context.state.get("caretaker_id", ""))
+    caretaker_id = int(caretaker_id) if caretaker_id.isdigit() else None
 
-    patient_info = dict(list(patient_info)[0])
+    patient_info = patient_cache.get(patient_id, caretaker_id=caretaker_id)
 
-    tool_context.state["patient_information"] = patient_info
+    tool_context.state["patient_information"] = dict(patient_info)
 
-    return True
\ No newline at end of file
+    return True
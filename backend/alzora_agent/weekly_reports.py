@@ -0,0 +1,168 @@
+"""
+Weekly reports for every patient in one run.
+
+The week's daily vitals of all patients are read with one query on the
+day-partitioned rollup table, charts and PDFs are built on a process pool,
+caretaker emails are resolved with one query and every report is handed to
+the shared mail service, which sends over a few pooled SMTP connections. The
+narrative is the data-only text from report_pdf.default_narrative; the agent is
+not involved.
+
+    python -m alzora_agent.weekly_reports
+    python -m alzora_agent.weekly_reports --dry-run --out-dir reports/
+    python -m alzora_agent.weekly_reports --smtp-host localhost --smtp-port 1025 --smtp-mode plain
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .agents.report_generation_agent.tools import REPORT_WINDOW_DAYS, build_report_message, get_caretaker_emails
+from .mail_delivery import MAIL_SMTP_HOST, MAIL_SMTP_MODE, MAIL_SMTP_PASSWORD, MAIL_SMTP_PORT, MailService, SMTPConnectionPool, get_mail_service
+from .report_charts import ChartRenderer, get_chart_renderer, set_chart_renderer, weekly_series
+from .report_pdf import render_weekly_report, report_file_name
+from .setup import VITALS_DAILY_ROLLUP_TABLE, get_bigquery_data
+
+
+# ── CONFIG ────────────────────────────────────────────────────────────────
+REPORT_BATCH_WORKERS = int(os.getenv("REPORT_BATCH_WORKERS", str(os.cpu_count() or 1)))
+# How long the run waits for the outbox to drain; the rest is sent by the next process using it
+REPORT_MAIL_FLUSH_SECONDS = float(os.getenv("REPORT_MAIL_FLUSH_SECONDS", "600"))
+# ── END CONFIG ────────────────────────────────────────────────────────────
+
+PATIENT_COLUMNS = ("patient_id", "first_name", "last_name", "age", "gender", "safe_radius_meters")
+
+
+def load_weekly_vitals(days=REPORT_WINDOW_DAYS, patient_ids=None):
+    """
+    {patient_id: [daily rollup rows]} for the last `days` days.
+    The filter is on the partition column alone, so only those day partitions are scanned.
+    """
+    patient_filter = ""
+    if patient_ids:
+        patient_filter = f"AND `patient_id` IN ({', '.join(str(int(p)) for p in patient_ids)})"
+    rows = get_bigquery_data(f"""
+    SELECT
+        `patient_id`,
+        `day`,
+        `avg_heart_rate`,
+        `avg_step_count`,
+        `avg_spO2_level`,
+        `total_fall_flag`
+    FROM
+        `{VITALS_DAILY_ROLLUP_TABLE}`
+    WHERE
+        `day` > DATE_SUB(CURRENT_DATE(), INTERVAL {int(days)} DAY)
+        {patient_filter}
+    ORDER BY
+        `patient_id`, `day`
+    """)
+    vitals = {}
+    for row in rows:
+        row = dict(row.items())
+        vitals.setdefault(row["patient_id"], []).append(row)
+    return vitals
+
+
+def load_patients(patient_ids):
+    rows = get_bigquery_data(f"""
+    SELECT {', '.join(PATIENT_COLUMNS)}
+    FROM `alzora_datawarehouse.patients`
+    WHERE patient_id IN ({', '.join(str(int(p)) for p in patient_ids)})
+    """)
+    return {row.patient_id: dict(row.items()) for row in rows}
+
+
+def _init_worker():
+    # Each worker already is one of a pool of processes; render its charts inline
+    set_chart_renderer(ChartRenderer(workers=0))
+
+
+def render_patient_report(job):
+    """(patient_info, vitals rows) -> (patient_id, report file name, PDF bytes)"""
+    patient_info, rows = job
+    days, series = weekly_series(rows)
+    charts = get_chart_renderer().render_weekly(patient_info["patient_id"], days, series)
+    pdf_bytes = render_weekly_report(patient_info, days, series, charts, narrative=None)
+    return patient_info["patient_id"], report_file_name(patient_info, days), pdf_bytes
+
+
+def run(days=REPORT_WINDOW_DAYS, patient_ids=None, workers=REPORT_BATCH_WORKERS, dry_run=False, out_dir=None, mail_service=None):
+    started = time.perf_counter()
+    vitals = load_weekly_vitals(days, patient_ids)
+    if not vitals:
+        print("No vitals recorded in the window, nothing to report")
+        return {"reports": 0, "queued": 0, "skipped": 0}
+
+    patients = load_patients(vitals)
+    if not patients:
+        print(f"None of the {len(vitals)} patients with vitals are in the warehouse, nothing to report")
+        return {"reports": 0, "queued": 0, "skipped": 0}
+    emails = get_caretaker_emails(patients)
+    jobs = [(patients[patient_id], rows) for patient_id, rows in vitals.items() if patient_id in patients]
+    print(f"Loaded {sum(map(len, vitals.values()))} vitals rows for {len(jobs)} patients in {time.perf_counter() - started:.1f}s")
+
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    mail_service = None if dry_run else (mail_service or get_mail_service())
+    counts = {"reports": 0, "queued": 0, "skipped": 0}
+    message_ids = []
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) if workers > 0 else None
+    try:
+        results = pool.map(render_patient_report, jobs, chunksize=4) if pool else map(render_patient_report, jobs)
+        # Reports are mailed as they come off the pool, while the rest are still rendering
+        for patient_id, report_name, pdf_bytes in results:
+            counts["reports"] += 1
+            if out_dir:
+                with open(os.path.join(out_dir, report_name), "wb") as f:
+                    f.write(pdf_bytes)
+            caretaker_emails = emails.get(patient_id, [])
+            if not caretaker_emails:
+                print(f"No caretakers found for patient id: {patient_id}, skipping {report_name}")
+                counts["skipped"] += 1
+                continue
+            if dry_run:
+                print(f"[dry-run] {report_name} -> {', '.join(caretaker_emails)}")
+                continue
+            message_ids.append(mail_service.send(build_report_message(patients[patient_id], caretaker_emails, report_name, pdf_bytes), kind="weekly_report"))
+            counts["queued"] += 1
+    finally:
+        if pool:
+            pool.shutdown()
+
+    print(f"{counts['reports']} reports, {counts['queued']} queued, {counts['skipped']} without caretakers in {time.perf_counter() - started:.1f}s")
+    if mail_service:
+        # Only this run's reports: the outbox is shared with the alert mail
+        if not mail_service.flush(REPORT_MAIL_FLUSH_SECONDS, message_ids=message_ids):
+            print(f"Outbox not drained after {REPORT_MAIL_FLUSH_SECONDS:.0f}s, the remaining reports stay queued")
+        counts["mail"] = mail_service.metrics()
+        print("Mail delivery:", counts["mail"])
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=REPORT_WINDOW_DAYS)
+    parser.add_argument("--patients", type=int, nargs="+", help="only these patient ids")
+    parser.add_argument("--workers", type=int, default=REPORT_BATCH_WORKERS, help="report processes, 0 renders inline")
+    parser.add_argument("--dry-run", action="store_true", help="build the reports but don't send them")
+    parser.add_argument("--out-dir", help="also write every PDF to this directory")
+    parser.add_argument("--smtp-host", default=MAIL_SMTP_HOST)
+    parser.add_argument("--smtp-port", type=int, default=MAIL_SMTP_PORT)
+    parser.add_argument("--smtp-mode", choices=["ssl", "plain"], default=MAIL_SMTP_MODE)
+    args = parser.parse_args()
+
+    mail_service = None
+    if not args.dry_run:
+        # A local stand-in server takes mail without logging in
+        pool = SMTPConnectionPool(args.smtp_host, args.smtp_port, args.smtp_mode, password=MAIL_SMTP_PASSWORD if args.smtp_mode == "ssl" else None)
+        mail_service = MailService(pool=pool)
+    try:
+        run(args.days, args.patients, args.workers, args.dry_run, args.out_dir, mail_service)
+    finally:
+        if mail_service:
+            mail_service.close()
+
+
+if __name__ == "__main__":
+    main()
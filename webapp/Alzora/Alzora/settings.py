@@ -117,6 +117,30 @@ if TIDB_CA_PATH:
 AUTH_USER_MODEL = "alzoraapp.CustomUser"
 
 
+# Daily vitals rollup maintained by dbt (alzora_dbt/models/vitals_rollup)
+VITALS_DAILY_ROLLUP_TABLE = os.environ.get("VITALS_DAILY_ROLLUP_TABLE", "Alzora_Embeddings_Dataset_alzora_vitals_rollup.daily_vitals_rollup")
+CHART_DATA_WINDOW_DAYS = int(os.environ.get("CHART_DATA_WINDOW_DAYS", "7"))
+CHART_DATA_CACHE_TTL_SECONDS = int(os.environ.get("CHART_DATA_CACHE_TTL_SECONDS", "900"))
+# How long the rollup's rolled_up_at watermark is trusted before it is queried again
+CHART_DATA_WATERMARK_TTL_SECONDS = int(os.environ.get("CHART_DATA_WATERMARK_TTL_SECONDS", "60"))
+# Shared secret for POST /chartdata/<patient_id>/invalidate, the endpoint is disabled when unset
+CHART_DATA_INVALIDATION_TOKEN = os.environ.get("CHART_DATA_INVALIDATION_TOKEN", "")
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The default local-memory cache is per process; point these at a shared backend
+# (e.g. django.core.cache.backends.db.DatabaseCache or RedisCache) so invalidations
+# reach every gunicorn worker.
+
+CACHES = {
+    "default": {
+        "BACKEND": os.environ.get("DJANGO_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("DJANGO_CACHE_LOCATION", "alzora"),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -30,4 +30,5 @@ urlpatterns = [
     path('patientinfo/<str:patient_id>', patientInfo, name="patientInfo"),
     path('updatepatientinfo/', updatePatientInfo, name="updatePatientInfo"),
     path('chartdata/<str:patient_id>', chartData, name="chartData"),
+    path('chartdata/<str:patient_id>/invalidate', invalidateChartData, name="invalidateChartData"),
 ]
\ No newline at end of file
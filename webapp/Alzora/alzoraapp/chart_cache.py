@@ -0,0 +1,52 @@
+import hashlib
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+# The chart payload of a patient is cached under its data watermark, the newest
+# rolled_up_at of the patient's rollup rows in the chart window. Every dbt run
+# that rebuilds those rows moves it, so a payload is never served past the
+# rollup that replaced its data. The watermark itself is re-read at most every
+# CHART_DATA_WATERMARK_TTL_SECONDS; invalidate_chart_data forces a re-read.
+
+
+def _watermark_key(patient_id):
+    return f"chartdata:watermark:{patient_id}"
+
+
+def get_data_watermark(patient_id, load_watermark):
+    watermark = cache.get(_watermark_key(patient_id))
+    if watermark is None:
+        watermark = str(load_watermark(patient_id))
+        cache.set(_watermark_key(patient_id), watermark, settings.CHART_DATA_WATERMARK_TTL_SECONDS)
+    return watermark
+
+
+def invalidate_chart_data(patient_id):
+    cache.delete(_watermark_key(patient_id))
+
+
+def get_chart_data(patient_id, build_chart_data, load_watermark):
+    """
+    Return (json_body, etag) for the patient's dashboard charts, calling
+    `build_chart_data(patient_id)` only when nothing is cached for the current
+    day and the data watermark returned by `load_watermark(patient_id)`.
+    """
+    # The chart window slides with the calendar day, so the day is part of the key too
+    key = f"chartdata:{patient_id}:{date.today().isoformat()}:{get_data_watermark(patient_id, load_watermark)}"
+    entry = cache.get(key)
+    if entry is None:
+        body = json.dumps(build_chart_data(patient_id), cls=DjangoJSONEncoder)
+        etag = '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+        entry = (body, etag)
+        cache.set(key, entry, settings.CHART_DATA_CACHE_TTL_SECONDS)
+    return entry
+
+
+def etag_matches(request, etag):
+    if_none_match = request.headers.get("If-None-Match", "")
+    return any(tag.strip() in (etag, "W/" + etag, "*") for tag in if_none_match.split(","))
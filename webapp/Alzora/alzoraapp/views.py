@@ -1,10 +1,15 @@
 from django.shortcuts import render
 from django.contrib.auth import authenticate
-from django.http import HttpResponseRedirect, JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotModified, HttpResponseRedirect, JsonResponse
 from django.urls import reverse
 from django.contrib import auth
 from django.contrib import messages
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .models import *
+from .chart_cache import etag_matches, get_chart_data, invalidate_chart_data
 from google.cloud import bigquery
 
 
@@ -202,24 +207,22 @@ def updatePatientInfo(request):
     return HttpResponseRedirect(reverse("addPatient"))
 
 
-def chartData(request, patient_id):
+def build_chart_data(patient_id):
 
     query_job = bigquery_client.query(f'''
         SELECT
-            DATE(`timestamp`) AS `day`,
-            ROUND(AVG(`value_heart_rate`),2) AS `avg_heart_rate`,
-            ROUND(AVG(`value_step_count`),2) AS `avg_step_count`,
-            ROUND(AVG(`value_sp_o_2`),2) AS `avg_spO2_level`,
-            ROUND(SUM(CAST(value_fall_flag AS INT64)), 2) AS total_fall_flag
+            `day`,
+            `avg_heart_rate`,
+            `avg_step_count`,
+            `avg_spO2_level`,
+            `total_fall_flag`
         FROM
-            `patients_vitals.patient_vitals`
+            `{settings.VITALS_DAILY_ROLLUP_TABLE}`
         WHERE
-            `value_patient_id` = {patient_id}
-        GROUP BY
-            `day`
+            `patient_id` = {int(patient_id)}
+            AND `day` > DATE_SUB(CURRENT_DATE(), INTERVAL {settings.CHART_DATA_WINDOW_DAYS} DAY)
         ORDER BY
             `day`
-        LIMIT 7
     ''')
     data_collection = query_job.result()
 
@@ -227,12 +230,13 @@ def chartData(request, patient_id):
     data_collection = data_collection.sort_values("day")
 
     # Labels = days
-    labels = data_collection["day"]
+    labels = [str(day) for day in data_collection["day"]]
 
-    heart_rate = data_collection["avg_heart_rate"]
-    spO2_level = data_collection["avg_spO2_level"]
-    step_count = data_collection["avg_step_count"]
-    fall_events = data_collection["total_fall_flag"]
+    heart_rate = data_collection["avg_heart_rate"].fillna(0).astype(float).tolist()
+    spO2_level = data_collection["avg_spO2_level"].fillna(0).astype(float).tolist()
+    step_count = data_collection["avg_step_count"].fillna(0).astype(float).tolist()
+    fall_events = data_collection["total_fall_flag"].fillna(0).astype(float).tolist()
+    max_heart_rate = max(heart_rate, default=0)
 
     data = {
         "labels": labels,
@@ -283,7 +287,8 @@ def chartData(request, patient_id):
             "datasets": [{
                 "label": "SpO2 Levels vs Miles vs HR",
                 "data": [
-                    {"x": m, "y": s, "r": (c / step_count) * 20}  # max bubble = 20px
+                    # Heart rate relative to the window's highest, max bubble = 20px
+                    {"x": m, "y": s, "r": (c / max_heart_rate) * 20 if max_heart_rate else 0}
                     for m, s, c in zip(step_count, spO2_level, heart_rate)
                 ],
                 "backgroundColor": '#4b6eb8',
@@ -291,4 +296,46 @@ def chartData(request, patient_id):
         }
     }
 
-    return JsonResponse(data)
\ No newline at end of file
+    return data
+
+
+def load_chart_data_watermark(patient_id):
+    # Clustered on patient_id and pruned to the window's partitions, so this reads next to nothing
+    query_job = bigquery_client.query(f'''
+        SELECT
+            MAX(`rolled_up_at`) AS `rolled_up_at`,
+            COUNT(*) AS `days`
+        FROM
+            `{settings.VITALS_DAILY_ROLLUP_TABLE}`
+        WHERE
+            `patient_id` = {int(patient_id)}
+            AND `day` > DATE_SUB(CURRENT_DATE(), INTERVAL {settings.CHART_DATA_WINDOW_DAYS} DAY)
+    ''')
+    row = next(iter(query_job.result()))
+    return f"{row.rolled_up_at}:{row.days}"
+
+
+def chartData(request, patient_id):
+    body, etag = get_chart_data(patient_id, build_chart_data, load_chart_data_watermark)
+
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+
+    response["ETag"] = etag
+    # Let the browser keep the payload but revalidate it on every dashboard load
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@csrf_exempt
+@require_POST
+def invalidateChartData(request, patient_id):
+    # Optional: lets a pipeline that just rebuilt the rollup skip the watermark TTL
+    token = settings.CHART_DATA_INVALIDATION_TOKEN
+    if not token or not constant_time_compare(request.headers.get("X-Alzora-Token", ""), token):
+        return HttpResponseForbidden()
+
+    invalidate_chart_data(patient_id)
+    return JsonResponse({"patient_id": patient_id, "invalidated": True})
\ No newline at end of file